@@ -26,10 +26,10 @@ import math
 import argparse
 import utils
 from utils import load_pretrained_model
-from datasets.RAF import RAF_multi_teacher
-from datasets.PET import PET_multi_teacher
-from datasets.colorferet import colorferet_multi_teacher
-from datasets.FairFace import FairFace_multi_teacher
+from datasets import store, stats
+from datasets.generic import StoreDataset
+from datasets import augment
+from datasets import eval_cache
 from torch.autograd import Variable
 from network.teacherNet import Teacher
 from tensorboardX import SummaryWriter
@@ -52,6 +52,8 @@ parser.add_argument('--cuda', type=int, default=1)
 parser.add_argument('--seed', type=int, default=2, help='random seed')
 parser.add_argument('--number_teacher', default=4, type=int, help='Batch size')
 parser.add_argument('--root', type=str, default='results/colorferet_MultiTeacher_Average', help='models and logs are saved here')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
 
 args, unparsed = parser.parse_known_args()
 
@@ -67,12 +69,7 @@ else:
 best_acc = 0
 best_mAP = 0
 best_F1 = 0
-if args.data_name == 'colorferet':
-    NUM_CLASSES = 994
-elif args.data_name == 'PET':
-    NUM_CLASSES = 37
-else:
-    NUM_CLASSES = 7
+NUM_CLASSES = store.num_classes(args.data_name)
 
 print ('The dataset used for training is:   '+ str(args.data_name))
 print ('The path of the multi-teacher model is :   '+ str(args.root))
@@ -109,44 +106,24 @@ print ('best_Teacher_Avg_F1 is '+ str(tcheckpoint['test_Avg_F1']))
 
 criterion = torch.nn.CrossEntropyLoss().cuda()
 
-if args.data_name == 'RAF':
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.589667, 0.45717254, 0.40727714], std=[0.25235596, 0.23242524, 0.23155019])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'PET':
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.486185, 0.45276144, 0.39575183], std=[0.2640792, 0.25989106, 0.26799843])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'FairFace':
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49167913, 0.36098105, 0.30529523], std=[0.24649838, 0.21503104, 0.20875944])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'colorferet':
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49930117, 0.43744352, 0.37612754], std=[0.22151423, 0.24302939, 0.2520711])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-else:
-    raise Exception('Invalid ...')
-
-if args.data_name == 'RAF':
-    PrivateTestset = RAF_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'PET':
-    PrivateTestset = PET_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'FairFace':
-    PrivateTestset = FairFace_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'colorferet':
-    PrivateTestset = colorferet_multi_teacher(split = 'PrivateTest', transform=transform_test)
-else:
-    raise Exception('Invalid dataset name...')
+test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher_test'))
+transform_test = transforms.Compose([
+    transforms.TenCrop(92),
+    transforms.Lambda(lambda crops: torch.stack([test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),])
+
+if args.batch_tencrop:
+    # the loader ships raw uint8 pixels, test() crops and normalizes the whole batch
+    batch_tencrop = augment.TenCropNormalize(92, test_Normalize.mean, test_Normalize.std)
+    transform_test = None
+
+PrivateTestset = StoreDataset(args.data_name, split = 'PrivateTest', transform=transform_test)
 PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=1)
+if args.eval_cache:
+    # the TenCrop tensors are built once per (dataset, crop, normalization) and only streamed afterwards
+    args.batch_tencrop = 0
+    cache_path = eval_cache.build(args.data_name, 92, test_Normalize.mean, test_Normalize.std,
+                                  dtype=args.eval_cache, num_workers=1)
+    PrivateTestloader = eval_cache.CachedTestLoader(cache_path, batch_size=args.test_bs)
 criterion = nn.CrossEntropyLoss()
 
 def test(epoch):
@@ -176,6 +153,8 @@ def test(epoch):
 
     for batch_idx, (inputs, targets) in enumerate(PrivateTestloader):
         t = time.time()
+        if args.batch_tencrop:
+            inputs = batch_tencrop(inputs.cuda(non_blocking=True))
         test_bs, ncrops, c, h, w = np.shape(inputs)
         inputs = inputs.view(-1, c, h, w)
         inputs, targets = inputs.cuda(), targets.cuda()
@@ -0,0 +1,42 @@
+'''Convert the *_data_100.h5 files into memory-mapped image stores.'''
+from __future__ import print_function
+
+import argparse
+from datasets import store
+from datasets import corrupt
+from datasets import packed
+
+parser = argparse.ArgumentParser(description='Build memory-mapped image stores')
+parser.add_argument('--data_name', type=str, default='RAF,FairFace,colorferet,PET', help='RAF,FairFace,colorferet,PET')
+parser.add_argument('--root', type=str, default='datasets', help='directory holding the h5 files')
+parser.add_argument('--convert', type=int, default=1, help='(re)convert the h5 file, 0 keeps an existing store')
+parser.add_argument('--pyramid', type=str, default='', help='resize levels to precompute, e.g. 48,36,28,20,12')
+parser.add_argument('--pyramid_train', type=int, default=0, help='also precompute the levels of the training split')
+parser.add_argument('--corrupt', type=str, default='', help='noise types to materialize for the test split, e.g. GaussianBlur,MedianBlur or all')
+parser.add_argument('--severity', type=str, default='1,2,3,4,5', help='severities of the corrupted test splits')
+parser.add_argument('--pack', type=str, default='', help='write compressed chunks with this codec: zstd, lz4, blosc, zlib or auto')
+parser.add_argument('--chunk_size', type=int, default=256, help='images per compressed chunk')
+parser.add_argument('--num_threads', type=int, default=8, help='threads of the corruption engine')
+parser.add_argument('--num_workers', type=int, default=8, help='processes resizing the pyramid levels')
+args = parser.parse_args()
+
+for data_name in args.data_name.split(','):
+    if args.convert or not store.has_store(data_name, root=args.root):
+        print('==> Converting ' + data_name + '..')
+        store.convert_h5(data_name, root=args.root)
+    if args.pyramid:
+        sizes = [int(size) for size in args.pyramid.split(',')]
+        print('==> Building the resize pyramid of ' + data_name + '..')
+        store.build_pyramid(data_name, 'PrivateTest', sizes, num_workers=args.num_workers, root=args.root)
+        if args.pyramid_train:
+            store.build_pyramid(data_name, 'Training', sizes, num_workers=args.num_workers, root=args.root)
+    if args.corrupt:
+        noises = corrupt.NOISE_TYPES if args.corrupt == 'all' else args.corrupt.split(',')
+        severities = [int(severity) for severity in args.severity.split(',')]
+        print('==> Corrupting the test split of ' + data_name + '..')
+        corrupt.materialize(data_name, noises, severities, num_threads=args.num_threads, root=args.root)
+    if args.pack:
+        print('==> Packing ' + data_name + '..')
+        for split in ('Training', 'PrivateTest'):
+            packed.pack(data_name, split, chunk_size=args.chunk_size, codec=None if args.pack == 'auto' else args.pack,
+                        root=args.root)
@@ -0,0 +1,159 @@
+''' Batched tensor augmentation'''
+
+from __future__ import print_function
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.utils.data as data
+
+
+# Resize applied to the 100x100 test images before TenCrop(S_size) on the student side
+TEST_RESIZE = {44: 48, 32: 36, 24: 28, 16: 20, 8: 12}
+
+
+def empty(shape, dtype, device=None):
+    """Output tensor of a batch, in shared memory inside DataLoader workers so it is sent back without a copy."""
+    out = torch.empty(shape, dtype=dtype, device=device)
+    if out.device.type == 'cpu' and data.get_worker_info() is not None:
+        out.share_memory_()
+    return out
+
+
+def to_float(imgs):
+    """uint8 (N, H, W, C) batch -> float (N, C, H, W) in [0, 1], i.e. ``ToTensor`` on every image."""
+    return imgs.permute(0, 3, 1, 2).float().div_(255)
+
+
+def normalize(imgs, mean, std):
+    mean = torch.as_tensor(mean, dtype=imgs.dtype, device=imgs.device).view(-1, 1, 1)
+    std = torch.as_tensor(std, dtype=imgs.dtype, device=imgs.device).view(-1, 1, 1)
+    return (imgs - mean) / std
+
+
+def to_normalized(imgs, mean, std):
+    """``normalize(imgs / 255, mean, std)`` of a uint8 (..., C, H, W) batch as a single multiply-subtract."""
+    scale = torch.tensor([1. / (255. * s) for s in std], device=imgs.device).view(-1, 1, 1)
+    shift = torch.tensor([m / s for m, s in zip(mean, std)], device=imgs.device).view(-1, 1, 1)
+    out = empty(imgs.shape, torch.float32, imgs.device)
+    torch.mul(imgs, scale, out=out)
+    return out.sub_(shift)
+
+
+def resize(imgs, size):
+    """Antialiased bilinear resize of a float (N, C, H, W) batch of square images, like PIL ``Resize(size)``."""
+    if imgs.shape[-1] == size and imgs.shape[-2] == size:
+        return imgs
+    return F.interpolate(imgs, size=(size, size), mode='bilinear', align_corners=False, antialias=True)
+
+
+def sample_crop_flip(n, height, width, size, device=None):
+    """Draw ``RandomCrop(size)`` offsets and ``RandomHorizontalFlip`` decisions for ``n`` images."""
+    top = torch.randint(0, height - size + 1, (n,), device=device)
+    left = torch.randint(0, width - size + 1, (n,), device=device)
+    flip = torch.rand(n, device=device) < 0.5
+    return top, left, flip
+
+
+def crop_flip(imgs, top, left, flip, size):
+    """Crop every image of a (N, H, W, C) batch at its own offset, mirroring where ``flip`` is set.
+
+    On the device all crops come out of a single gather, so there is no per-image Python work;
+    on the CPU one strided copy per image is several times faster than that gather.
+    """
+    if imgs.device.type == 'cpu':
+        src = imgs.numpy()
+        out = empty((imgs.shape[0], size, size) + tuple(imgs.shape[3:]), imgs.dtype)
+        dst = out.numpy()
+        for i, (t, l, f) in enumerate(zip(top.tolist(), left.tolist(), flip.tolist())):
+            crop = src[i, t:t + size, l:l + size]
+            dst[i] = crop[:, ::-1] if f else crop
+        return out
+    steps = torch.arange(size, device=imgs.device)
+    rows = top.to(imgs.device)[:, None] + steps
+    cols = left.to(imgs.device)[:, None] + steps
+    cols = torch.where(flip.to(imgs.device)[:, None], cols.flip(1), cols)
+    batch = torch.arange(imgs.shape[0], device=imgs.device)[:, None, None]
+    return imgs[batch, rows[:, :, None], cols[:, None, :]]
+
+
+def random_crop_flip(imgs, size):
+    n, h, w, _ = imgs.shape
+    top, left, flip = sample_crop_flip(n, h, w, size, device=imgs.device)
+    return crop_flip(imgs, top, left, flip, size)
+
+
+class CropFlipNormalize(object):
+    """Batched ``RandomCrop(size)`` + ``RandomHorizontalFlip`` + ``ToTensor`` + ``Normalize`` of the
+    teacher training view, on a uint8 (N, H, W, C) batch."""
+    def __init__(self, size, mean, std):
+        self.size = size
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, imgs):
+        return to_normalized(random_crop_flip(imgs, self.size).permute(0, 3, 1, 2), self.mean, self.std)
+
+
+class TeacherStudentAugment(object):
+    """Batched version of the dual-view training pipeline.
+
+    Replaces ``RandomCrop(92)`` + ``RandomHorizontalFlip`` followed by ``teacher_norm`` and
+    ``student_norm`` (``Resize(S_size)``, ``ToTensor``, ``Normalize``) for every sample.
+    Takes the raw uint8 (N, 100, 100, 3) batch a dual-view dataset yields when it is built
+    with ``transform=None`` and returns ``(img_teacher, img_student)``. Runs on whatever
+    device the batch lives on.
+    """
+    def __init__(self, teacher_mean, teacher_std, student_mean, student_std, S_size=44, crop_size=92):
+        self.teacher_mean = teacher_mean
+        self.teacher_std = teacher_std
+        self.student_mean = student_mean
+        self.student_std = student_std
+        self.S_size = S_size
+        self.crop_size = crop_size
+
+    def student(self, crops):
+        """Student view of uint8 (N, H, W, C) crops, e.g. the recorded ones of ``datasets.teacher_cache``."""
+        return normalize(resize(crops.permute(0, 3, 1, 2).float().div_(255), self.S_size), self.student_mean, self.student_std)
+
+    def __call__(self, imgs):
+        imgs = random_crop_flip(imgs, self.crop_size)
+        img_student = self.student(imgs)
+        img_teacher = to_normalized(imgs.permute(0, 3, 1, 2), self.teacher_mean, self.teacher_std)
+        return img_teacher, img_student
+
+
+def ten_crop(imgs, size):
+    """``TenCrop(size)`` on a (..., C, H, W) batch -> (N, 10, C, size, size), in torchvision's order.
+
+    The five windows are plain strided views; the mirrored five are the same windows taken
+    from the horizontally flipped image, so only they need a flip before the single stack.
+    """
+    h, w = imgs.shape[-2:]
+    center_top = int(round((h - size) / 2.))
+    center_left = int(round((w - size) / 2.))
+    boxes = [(0, 0), (0, w - size), (h - size, 0), (h - size, w - size), (center_top, center_left)]
+    crops = [imgs[..., t:t + size, l:l + size] for t, l in boxes]
+    crops += [imgs[..., t:t + size, w - l - size:w - l].flip(-1) for t, l in boxes]
+    return torch.stack(crops, 1)
+
+
+class TenCropNormalize(object):
+    """Batched replacement for ``TenCrop`` + the per-crop ``ToTensor``/``Normalize`` Lambda.
+
+    Takes the raw uint8 (N, H, W, C) batch of a dataset built with ``transform=None`` and
+    returns (N, 10, C, size, size), so ``view(-1, c, h, w)`` keeps working. ``resize`` is the
+    optional antialiased pre-resize of the student test path (``Resize(48)`` and friends).
+    """
+    def __init__(self, size, mean, std, resize=None):
+        self.size = size
+        self.mean = mean
+        self.std = std
+        self.resize = resize
+
+    def __call__(self, imgs):
+        imgs = imgs.permute(0, 3, 1, 2)
+        if self.resize is not None:
+            imgs = resize(imgs.float().div_(255), self.resize)
+            # the resize of the permuted batch comes out channels-last, the callers view() the result
+            return normalize(ten_crop(imgs, self.size), self.mean, self.std).contiguous()
+        return to_normalized(ten_crop(imgs, self.size), self.mean, self.std)
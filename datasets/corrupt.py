@@ -0,0 +1,118 @@
+''' Image corruptions of the --noise robustness experiments'''
+
+from __future__ import print_function
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from datasets import store
+
+
+NOISE_TYPES = ('GaussianBlur', 'AverageBlur', 'MedianBlur', 'BilateralFilter', 'Salt-and-pepper')
+SEVERITIES = (1, 2, 3, 4, 5)
+
+# per-severity parameters: kernel sizes, (diameter, sigma) of the bilateral filter, corrupted fraction
+NOISE_PARAMS = {
+    'GaussianBlur': (3, 5, 7, 9, 11),
+    'AverageBlur': (3, 5, 7, 9, 11),
+    'MedianBlur': (3, 5, 7, 9, 11),
+    'BilateralFilter': ((5, 25), (7, 50), (9, 75), (11, 100), (13, 150)),
+    'Salt-and-pepper': (0.01, 0.03, 0.05, 0.1, 0.2),
+}
+
+# cv2 images have at most 128 channels (512 before OpenCV 5), i.e. 42 RGB images stacked together
+_STACK = 42
+
+
+def is_noise(noise):
+    return noise is not None and noise != 'None'
+
+
+def _stacked(fn, imgs):
+    """Run a per-channel cv2 filter on a (N, H, W, C) batch as a single (H, W, N * C) image."""
+    n, h, w, c = imgs.shape
+    stacked = np.ascontiguousarray(imgs.transpose(1, 2, 0, 3).reshape(h, w, n * c))
+    out = fn(stacked)
+    return out.reshape(h, w, n, c).transpose(2, 0, 1, 3)
+
+
+def _filter(imgs, noise, param):
+    if noise == 'GaussianBlur':
+        return _stacked(lambda x: cv2.GaussianBlur(x, (param, param), 0), imgs)
+    elif noise == 'AverageBlur':
+        return _stacked(lambda x: cv2.blur(x, (param, param)), imgs)
+    elif noise == 'MedianBlur':
+        return np.stack([cv2.medianBlur(np.ascontiguousarray(img), param) for img in imgs])
+    elif noise == 'BilateralFilter':
+        diameter, sigma = param
+        return np.stack([cv2.bilateralFilter(np.ascontiguousarray(img), diameter, sigma, sigma) for img in imgs])
+    else:
+        raise Exception('Invalid noise type...')
+
+
+def salt_and_pepper(imgs, amount, rng):
+    """Set a random ``amount`` of the pixels of every image to black or white, all at once."""
+    out = np.array(imgs)
+    hit = rng.random_sample(out.shape[:-1])
+    out[hit < amount / 2.] = 0
+    out[(hit >= amount / 2.) & (hit < amount)] = 255
+    return out
+
+
+def corrupt_batch(imgs, noise, severity=3, seed=0, num_threads=8):
+    """Corrupt a uint8 (N, H, W, C) batch with ``noise`` at ``severity`` (1-5).
+
+    Salt-and-pepper is a single vectorized NumPy pass; the blurs run on slices of the batch in a
+    thread pool (cv2 releases the GIL), Gaussian and average blur filter up to 42 images per
+    call by stacking them along the channel axis.
+    """
+    if not is_noise(noise):
+        return imgs
+    param = NOISE_PARAMS[noise][severity - 1]
+    if noise == 'Salt-and-pepper':
+        return salt_and_pepper(imgs, param, np.random.RandomState(seed))
+    step = _STACK if noise in ('GaussianBlur', 'AverageBlur') else max(1, int(np.ceil(len(imgs) / float(num_threads))))
+    slices = [imgs[i:i + step] for i in range(0, len(imgs), step)]
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return np.concatenate(list(pool.map(lambda x: _filter(x, noise, param), slices)))
+
+
+def corrupted_name(noise, severity):
+    return 'valid_%s_%d_pixel.npy' % (noise, severity)
+
+
+def materialize(data_name, noises=NOISE_TYPES, severities=SEVERITIES, batch_size=1024, num_threads=8,
+                root='datasets'):
+    """Write every ``noise`` x ``severity`` copy of the test split into the store, once.
+
+    Each copy is a uint8 ``.npy`` next to ``valid_pixel.npy`` and is listed under
+    ``meta['corrupt']``, so the test sets of all runs are read instead of regenerated.
+    """
+    pixels, _ = store.load_split(data_name, 'PrivateTest', root)
+    meta = store.read_meta(data_name, root)
+    entries = meta.setdefault('corrupt', {})
+    for noise in noises:
+        for severity in severities:
+            name = corrupted_name(noise, severity)
+            path = os.path.join(store.store_dir(data_name, root), name)
+            out = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.uint8, shape=pixels.shape)
+            for start in range(0, len(pixels), batch_size):
+                batch = np.array(pixels[start:start + batch_size])
+                out[start:start + len(batch)] = corrupt_batch(batch, noise, severity, seed=start + 7919 * (NOISE_TYPES.index(noise) * 10 + severity),
+                                                              num_threads=num_threads)
+            out.flush()
+            del out
+            os.replace(path + '.tmp', path)
+            entries.setdefault(noise, {})[str(severity)] = name
+            store.write_meta(data_name, meta, root)
+            print('%s %s severity %d' % (data_name, noise, severity))
+
+
+def load_corrupted(data_name, noise, severity, root='datasets'):
+    """Memory map of a materialized corrupted test split, ``None`` when it was not built."""
+    if not store.has_store(data_name, root):
+        return None
+    name = store.read_meta(data_name, root).get('corrupt', {}).get(noise, {}).get(str(severity))
+    if name is None:
+        return None
+    return np.load(os.path.join(store.store_dir(data_name, root), name), mmap_mode='r')
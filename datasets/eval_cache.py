@@ -0,0 +1,116 @@
+''' Persistent cache of the TenCrop test tensors'''
+
+from __future__ import print_function
+import os
+import json
+import hashlib
+import math
+import numpy as np
+import torch
+from datasets import store
+from datasets import augment
+from datasets.generic import StoreDataset, DualViewDataset
+
+
+CACHE_VERSION = 1
+
+
+def cache_dir(root='datasets'):
+    return os.path.join(root, 'eval_cache')
+
+
+def cache_params(data_name, size, mean, std, S_size=None, dtype='uint8', noise=None, severity=3, root='datasets'):
+    """Everything the cached tensors depend on; any change gives a new cache file.
+
+    ``S_size=None`` is the teacher view (TenCrop of the 100x100 images), otherwise the images
+    are first resized like the student test set of that resolution.
+    """
+    source = os.path.join(store.store_dir(data_name, root), 'meta.json') if store.has_store(data_name, root) \
+        else store.h5_path(data_name, root)
+    return {'version': CACHE_VERSION, 'data_name': data_name, 'size': size,
+            'resize': None if S_size is None else augment.TEST_RESIZE.get(S_size, 48),
+            'mean': [float(v) for v in mean], 'std': [float(v) for v in std], 'dtype': dtype,
+            'noise': noise if noise not in (None, 'None') else None, 'severity': severity,
+            'source_mtime': os.stat(source).st_mtime}
+
+
+def cache_path(params, root='datasets'):
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir(root), '%s_tencrop%d_%s' % (params['data_name'], params['size'], key))
+
+
+def build(data_name, size, mean, std, S_size=None, dtype='uint8', noise=None, severity=3, batch_size=256,
+          num_workers=4, root='datasets'):
+    """Materialize the TenCrop tensors of the test split once and return the cache path.
+
+    ``uint8`` keeps the raw (N, 10, size, size, 3) crops, which is exact and 4x smaller than
+    float32, the normalization then runs on the device while loading. ``float16`` stores the
+    normalized (N, 10, 3, size, size) tensors.
+    """
+    params = cache_params(data_name, size, mean, std, S_size, dtype, noise, severity, root)
+    path = cache_path(params, root)
+    if os.path.exists(path + '.json'):
+        return path
+    if not os.path.isdir(cache_dir(root)):
+        os.makedirs(cache_dir(root))
+    if S_size is None:
+        dataset = StoreDataset(data_name, split='PrivateTest', transform=None, root=root)
+    else:
+        dataset = DualViewDataset(data_name, split='PrivateTest', transform=None, S_size=S_size, noise=noise,
+                                  severity=severity, root=root)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    num = len(dataset)
+    if dtype == 'uint8':
+        shape, np_dtype = (num, 10, size, size, 3), np.uint8
+    else:
+        shape, np_dtype = (num, 10, 3, size, size), np.float16
+    out = np.lib.format.open_memmap(path + '_tencrop.npy.tmp', mode='w+', dtype=np_dtype, shape=shape)
+    labels = np.zeros(num, dtype=np.int64)
+    start = 0
+    for imgs, target in loader:
+        if dtype == 'uint8':
+            crops = augment.ten_crop(imgs.permute(0, 3, 1, 2), size).permute(0, 1, 3, 4, 2)
+        else:
+            crops = augment.normalize(augment.ten_crop(augment.to_float(imgs), size), mean, std).half()
+        out[start:start + len(imgs)] = crops.numpy()
+        labels[start:start + len(imgs)] = target.numpy()
+        start += len(imgs)
+    out.flush()
+    del out
+    os.replace(path + '_tencrop.npy.tmp', path + '_tencrop.npy')
+    np.save(path + '_label.npy', labels)
+    with open(path + '.json', 'w') as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+    print('TenCrop cache of %s written to %s' % (data_name, path))
+    return path
+
+
+class CachedTestLoader(object):
+    """Test loader over a cache written by ``build``.
+
+    Yields ``(img, target)`` with ``img`` of shape (B, 10, C, size, size), already normalized and
+    on ``device``, by reading contiguous slices of the memory-mapped file, so ``test()`` keeps its
+    ``view(-1, c, h, w)`` and ten-crop averaging unchanged.
+    """
+    def __init__(self, path, batch_size=256, device=None):
+        with open(path + '.json') as f:
+            self.params = json.load(f)
+        self.crops = np.load(path + '_tencrop.npy', mmap_mode='r')
+        self.labels = np.load(path + '_label.npy')
+        self.batch_size = batch_size
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+
+    def __len__(self):
+        return int(math.ceil(len(self.labels) / float(self.batch_size)))
+
+    def __iter__(self):
+        for start in range(0, len(self.labels), self.batch_size):
+            img = torch.from_numpy(np.array(self.crops[start:start + self.batch_size]))
+            target = torch.from_numpy(self.labels[start:start + self.batch_size])
+            img = img.to(self.device, non_blocking=True)
+            if self.params['dtype'] == 'uint8':
+                img = augment.normalize(img.permute(0, 1, 4, 2, 3).float().div_(255),
+                                        self.params['mean'], self.params['std'])
+            else:
+                img = img.float()
+            yield img, target
@@ -0,0 +1,369 @@
+''' Store-backed dataset classes shared by every dataset'''
+
+from __future__ import print_function
+import functools
+from PIL import Image
+import numpy as np
+import torch
+import torch.utils.data as data
+import torchvision
+from datasets import store
+from datasets import corrupt
+from datasets import shm
+from datasets import packed
+from datasets import augment
+from datasets.augment import TEST_RESIZE, empty
+
+
+def collated(batch):
+    """``collate_fn`` of the loaders over ``batched`` datasets, whose ``__getitems__`` returns whole batches."""
+    return batch
+
+
+def repeated(batch):
+    """``collate_fn`` of the loaders over datasets with ``repeats > 1``: the (B, repeats, ...) fields become B * repeats samples."""
+    return tuple(field.flatten(0, 1) for field in data.default_collate(batch))
+
+
+def seeded(getitem):
+    """Let ``__getitem__`` take the ``(index, sample_seed)`` pairs of ``datasets.sampler``.
+
+    The random transforms of the sample are then drawn from its own seed, whatever the worker
+    that loads it and wherever a resumed epoch started; the global RNG is left untouched.
+    """
+    @functools.wraps(getitem)
+    def wrapper(self, index):
+        if not isinstance(index, tuple):
+            return getitem(self, index)
+        index, seed = index
+        with torch.random.fork_rng(devices=[]):
+            # only the CPU generator: torch.manual_seed would also reseed, and leak, the CUDA ones
+            torch.default_generator.manual_seed(seed)
+            return getitem(self, index)
+    return wrapper
+
+
+def _stack(values):
+    """Collate one field of a list of samples into a preallocated tensor."""
+    first = values[0]
+    if not (torch.is_tensor(first) or isinstance(first, np.ndarray)):
+        return torch.as_tensor(np.asarray(values))
+    first = torch.as_tensor(first)
+    out = empty((len(values),) + tuple(first.shape), first.dtype)
+    for i, value in enumerate(values):
+        out[i] = torch.as_tensor(value)
+    return out
+
+
+class StoreDataset(data.Dataset):
+    """Single-view dataset over the image store of ``data_name``.
+
+    Length and class count come from the store's metadata; the pixels are only mapped on the
+    first ``__getitem__``, i.e. inside each DataLoader worker, and are dropped again when the
+    dataset is pickled.
+
+    Args:
+        data_name (string): RAF, PET, colorferet, FairFace or any other converted store.
+        split (string): 'Training' or 'PrivateTest'.
+        transform (callable, optional): transform applied to the PIL image, ``None`` returns
+            the raw uint8 pixels.
+        shared (bool): map the host-wide copy in /dev/shm (``datasets.shm``) instead of the
+            store, for many concurrent runs on the same dataset. The process that builds the
+            dataset holds the copy, its DataLoader workers only map it.
+        chunked (bool): read the compressed chunks of ``build_store.py --pack`` (``datasets.packed``),
+            best paired with ``sampler.BlockShuffleSampler``.
+        batched (bool): offer ``__getitems__`` so the DataLoader (with ``collate_fn=collated``)
+            fetches whole batches, see ``get_batch``.
+        batch_transform (callable, optional): batched augmentation of ``datasets.augment`` applied
+            to the uint8 (N, H, W, C) batch by ``get_batch`` instead of ``transform`` per image.
+        repeats (int): augmented views made of every image read (repeated augmentation), stacked
+            by ``__getitem__`` and flattened by ``collate_fn=repeated``, consecutive in the batches
+            of ``get_batch``; pair it with ``sampler.RepeatedAugmentSampler``.
+    """
+    resize_level = None
+
+    def __init__(self, data_name, split='Training', transform=None, root='datasets', shared=False, chunked=False,
+                 batched=False, batch_transform=None, repeats=1):
+        self.data_name = data_name
+        self.split = split
+        self.transform = transform
+        self.root = root
+        self.shared = shared
+        self.chunked = chunked
+        self.batched = batched
+        self.batch_transform = batch_transform
+        self.repeats = repeats
+        self.num = store.split_size(data_name, split, root)
+        self.num_classes = store.num_classes(data_name, root)
+        self._segment = None
+        if shared and not chunked:
+            # registered here, in the main process, which releases it at exit
+            self._segment = shm.attach(data_name, split, root)
+        self._opened = False
+
+    def _open(self):
+        if not self._opened:
+            if self.chunked:
+                self._data = packed.load_pixels(self.data_name, self.split, root=self.root)
+                if self._data is None:
+                    raise Exception('%s %s is not packed, run build_store.py --pack...' % (self.data_name, self.split))
+                self._labels = store.load_labels(self.data_name, self.split, self.root)
+            elif self.shared:
+                self._data, self._labels = shm.open_segment(self._segment)
+            else:
+                self._data, self._labels = store.load_split(self.data_name, self.split, self.root)
+            self._resized = None
+            if self.resize_level is not None:
+                self._resized = store.load_level(self.data_name, self.split, self.resize_level, self.root)
+            self._opened = True
+
+    @property
+    def data(self):
+        self._open()
+        return self._data
+
+    @property
+    def labels(self):
+        self._open()
+        return self._labels
+
+    def _pixels(self, index):
+        return self._data[index]
+
+    def _resized_image(self, index):
+        """PIL image at ``resize_level``, read from the pyramid when it was built."""
+        if self._resized is not None:
+            return Image.fromarray(self._resized[index])
+        return torchvision.transforms.Resize(self.resize_level)(Image.fromarray(self._pixels(index)))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_data', '_labels', '_resized'):
+            state.pop(key, None)
+        state['_opened'] = False
+        return state
+
+    def make_sample(self, img, target):
+        """Turn one raw training image into what ``__getitem__`` yields, see ``datasets.stream``."""
+        if self.transform is None:
+            return np.array(img), target
+        img = Image.fromarray(img)
+        img = self.transform(img)
+        return img, target
+
+    def make_views(self, img, target):
+        """``make_sample``, or with ``repeats > 1`` that many samples of the image stacked field by field."""
+        if self.repeats == 1:
+            return self.make_sample(img, target)
+        samples = [self.make_sample(img, target) for _ in range(self.repeats)]
+        return tuple(torch.stack([torch.as_tensor(value) for value in field]) for field in zip(*samples))
+
+    @seeded
+    def __getitem__(self, index):
+        self._open()
+        return self.make_views(self._data[index], self._labels[index])
+
+    def __len__(self):
+        return self.num
+
+    @property
+    def __getitems__(self):
+        # only batched datasets have the batch fetch path, the others keep the default collate
+        return self.get_batch if self.batched else None
+
+    def _take(self, source, indices):
+        """Gather ``indices`` of a (N, H, W, C) array with one fancy index, straight into the output tensor."""
+        out = empty((len(indices),) + tuple(source.shape[1:]), torch.uint8)
+        if isinstance(source, np.ndarray):
+            np.take(source, indices, axis=0, out=out.numpy())
+        else:
+            out.numpy()[:] = source[indices]
+        return out
+
+    def batch_pixels(self, indices):
+        """uint8 (N, H, W, C) batch of the images ``__getitem__`` starts from."""
+        if self.resize_level is None:
+            if getattr(self, '_corrupt', False):
+                return torch.from_numpy(np.stack([self._pixels(index) for index in indices]))
+            return self._take(self._data, indices)
+        if self._resized is not None:
+            return self._take(self._resized, indices)
+        return torch.from_numpy(np.stack([np.asarray(self._resized_image(index)) for index in indices]))
+
+    def make_batch(self, imgs, target, indices=None):
+        if self.batch_transform is not None:
+            out = self.batch_transform(imgs)
+            return (out if isinstance(out, tuple) else (out,)) + (target,)
+        if self.transform is None:
+            return imgs, target
+        samples = [self.make_sample(img, label) for img, label in zip(imgs.numpy(), target.numpy())]
+        return tuple(_stack(field) for field in zip(*samples))
+
+    def get_batch(self, indices):
+        """The collated batch of ``indices``: what the default collate makes of ``__getitem__``.
+
+        The indices are sorted, so the pixels come out of one sequential fancy index of the
+        memmap, and the images of a batch come back in that order. ``batch_transform``
+        augments the whole uint8 batch at once; otherwise ``transform`` runs per image and
+        the samples are written into preallocated tensors. ``(index, sample_seed)`` pairs
+        draw the augmentation of the whole batch from the seed of the first one. With
+        ``repeats > 1`` every image is gathered once and augmented ``repeats`` times.
+        """
+        self._open()
+        if len(indices) and isinstance(indices[0], tuple):
+            with torch.random.fork_rng(devices=[]):
+                torch.default_generator.manual_seed(indices[0][1])
+                return self.get_batch([index for index, _ in indices])
+        indices = np.sort(np.asarray(indices, dtype=np.int64))
+        target = torch.from_numpy(np.asarray(self._labels[indices], dtype=np.int64))
+        imgs = self.batch_pixels(indices)
+        if self.repeats > 1:
+            indices = np.repeat(indices, self.repeats)
+            imgs, target = imgs.repeat_interleave(self.repeats, 0), target.repeat_interleave(self.repeats, 0)
+        return self.make_batch(imgs, target, indices)
+
+
+class DualViewDataset(StoreDataset):
+    """Teacher/student dataset: training samples yield ``(img_teacher, img_student, target)``.
+
+    Test samples are resized for ``TenCrop(S_size)`` and only yield the student view. With
+    ``transform=None`` both splits return the raw uint8 pixels for the batched pipelines of
+    ``datasets.augment``. A ``noise`` other than 'None' corrupts the test images at
+    ``severity``, read from the store when ``build_store.py --corrupt`` materialized them.
+
+    With a ``teacher_cache`` (``datasets.teacher_cache.TeacherCache``) every training sample
+    replays one of the recorded crops/flips of its image instead of ``transform`` and yields
+    ``(teacher_logits, img_student, target)``, the float16 (teachers, classes) logits the
+    teachers produced for that very crop taking the place of the teacher view. A
+    ``feature_cache`` (``datasets.teacher_cache.FeatureCache``) over the same augmentations
+    appends the cached teacher maps of that crop, one field per layer of the cache.
+    """
+    def __init__(self, data_name, split='Training', transform=None, student_norm=None, teacher_norm=None,
+                 S_size=44, noise=None, severity=3, root='datasets', shared=False, chunked=False, batched=False,
+                 batch_transform=None, repeats=1, teacher_cache=None, feature_cache=None):
+        super(DualViewDataset, self).__init__(data_name, split=split, transform=transform, root=root, shared=shared,
+                                              chunked=chunked, batched=batched, batch_transform=batch_transform,
+                                              repeats=repeats if split == 'Training' else 1)
+        self.student_norm = student_norm
+        self.teacher_norm = teacher_norm
+        self.S_size = S_size
+        self.noise = noise
+        self.severity = severity
+        self.teacher_cache = teacher_cache
+        self.feature_cache = feature_cache
+        if feature_cache is not None and (teacher_cache is None or not teacher_cache.same_augmentations(feature_cache)):
+            raise Exception('a feature_cache needs a teacher_cache over the same recorded augmentations...')
+        if self.split != 'Training':
+            self.resize_level = TEST_RESIZE.get(S_size, 48)
+
+    def _open(self):
+        if not self._opened:
+            super(DualViewDataset, self)._open()
+            self._corrupt = False
+            if self.split != 'Training' and corrupt.is_noise(self.noise):
+                # the pyramid holds clean images, corrupted ones are resized on the fly
+                self._resized = None
+                corrupted = corrupt.load_corrupted(self.data_name, self.noise, self.severity, self.root)
+                if corrupted is not None:
+                    self._data = corrupted
+                else:
+                    self._corrupt = True
+
+    def _pixels(self, index):
+        img = self._data[index]
+        if self._corrupt:
+            img = corrupt.corrupt_batch(np.array(img)[None], self.noise, self.severity, seed=index, num_threads=1)[0]
+        return img
+
+    def make_sample(self, img, target):
+        if self.transform is None:
+            # raw uint8 pixels for datasets.augment.TeacherStudentAugment
+            return np.array(img), target
+        img = Image.fromarray(img)
+        img = self.transform(img)
+
+        img_student = self.student_norm(img)
+        img_teacher = self.teacher_norm(img)
+
+        return img_teacher, img_student, target
+
+    def make_cached_views(self, index, img, target):
+        """``repeats`` student views of recorded augmentations of image ``index``, with their cached teacher logits."""
+        img = Image.fromarray(img)
+        samples = []
+        for slot in torch.randint(self.teacher_cache.pool, (self.repeats,)).tolist():
+            img_student = self.student_norm(self.teacher_cache.replay(img, index, slot))
+            features = self.feature_cache.features(index, slot) if self.feature_cache is not None else ()
+            samples.append((self.teacher_cache.logits(index, slot), img_student, target) + features)
+        if self.repeats == 1:
+            return samples[0]
+        return tuple(torch.stack([torch.as_tensor(value) for value in field]) for field in zip(*samples))
+
+    def make_cached_batch(self, imgs, target, indices):
+        slots = torch.randint(self.teacher_cache.pool, (len(indices),)).numpy()
+        if self.batch_transform is not None:
+            top, left, flip = self.teacher_cache.augmentation(indices, slots)
+            img_student = self.batch_transform.student(augment.crop_flip(imgs, top, left, flip, self.teacher_cache.crop_size))
+        else:
+            img_student = _stack([self.student_norm(self.teacher_cache.replay(Image.fromarray(img), index, slot))
+                                  for img, index, slot in zip(imgs.numpy(), indices.tolist(), slots.tolist())])
+        features = self.feature_cache.features(indices, slots) if self.feature_cache is not None else ()
+        return (self.teacher_cache.logits(indices, slots), img_student, target) + features
+
+    def make_batch(self, imgs, target, indices=None):
+        if self.split != 'Training' and self.batch_transform is None and self.transform is not None:
+            return _stack([self.transform(Image.fromarray(img)) for img in imgs.numpy()]), target
+        if self.split == 'Training' and self.teacher_cache is not None:
+            return self.make_cached_batch(imgs, target, indices)
+        return super(DualViewDataset, self).make_batch(imgs, target)
+
+    @seeded
+    def __getitem__(self, index):
+        self._open()
+        target = self._labels[index]
+        if self.split == 'Training':
+            if self.teacher_cache is not None:
+                return self.make_cached_views(index, self._data[index], target)
+            return self.make_views(self._data[index], target)
+
+        else:
+            if self.transform is None:
+                # raw uint8 pixels for datasets.augment.TenCropNormalize
+                return np.array(self._resized_image(index)), target
+            img_student = self.transform(self._resized_image(index))
+
+            return img_student, target
+
+
+class StudentDataset(StoreDataset):
+    """Student-only dataset over the images resized to 48."""
+    resize_level = 48
+
+    @seeded
+    def __getitem__(self, index):
+        self._open()
+        img = self.transform(self._resized_image(index))
+        return img, self._labels[index]
+
+
+class OnlineDataset(StoreDataset):
+    def __init__(self, data_name, split='Training', transform=None, student_norm=None, teacher_norm=None,
+                 noise=None, root='datasets', shared=False, chunked=False):
+        super(OnlineDataset, self).__init__(data_name, split=split, transform=transform, root=root, shared=shared,
+                                            chunked=chunked)
+        self.student_norm = student_norm
+        self.teacher_norm = teacher_norm
+        self.noise = noise
+
+    @seeded
+    def __getitem__(self, index):
+        self._open()
+        img, target = self._data[index], self._labels[index]
+        if self.split == 'Training':
+            img = Image.fromarray(img)
+            img = self.transform(img)
+
+        img_student = self.student_norm(img)
+        img_teacher = self.teacher_norm(img)
+
+        return img_teacher, img_student, target
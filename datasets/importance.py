@@ -0,0 +1,70 @@
+''' Loss-proportional importance sampling of the training sets'''
+
+from __future__ import print_function
+import numpy as np
+import torch
+from datasets import sampler
+
+
+class LossProportionalSampler(sampler.PlannedSampler):
+    """Draw the images of an epoch with probability proportional to their last training loss.
+
+    The per-sample losses live in a float16 table, with the epoch each one was measured in an
+    int32 one: 6 bytes per image, so millions of images cost megabytes. ``update`` overwrites
+    the entries of every batch trained on, so the scores cost no extra forward pass.
+
+    An epoch draws ``num`` images with replacement from ``p = (1 - uniform) * loss / sum(loss)
+    + uniform / num``; the uniform share keeps every image reachable and bounds the weights.
+    ``weights`` returns ``1 / (num * p)``, which makes the weighted batch loss an unbiased
+    estimate of the loss over the whole set. Scores older than ``stale_epochs`` epochs, and
+    those never measured, count as at least the mean score, so the images they belong to are
+    re-measured soon instead of being forgotten. The first epoch, before any score exists, is a
+    plain permutation. Resumes like every ``sampler.PlannedSampler``.
+    """
+    state_keys = ('scores', 'seen', 'probs')
+
+    def __init__(self, num, uniform=0.1, stale_epochs=5, sorted_batches=False, seed=0):
+        super(LossProportionalSampler, self).__init__(num, sorted_batches=sorted_batches, seed=seed)
+        self.uniform = uniform
+        self.stale_epochs = stale_epochs
+        self.scores = np.zeros(num, dtype=np.float16)
+        self.seen = np.full(num, -1, dtype=np.int32)
+        self.probs = None
+
+    def probabilities(self, epoch):
+        """Sampling probabilities of ``epoch``, ``None`` before any loss was recorded."""
+        measured = self.seen >= 0
+        if not measured.any():
+            return None
+        scores = self.scores.astype(np.float64)
+        stale = ~measured | (self.seen < epoch - self.stale_epochs)
+        scores[stale] = np.maximum(scores[stale], scores[measured].mean())
+        total = scores.sum()
+        if total <= 0:
+            return np.full(self.num, 1. / self.num)
+        return (1 - self.uniform) * scores / total + self.uniform / self.num
+
+    def draw(self, epoch, rng):
+        self.probs = self.probabilities(epoch)
+        if self.probs is None:
+            return rng.permutation(self.num)
+        cdf = np.cumsum(self.probs)
+        return np.minimum(np.searchsorted(cdf, rng.random(self.num) * cdf[-1], side='right'), self.num - 1)
+
+    def weights(self, indices, device=None):
+        """Loss weights ``1 / (num * p)`` of the images of a batch."""
+        if self.probs is None:
+            return torch.ones(len(indices), device=device)
+        return torch.from_numpy((1. / (self.num * self.probs[indices])).astype(np.float32)).to(device)
+
+    def update(self, indices, loss):
+        """Record the per-sample losses of a batch."""
+        self.scores[indices] = np.minimum(loss.detach().float().cpu().numpy(), np.finfo(np.float16).max)
+        self.seen[indices] = self.plan_epoch
+
+    def report(self):
+        if self.probs is None:
+            return 'importance: epoch %d, uniform pass' % self.plan_epoch
+        return ('importance: epoch %d drew %d distinct images, weights %.2f-%.2f, mean score %.4f'
+                % (self.plan_epoch, len(np.unique(self.plan)), 1. / (self.num * self.probs.max()),
+                   1. / (self.num * self.probs.min()), self.scores[self.seen >= 0].astype(np.float32).mean()))
@@ -0,0 +1,156 @@
+''' Ingestion of image folders and label CSVs into memory-mapped stores'''
+
+from __future__ import print_function
+import os
+import csv
+import time
+import multiprocessing
+import numpy as np
+from PIL import Image
+from datasets import store
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.ppm', '.tif', '.tiff', '.webp')
+
+
+def scan_folder(path):
+    """``(files, labels)`` of a ``<path>/<class>/.../<image>`` tree, labelled by the class folder names."""
+    files, labels = [], []
+    for name in sorted(os.listdir(path)):
+        class_dir = os.path.join(path, name)
+        if not os.path.isdir(class_dir):
+            continue
+        for dirpath, dirnames, filenames in os.walk(class_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(os.path.join(dirpath, filename))
+                    labels.append(name)
+    return files, labels
+
+
+def read_csv(path, image_root=None, path_col='file', label_col='label'):
+    """``(files, labels)`` of a label CSV; relative image paths are resolved against ``image_root``,
+    by default the directory of the CSV."""
+    if image_root is None:
+        image_root = os.path.dirname(os.path.abspath(path))
+    files, labels = [], []
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            files.append(os.path.join(image_root, row[path_col]))
+            labels.append(row[label_col].strip())
+    return files, labels
+
+
+def read_source(path, image_root=None, path_col='file', label_col='label'):
+    if path.lower().endswith('.csv'):
+        return read_csv(path, image_root, path_col, label_col)
+    return scan_folder(path)
+
+
+def class_names(labels):
+    """Sorted class names; integer labels sort numerically, so 0..K-1 keep their ids."""
+    return sorted(set(labels), key=lambda name: (not name.isdigit(), int(name) if name.isdigit() else 0, name))
+
+
+def holdout(files, labels, fraction, seed=0):
+    """Random ``(train, test)`` split of one source that has no test set of its own."""
+    order = np.random.RandomState(seed).permutation(len(files))
+    num_test = int(round(len(files) * fraction))
+    pick = lambda idx: ([files[i] for i in sorted(idx)], [labels[i] for i in sorted(idx)])
+    return pick(order[num_test:]), pick(order[:num_test])
+
+
+def load_image(path, size=store.IMAGE_SIZE):
+    """Decode ``path`` into a uint8 (size, size, 3) RGB array.
+
+    JPEGs are decoded at the smallest DCT scale that is still at least ``size`` wide, which is
+    most of the decoding time saved on large photos, before the bilinear resize.
+    """
+    with Image.open(path) as img:
+        img.draft('RGB', (size, size))
+        return np.asarray(img.convert('RGB').resize((size, size), Image.BILINEAR))
+
+
+def _ingest_chunk(job):
+    """Write rows ``[start, start + len(files))`` of the pixel file; runs in a worker process.
+
+    Returns the rows whose image could not be decoded.
+    """
+    path, start, files = job
+    dst = np.load(path, mmap_mode='r+')
+    failed = []
+    for i, file in enumerate(files):
+        try:
+            dst[start + i] = load_image(file)
+        except (IOError, OSError, ValueError) as e:
+            print('skipping %s: %s' % (file, e))
+            failed.append(start + i)
+    dst.flush()
+    return failed
+
+
+def _drop_rows(path, failed, chunk=4096):
+    """Rewrite the pixel file without the ``failed`` rows, returns the indices that were kept."""
+    src = np.load(path, mmap_mode='r')
+    keep = np.setdiff1d(np.arange(len(src)), failed)
+    dst = np.lib.format.open_memmap(path + '.keep', mode='w+', dtype=np.uint8, shape=(len(keep),) + src.shape[1:])
+    for start in range(0, len(keep), chunk):
+        dst[start:start + chunk] = src[keep[start:start + chunk]]
+    dst.flush()
+    del dst, src
+    os.replace(path + '.keep', path)
+    return keep
+
+
+def ingest(data_name, splits, num_workers=8, chunk=256, root='datasets', source=None):
+    """Build the store of ``data_name`` from ``{'Training': (files, labels), 'PrivateTest': (files, labels)}``.
+
+    Every split gets its (N, 100, 100, 3) pixel file preallocated; ``num_workers`` processes
+    then decode and resize chunks of ``chunk`` images and write them straight into their rows,
+    so the images never pass through the parent process. Unreadable files are reported and
+    dropped. The class names are recorded in meta.json in label order.
+    """
+    names = class_names([label for _, labels in splits.values() for label in labels])
+    index = dict((name, i) for i, name in enumerate(names))
+    out = store.store_dir(data_name, root)
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    meta = {'name': data_name, 'image_size': store.IMAGE_SIZE, 'channels': 3, 'splits': {},
+            'num_classes': len(names), 'class_names': names}
+    if source is not None:
+        meta['source'] = source
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    try:
+        for split in ('Training', 'PrivateTest'):
+            files, labels = splits[split]
+            prefix = store.split_prefix(split)
+            labels = np.array([index[label] for label in labels], dtype=np.int64)
+            pixel_file = os.path.join(out, prefix + '_pixel.npy')
+            t = time.time()
+            dst = np.lib.format.open_memmap(pixel_file + '.tmp', mode='w+', dtype=np.uint8,
+                                            shape=(len(files), store.IMAGE_SIZE, store.IMAGE_SIZE, 3))
+            del dst
+            jobs = [(pixel_file + '.tmp', start, files[start:start + chunk]) for start in range(0, len(files), chunk)]
+            results = pool.imap_unordered(_ingest_chunk, jobs) if pool is not None else map(_ingest_chunk, jobs)
+            failed = []
+            for done, bad in enumerate(results):
+                failed += bad
+                if (done + 1) % 100 == 0:
+                    print('%s %s: %d/%d images' % (data_name, split, min((done + 1) * chunk, len(files)), len(files)))
+            if failed:
+                labels = labels[_drop_rows(pixel_file + '.tmp', sorted(failed))]
+            os.replace(pixel_file + '.tmp', pixel_file)
+            np.save(os.path.join(out, prefix + '_label.npy'), labels)
+            meta['splits'][prefix] = {'num': len(labels),
+                                     'pixels': prefix + '_pixel.npy',
+                                     'labels': prefix + '_label.npy'}
+            print('%s %s: %d images (%d skipped) in %.1fs' % (data_name, split, len(labels), len(failed), time.time() - t))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    store.write_meta(data_name, meta, root)
+    for split in ('Training', 'PrivateTest'):
+        store.build_class_index(data_name, split, root)
+    return store.read_meta(data_name, root)
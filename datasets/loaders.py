@@ -0,0 +1,127 @@
+''' Training and test loaders of the training scripts, built from their common data flags'''
+
+from __future__ import print_function
+import torch
+from datasets import store
+from datasets import sampler
+from datasets import packed
+from datasets import pruning
+from datasets import importance
+from datasets import stream
+from datasets import eval_cache
+from datasets import prefetch
+from datasets import progressive
+from datasets.generic import collated, repeated
+
+
+def flag(args, name):
+    """``args.<name>``, 0 when the script does not define the flag; ``repeats`` defaults to 1."""
+    return getattr(args, name, 1 if name == 'repeats' else 0)
+
+
+def _exclusive(args, name, others):
+    """Refuse ``--<name>`` together with any of the ``others`` flags that are set."""
+    others = [other for other in others if flag(args, other)]
+    if others:
+        raise Exception('--%s draws its own order and cannot be combined with %s...'
+                        % (name, ', '.join('--' + other for other in others)))
+
+
+def check_order_flags(args):
+    """Refuse the combinations of flags that each want their own training order."""
+    if flag(args, 'balanced') and flag(args, 'stream'):
+        raise Exception('--balanced samples at random and cannot be combined with --stream...')
+    if flag(args, 'prune'):
+        _exclusive(args, 'prune', ('stream', 'balanced', 'chunked'))
+    if flag(args, 'importance'):
+        _exclusive(args, 'importance', ('stream', 'balanced', 'chunked', 'prune'))
+    if flag(args, 'repeats') > 1:
+        _exclusive(args, 'repeats', ('stream', 'balanced', 'chunked', 'prune', 'importance'))
+        if args.train_bs % args.repeats:
+            raise Exception('--train_bs must be a multiple of --repeats...')
+
+
+def train_order(args, trainset, seed=0):
+    """The sampler the flags ask for: ``(sampler, batch_size, is_batch_sampler)``.
+
+    Every one of them yields the seeded ``(index, sample_seed)`` pairs that snapshots resume
+    mid-epoch (``datasets.sampler``). ``--chunked`` draws whole compressed chunks together,
+    ``--balanced`` class-balanced (P x K) batches, ``--prune`` down-samples the images the
+    teachers and the student have solved, ``--importance`` draws in proportion to the last
+    loss and ``--repeats`` draws ``len(trainset) // repeats`` images whose views fill the batches.
+    """
+    check_order_flags(args)
+    if flag(args, 'repeats') > 1:
+        # an epoch keeps its number of samples and steps
+        return sampler.RepeatedAugmentSampler(len(trainset), repeats=args.repeats, seed=seed), args.train_bs // args.repeats, False
+    if flag(args, 'importance'):
+        return importance.LossProportionalSampler(len(trainset), uniform=args.importance_uniform, stale_epochs=args.importance_stale,
+                                                  sorted_batches=args.batched, seed=seed), args.train_bs, False
+    if flag(args, 'prune'):
+        return pruning.ConsensusPruner(len(trainset), num_teachers=4, ratio=args.prune, margin=args.prune_margin,
+                                       recheck_every=args.prune_recheck, anneal_epoch=args.epochs - int(args.epochs * args.prune_anneal) + 1,
+                                       sorted_batches=args.batched, seed=seed), args.train_bs, False
+    if flag(args, 'balanced'):
+        return sampler.ClassBalancedBatchSampler(store.load_class_index(args.data_name, 'Training'), args.train_bs,
+                                                 samples_per_class=args.samples_per_class, seed=seed), None, True
+    if flag(args, 'chunked'):
+        return sampler.BlockShuffleSampler(len(trainset), packed.chunk_size(args.data_name, 'Training'), seed=seed), args.train_bs, False
+    return sampler.ResumableSampler(len(trainset), seed=seed), args.train_bs, False
+
+
+def build_loaders(args, trainset, testset, crop, mean, std, S_size=None, seed=0):
+    """``(trainset, trainloader, train_order, testloader)`` of the store datasets ``trainset`` and ``testset``.
+
+    ``train_order`` is the sampler of ``train_order()``, ``None`` with ``--stream``, where
+    ``trainset`` comes back wrapped in a ``stream.ShardedStream``. The loaders get their own
+    generator, so starting an epoch does not draw from the global RNG the snapshots restore.
+    ``--eval_cache`` replaces the test loader by the cached TenCrop tensors of ``crop``,
+    normalized with ``(mean, std)`` and resized like the student test set when ``S_size`` is
+    given; it turns ``args.batch_tencrop`` off, the cached batches come out normalized.
+    ``--prefetch`` stages the training batches on the device in the background.
+    """
+    num_workers = getattr(args, 'num_workers', 1)
+    batched = flag(args, 'batched')
+    check_order_flags(args)
+    if flag(args, 'stream'):
+        # constant-memory sequential reads: shard shuffle + shuffle buffer instead of random access
+        order = None
+        trainset = stream.ShardedStream(trainset, shard_size=args.stream, buffer_size=args.stream_buffer, seed=seed)
+        trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, num_workers=num_workers)
+    else:
+        collate = collated if batched else (repeated if flag(args, 'repeats') > 1 else None)
+        order, batch_size, batch_sampler = train_order(args, trainset, seed)
+        if batch_sampler:
+            trainloader = torch.utils.data.DataLoader(trainset, batch_sampler=order, num_workers=num_workers,
+                                                      collate_fn=collate, generator=torch.Generator())
+        else:
+            trainloader = torch.utils.data.DataLoader(trainset, batch_size=batch_size, sampler=order, num_workers=num_workers,
+                                                      collate_fn=collate, generator=torch.Generator())
+    # the test split is never repeated, only the batched reads need their own collate
+    testloader = torch.utils.data.DataLoader(testset, batch_size=args.test_bs, shuffle=False, num_workers=num_workers,
+                                             collate_fn=collated if batched else None)
+    if flag(args, 'eval_cache'):
+        # the TenCrop tensors are built once per (dataset, crop, normalization) and only streamed afterwards
+        args.batch_tencrop = 0
+        cache_path = eval_cache.build(args.data_name, crop, mean, std, S_size=S_size, noise=getattr(args, 'noise', None),
+                                      severity=getattr(args, 'severity', 3), dtype=args.eval_cache, num_workers=num_workers)
+        testloader = eval_cache.CachedTestLoader(cache_path, batch_size=args.test_bs)
+    if flag(args, 'prefetch'):
+        # overlap the host->device copies with the training step
+        trainloader = prefetch.Prefetcher(trainloader, depth=args.prefetch)
+    return trainset, trainloader, order, testloader
+
+
+def progressive_resizing(args, size, first_epoch=0):
+    """The ``--progressive`` schedule of the full ``size`` inputs, ``None`` without the flag.
+
+    Low resolution and large batches first, the full size from ``args.progressive_end`` of
+    the epochs that start at ``first_epoch`` on.
+    """
+    if not flag(args, 'progressive'):
+        return None
+    if flag(args, 'balanced'):
+        raise Exception('--progressive schedules the batch size and cannot be combined with --balanced...')
+    return progressive.ProgressiveResizing(size, args.train_bs // flag(args, 'repeats'), first_epoch,
+                                           int(args.epochs * args.progressive_end) + first_epoch,
+                                           min_scale=args.progressive, max_batch_scale=args.progressive_bs)
@@ -0,0 +1,181 @@
+''' Chunk-compressed copies of the image stores'''
+
+from __future__ import print_function
+import os
+import zlib
+from collections import OrderedDict
+import numpy as np
+from datasets import store
+
+
+def _codecs():
+    """``{name: (compress(bytes, level), decompress(bytes))}`` of the installed codecs."""
+    codecs = {'zlib': (lambda buf, level: zlib.compress(buf, 6 if level is None else level), zlib.decompress)}
+    try:
+        import zstandard
+        codecs['zstd'] = (lambda buf, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(buf),
+                          lambda buf: zstandard.ZstdDecompressor().decompress(buf))
+    except ImportError:
+        pass
+    try:
+        import lz4.frame
+        codecs['lz4'] = (lambda buf, level: lz4.frame.compress(buf, compression_level=level or 0), lz4.frame.decompress)
+    except ImportError:
+        pass
+    try:
+        import blosc
+        codecs['blosc'] = (lambda buf, level: blosc.compress(buf, typesize=1, clevel=5 if level is None else level, cname='zstd'),
+                           blosc.decompress)
+    except ImportError:
+        pass
+    return codecs
+
+
+CODECS = _codecs()
+PREFERRED = ('zstd', 'lz4', 'blosc', 'zlib')
+
+
+def default_codec():
+    return [codec for codec in PREFERRED if codec in CODECS][0]
+
+
+def sub_filter(imgs):
+    """PNG 'Sub' filter: every pixel minus its left neighbour (mod 256), compresses far better."""
+    out = np.array(imgs)
+    out[:, :, 1:] -= imgs[:, :, :-1]
+    return out
+
+
+def unsub_filter(imgs):
+    return np.cumsum(imgs, axis=2, dtype=np.uint8)
+
+
+def chunked_name(split):
+    return store.split_prefix(split) + '_chunks.bin'
+
+
+def pack(data_name, split, chunk_size=256, codec=None, level=None, root='datasets'):
+    """Write the pixels of a split as compressed chunks of ``chunk_size`` images.
+
+    ``<split>_chunks.bin`` holds the chunks back to back and ``<split>_chunks_offsets.npy``
+    their byte offsets; both are recorded under ``meta['chunked']``, so ``store.load_split``
+    can serve the split from them even after the raw ``<split>_pixel.npy`` has been deleted.
+    """
+    codec = codec or default_codec()
+    compress = CODECS[codec][0]
+    pixels, _ = store.load_split(data_name, split, root)
+    prefix = store.split_prefix(split)
+    path = os.path.join(store.store_dir(data_name, root), chunked_name(split))
+    offsets = [0]
+    with open(path + '.tmp', 'wb') as f:
+        for start in range(0, len(pixels), chunk_size):
+            buf = compress(sub_filter(np.asarray(pixels[start:start + chunk_size])).tobytes(), level)
+            f.write(buf)
+            offsets.append(offsets[-1] + len(buf))
+    os.replace(path + '.tmp', path)
+    np.save(os.path.join(store.store_dir(data_name, root), prefix + '_chunks_offsets.npy'), np.array(offsets, dtype=np.int64))
+
+    meta = store.read_meta(data_name, root)
+    meta.setdefault('chunked', {})[prefix] = {'file': chunked_name(split), 'offsets': prefix + '_chunks_offsets.npy',
+                                              'codec': codec, 'filter': 'sub', 'chunk_size': chunk_size,
+                                              'num': len(pixels), 'shape': list(pixels.shape[1:])}
+    store.write_meta(data_name, meta, root)
+    print('%s %s: %d chunks, %.2fx smaller with %s' % (data_name, store.split_prefix(split), len(offsets) - 1,
+                                                       pixels.nbytes / float(offsets[-1]), codec))
+    return meta['chunked'][prefix]
+
+
+def chunk_size(data_name, split, root='datasets'):
+    """Images per chunk of the packed split, ``None`` when it was not packed."""
+    if not store.has_store(data_name, root):
+        return None
+    entry = store.read_meta(data_name, root).get('chunked', {}).get(store.split_prefix(split))
+    return None if entry is None else entry['chunk_size']
+
+
+def load_pixels(data_name, split, cache_chunks=8, root='datasets'):
+    """``ChunkedArray`` over the packed split, ``None`` when it was not packed."""
+    if not store.has_store(data_name, root):
+        return None
+    entry = store.read_meta(data_name, root).get('chunked', {}).get(store.split_prefix(split))
+    if entry is None:
+        return None
+    path = store.store_dir(data_name, root)
+    return ChunkedArray(os.path.join(path, entry['file']), np.load(os.path.join(path, entry['offsets'])),
+                        entry['codec'], entry['chunk_size'], entry['num'], tuple(entry['shape']), cache_chunks)
+
+
+class ChunkedArray(object):
+    """Read-only (N, H, W, C) uint8 array backed by compressed chunks.
+
+    Indexing with an int, a slice or a list of indices reads and decompresses only the chunks
+    it touches, with one ``pread`` each, and keeps the last ``cache_chunks`` decoded chunks in
+    an LRU. The file is opened lazily and the cache is dropped when pickled, so every
+    DataLoader worker holds its own descriptor and cache.
+    """
+    dtype = np.dtype(np.uint8)
+
+    def __init__(self, path, offsets, codec, chunk_size, num, shape, cache_chunks=8):
+        self.path = path
+        self.offsets = offsets
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.shape = (num,) + tuple(shape)
+        self.cache_chunks = cache_chunks
+        self._fd = None
+        self._cache = OrderedDict()
+        self.reads = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        state['_cache'] = OrderedDict()
+        return state
+
+    def __del__(self):
+        if getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
+
+    def chunk(self, c):
+        """Decoded images of chunk ``c``."""
+        if c in self._cache:
+            self._cache.move_to_end(c)
+            return self._cache[c]
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        start, end = int(self.offsets[c]), int(self.offsets[c + 1])
+        buf = CODECS[self.codec][1](os.pread(self._fd, end - start, start))
+        imgs = unsub_filter(np.frombuffer(buf, dtype=np.uint8).reshape((-1,) + self.shape[1:]))
+        imgs.flags.writeable = False
+        self.reads += 1
+        self._cache[c] = imgs
+        if len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return imgs
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = int(index) + len(self) if index < 0 else int(index)
+            return self.chunk(index // self.chunk_size)[index % self.chunk_size]
+        if isinstance(index, slice):
+            index = range(*index.indices(len(self)))
+        index = np.asarray(index, dtype=np.int64).reshape(-1)
+        index = np.where(index < 0, index + len(self), index)
+        out = np.empty((len(index),) + self.shape[1:], dtype=np.uint8)
+        chunks = index // self.chunk_size
+        # one decode per distinct chunk, whatever the order of the indices
+        for c in np.unique(chunks):
+            hit = chunks == c
+            out[hit] = self.chunk(int(c))[index[hit] % self.chunk_size]
+        return out
+
+    def __array__(self, dtype=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
@@ -0,0 +1,150 @@
+''' Background batch prefetching with pinned, reusable buffers'''
+
+from __future__ import print_function
+import queue
+import threading
+import time
+import torch
+
+
+_PENDING = object()
+
+
+class Prefetcher(object):
+    """Wrap a DataLoader so that the next ``depth`` batches are always staged.
+
+    A background thread copies every batch into one of ``depth + 2`` preallocated slots
+    (pinned memory with CUDA, shared memory otherwise), so no page-locked memory is
+    allocated per step. While the training step of batch ``k`` runs, the host->device copy
+    of batch ``k + 1`` is already issued on a separate CUDA stream. Tensors come out on
+    ``device``, so the ``.cuda()`` calls of the training loops become no-ops.
+
+    ``report()`` summarizes the queue depth seen by the training loop: a queue that is
+    mostly empty means the input pipeline is the bottleneck, a full one means compute is.
+    """
+    def __init__(self, loader, depth=2, device=None):
+        self.loader = loader
+        self.depth = depth
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.cuda = self.device.type == 'cuda'
+        self.stream = torch.cuda.Stream(self.device) if self.cuda else None
+        self.slots = [None] * (depth + 2)
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def reset_stats(self):
+        self.batches = 0
+        self.empty = 0
+        self.depth_sum = 0
+        self.wait = 0.
+
+    def report(self):
+        if self.batches == 0:
+            return 'prefetch: no batches'
+        return ('prefetch: %d batches, mean queue depth %.2f/%d, empty on %.1f%% of the steps, waited %.2fs'
+                % (self.batches, self.depth_sum / float(self.batches), self.depth,
+                   100. * self.empty / self.batches, self.wait))
+
+    def _stage(self, slot, batch):
+        """Copy ``batch`` into the buffers of ``slot``, growing them when a batch does not fit."""
+        buffers = self.slots[slot] or []
+        staged = []
+        for i, item in enumerate(batch):
+            if not torch.is_tensor(item):
+                staged.append(item)
+                continue
+            if i >= len(buffers):
+                buffers += [None] * (i + 1 - len(buffers))
+            buf = buffers[i]
+            if buf is None or buf.dtype != item.dtype or buf.shape[1:] != item.shape[1:] or len(buf) < len(item):
+                buf = torch.empty(item.shape, dtype=item.dtype)
+                buf = buf.pin_memory() if self.cuda else buf.share_memory_()
+                buffers[i] = buf
+            staged.append(buf[:len(item)].copy_(item))
+        self.slots[slot] = buffers
+        return staged
+
+    @staticmethod
+    def _wait(fn, stop):
+        """Retry a blocking queue call until it succeeds or the consumer has gone away."""
+        while not stop.is_set():
+            try:
+                return True, fn(timeout=0.1)
+            except (queue.Empty, queue.Full):
+                pass
+        return False, None
+
+    def _fill(self, ready, free, stop):
+        try:
+            for batch in self.loader:
+                ok, item = self._wait(free.get, stop)
+                if not ok:
+                    return
+                slot, event = item
+                if event is not None:
+                    event.synchronize()
+                single = not isinstance(batch, (tuple, list))
+                staged = self._stage(slot, [batch] if single else batch)
+                if not self._wait(lambda timeout: ready.put((slot, staged, single), timeout=timeout), stop)[0]:
+                    return
+        except Exception as e:
+            self._wait(lambda timeout: ready.put(e, timeout=timeout), stop)
+            return
+        self._wait(lambda timeout: ready.put(None, timeout=timeout), stop)
+
+    def _next(self, ready, free, block=True):
+        """Take the next staged batch and issue its host->device copy, ``None`` at the end.
+
+        With ``block=False`` returns ``_PENDING`` instead of waiting when nothing is staged yet.
+        """
+        if not block and ready.empty():
+            return _PENDING
+        self.depth_sum += ready.qsize()
+        self.empty += ready.empty()
+        t = time.time()
+        item = ready.get()
+        self.wait += time.time() - t
+        if item is None:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        slot, staged, single = item
+        self.batches += 1
+        if not self.cuda:
+            return slot, None, staged[0] if single else staged
+        with torch.cuda.stream(self.stream):
+            moved = [x.to(self.device, non_blocking=True) if torch.is_tensor(x) else x for x in staged]
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        free.put((slot, event))
+        return None, event, moved[0] if single else moved
+
+    def __iter__(self):
+        ready = queue.Queue(maxsize=self.depth)
+        free = queue.Queue()
+        for slot in range(len(self.slots)):
+            free.put((slot, None))
+        stop = threading.Event()
+        filler = threading.Thread(target=self._fill, args=(ready, free, stop))
+        filler.daemon = True
+        filler.start()
+        try:
+            current = self._next(ready, free)
+            while current is not None:
+                slot, event, batch = current
+                if event is not None:
+                    torch.cuda.current_stream().wait_event(event)
+                    for x in (batch if isinstance(batch, list) else [batch]):
+                        if torch.is_tensor(x):
+                            x.record_stream(torch.cuda.current_stream())
+                # start copying the next batch while this one is being trained on, if it is staged
+                upcoming = self._next(ready, free, block=False) if self.cuda else _PENDING
+                yield batch
+                if slot is not None:
+                    # CPU batches are the slot buffers themselves, recycle them once consumed
+                    free.put((slot, None))
+                current = self._next(ready, free) if upcoming is _PENDING else upcoming
+        finally:
+            stop.set()
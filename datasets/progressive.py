@@ -0,0 +1,77 @@
+''' Progressive-resolution schedules of the training runs'''
+
+from __future__ import print_function
+import torch
+from datasets import augment
+
+
+def set_batch_size(loader, batch_size):
+    """Change the batch size of a DataLoader (or of the one a ``prefetch.Prefetcher`` wraps) between two epochs.
+
+    The loader batches the indices of its sampler in the main process, so the next epoch picks
+    the new size up; the samplers count positions in samples, so snapshots resume across it.
+    """
+    loader = getattr(loader, 'loader', loader)
+    if getattr(loader.batch_sampler, 'batch_size', None) is None:
+        raise Exception('the batch size of a custom batch_sampler cannot be scheduled...')
+    loader.batch_sampler.batch_size = batch_size
+
+
+class ProgressiveResizing(object):
+    """Input size, batch size and learning-rate scale of every epoch of a progressive-resolution run.
+
+    The side of the training images ramps linearly from ``min_scale * size`` at ``first_epoch``
+    to ``size`` at ``end_epoch`` and stays there until the end of the run, so the last epochs,
+    where the learning rate has decayed, see the full resolution. Sizes are rounded to ``step``
+    pixels, so ``cudnn.benchmark`` tunes only a few shapes, and never go below ``min_size``
+    (the 8x8 that the three stride-2 stages of ``Teacher`` and ``CNN_RIS`` need).
+
+    The cost of a step goes like the number of pixels, so the batch grows by ``(size / s)²``,
+    up to ``max_batch_scale`` times the base one, and the learning rate linearly with it. The
+    networks end with adaptive average pooling and accept every size; the test set stays at
+    full resolution.
+    """
+    def __init__(self, size, batch_size, first_epoch, end_epoch, min_scale=0.5, step=4, min_size=8, max_batch_scale=4):
+        self.size = size
+        self.batch_size = batch_size
+        self.first_epoch = first_epoch
+        self.end_epoch = end_epoch
+        self.min_scale = min_scale
+        self.step = step
+        self.min_size = min_size
+        self.max_batch_scale = max_batch_scale
+
+    def input_size(self, epoch):
+        if epoch >= self.end_epoch:
+            return self.size
+        frac = max(0., float(epoch - self.first_epoch) / max(1, self.end_epoch - self.first_epoch))
+        side = self.size * (self.min_scale + (1. - self.min_scale) * frac)
+        return min(self.size, max(self.min_size, self.step * int(round(side / self.step))))
+
+    def train_bs(self, epoch):
+        scale = min(self.max_batch_scale, (float(self.size) / self.input_size(epoch)) ** 2)
+        return max(self.batch_size, int(self.batch_size * scale))
+
+    def lr_scale(self, epoch):
+        return self.train_bs(epoch) / float(self.batch_size)
+
+    def begin(self, epoch, loader):
+        """Set the batch size of ``epoch`` on the training loader, returns the input size of the epoch."""
+        set_batch_size(loader, self.train_bs(epoch))
+        return self.input_size(epoch)
+
+    def resize(self, imgs, size):
+        """Antialiased resize of a (N, C, H, W) batch, or of the uint8 (N, H, W, C) one of ``--uint8_input``, to ``size``.
+
+        uint8 batches come out as float pixels in [0, 255], which ``set_input_norm`` takes as well.
+        """
+        channels_last = imgs.dtype == torch.uint8 and imgs.size(-1) == 3
+        if imgs.shape[1:3] == (size, size) if channels_last else imgs.shape[-2:] == (size, size):
+            return imgs
+        if channels_last:
+            imgs = imgs.permute(0, 3, 1, 2)
+        return augment.resize(imgs.float(), size)
+
+    def report(self, epoch):
+        return 'progressive: epoch %d at %dx%d, batch size %d, lr x%.2f' % (
+            epoch, self.input_size(epoch), self.input_size(epoch), self.train_bs(epoch), self.lr_scale(epoch))
@@ -0,0 +1,93 @@
+''' Consensus-based pruning of the distillation epochs'''
+
+from __future__ import print_function
+import numpy as np
+import torch
+import torch.nn.functional as F
+from datasets import sampler
+
+
+class ConsensusPruner(sampler.PlannedSampler):
+    """Training order that down-samples the images the teachers and the student have solved.
+
+    Every time an image is trained on, ``update`` records how many of the ``num_teachers``
+    teachers classify it correctly (the count of ``losses.KW_Variance``), the margin of the
+    teacher ensemble (target probability minus the best other one) and the per-sample loss of
+    the student, in compact uint8/float16 tables. An image is *solved* when every teacher is
+    right, the ensemble margin is at least ``margin`` and the student loss is below the mean
+    loss of the scored images. Each epoch then keeps a solved image with probability
+    ``1 - ratio`` and ``weights`` scales the loss of the kept ones by ``1 / (1 - ratio)``, so
+    the expected gradient of the epoch does not change while its cost does.
+
+    Images are re-scored whenever they are drawn; besides, every ``recheck_every``-th epoch
+    and all epochs from ``anneal_epoch`` on are full passes that refresh every score and let
+    the model settle on the whole set. Never scored images are never pruned, so the first
+    epoch is full too. Resumes like every ``sampler.PlannedSampler``.
+    """
+    state_keys = ('agree', 'margins', 'loss', 'scored', 'downsampled', 'num_solved', 'trained', 'full')
+
+    def __init__(self, num, num_teachers=4, ratio=0.5, margin=0.5, recheck_every=5, anneal_epoch=None,
+                 sorted_batches=False, seed=0):
+        super(ConsensusPruner, self).__init__(num, sorted_batches=sorted_batches, seed=seed)
+        self.num_teachers = num_teachers
+        self.ratio = ratio
+        self.margin = margin
+        self.recheck_every = recheck_every
+        self.anneal_epoch = anneal_epoch
+        self.agree = np.zeros(num, dtype=np.uint8)
+        self.margins = np.zeros(num, dtype=np.float16)
+        self.loss = np.zeros(num, dtype=np.float16)
+        self.scored = np.zeros(num, dtype=bool)
+        self.downsampled = np.zeros(num, dtype=bool)
+        self.num_solved = 0
+        self.trained = 0
+        self.full = 0
+
+    def full_pass(self, epoch):
+        return (self.ratio <= 0 or (self.recheck_every > 0 and epoch % self.recheck_every == 0)
+                or (self.anneal_epoch is not None and epoch >= self.anneal_epoch))
+
+    def solved(self):
+        if not self.scored.any():
+            return self.scored.copy()
+        mean_loss = self.loss[self.scored].astype(np.float32).mean()
+        return (self.scored & (self.agree == self.num_teachers) & (self.margins >= self.margin)
+                & (self.loss.astype(np.float32) < mean_loss))
+
+    def draw(self, epoch, rng):
+        self.downsampled[:] = False
+        if self.full_pass(epoch):
+            plan = rng.permutation(self.num)
+        else:
+            solved = np.flatnonzero(self.solved())
+            self.downsampled[solved] = True
+            dropped = solved[rng.random(len(solved)) < self.ratio]
+            self.downsampled[dropped] = False
+            keep = np.ones(self.num, dtype=bool)
+            keep[dropped] = False
+            plan = rng.permutation(np.flatnonzero(keep))
+        self.num_solved = int(self.downsampled.sum()) + (self.num - len(plan))
+        self.trained += len(plan)
+        self.full += self.num
+        return plan
+
+    def weights(self, indices, device=None):
+        """Loss weights that keep the pruned epoch unbiased: ``1 / (1 - ratio)`` on the down-sampled images."""
+        weights = np.where(self.downsampled[indices], 1. / (1. - self.ratio), 1.).astype(np.float32)
+        return torch.from_numpy(weights).to(device)
+
+    def update(self, indices, teacher_outputs, target, student_loss):
+        """Score the images of a batch from the logits of every teacher and the per-sample student loss."""
+        with torch.no_grad():
+            self.agree[indices] = torch.stack([out.argmax(1) for out in teacher_outputs]).eq(target).sum(0).cpu().numpy()
+            probs = F.softmax(sum(teacher_outputs) / len(teacher_outputs), dim=1)
+            true = probs.gather(1, target.view(-1, 1)).squeeze(1)
+            other = probs.scatter(1, target.view(-1, 1), -1.).max(1)[0]
+            self.margins[indices] = (true - other).cpu().numpy()
+            self.loss[indices] = student_loss.detach().float().cpu().numpy()
+        self.scored[indices] = True
+
+    def report(self):
+        return ('pruning: epoch %d trained on %d/%d images (%.1f%% pruned, %d solved), %.1f%% of the passes saved so far'
+                % (self.plan_epoch, len(self.plan), self.num, 100. * (1 - len(self.plan) / float(self.num)),
+                   self.num_solved, 100. * (1 - self.trained / float(max(1, self.full)))))
@@ -0,0 +1,247 @@
+''' Samplers of the training sets: resumable shuffles, repeated-augmentation, class-balanced and block-shuffled orders'''
+
+from __future__ import print_function
+import numpy as np
+import torch.utils.data as data
+
+
+def _distinct(rng, n, k):
+    """``k`` distinct integers of ``[0, n)`` in O(k): redraw the collisions, permute small ranges."""
+    if 2 * k >= n:
+        return rng.permutation(n)[:k]
+    picked = np.unique(rng.integers(0, n, k))
+    while len(picked) < k:
+        picked = np.unique(np.concatenate([picked, rng.integers(0, n, k - len(picked))]))
+    return rng.permutation(picked)
+
+
+def _seeds(rng, n):
+    """Per-sample seeds of the random transforms, see ``datasets.generic.seeded``."""
+    return rng.integers(0, 2 ** 62, n).tolist()
+
+
+class ResumableSampler(data.Sampler):
+    """Random permutation of ``range(num)`` that a snapshot can resume mid-epoch.
+
+    The order and the per-sample transform seeds of an epoch are a pure function of
+    ``(seed, epoch)``, so ``set_epoch(epoch, start)`` skips the ``start`` samples that were
+    already trained on and the rest of the epoch comes out exactly as it would have. Yields
+    ``(index, sample_seed)`` pairs, which the store datasets unpack in ``__getitem__``.
+    """
+    def __init__(self, num, seed=0):
+        self.num = num
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    @property
+    def num_samples(self):
+        return self.num
+
+    def __len__(self):
+        return max(0, self.num - self.start)
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        order, seeds = rng.permutation(self.num).tolist(), _seeds(rng, self.num)
+        start, self.start = self.start, 0
+        self.epoch += 1
+        for i in range(start, self.num):
+            yield order[i], seeds[i]
+
+
+class RepeatedAugmentSampler(ResumableSampler):
+    """Random ``num // repeats`` distinct images per epoch, for datasets that make ``repeats`` views of each.
+
+    With ``repeats`` augmented views of every image it loads (``repeats`` of the store datasets),
+    the loader still hands the training loop about ``num`` samples per epoch, so the number of
+    steps and the learning-rate schedule do not change while every image is read and decoded
+    ``repeats`` times less often. The images left out vary from epoch to epoch. ``num_samples``
+    and the ``start`` of ``set_epoch`` count views, as ``snapshot.Snapshot`` does; otherwise it
+    resumes like ``ResumableSampler``.
+    """
+    def __init__(self, num, repeats=2, seed=0):
+        super(RepeatedAugmentSampler, self).__init__(num, seed=seed)
+        self.repeats = repeats
+
+    @property
+    def num_images(self):
+        return max(1, self.num // self.repeats)
+
+    @property
+    def num_samples(self):
+        return self.num_images * self.repeats
+
+    def __len__(self):
+        return max(0, self.num_images - self.start // self.repeats)
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        order, seeds = rng.permutation(self.num)[:self.num_images].tolist(), _seeds(rng, self.num_images)
+        start, self.start = self.start // self.repeats, 0
+        self.epoch += 1
+        for i in range(start, self.num_images):
+            yield order[i], seeds[i]
+
+
+class PlannedSampler(ResumableSampler):
+    """Base of the samplers whose epoch order depends on what the training has seen so far.
+
+    ``draw(epoch, rng)`` returns the indices of an epoch; they are drawn once, when the epoch
+    starts, and kept in ``state_dict`` with the per-sample tables listed in ``state_keys``, so
+    a snapshot resumes the epoch with the same plan. ``next_batch`` hands the training loop the
+    indices of the batch it is about to receive; ``sorted_batches`` follows the ``batched``
+    datasets, which return the images of a batch sorted by index.
+    """
+    state_keys = ()
+
+    def __init__(self, num, sorted_batches=False, seed=0):
+        super(PlannedSampler, self).__init__(num, seed=seed)
+        self.sorted_batches = sorted_batches
+        self.plan = None
+        self.plan_epoch = None
+        self.cursor = 0
+
+    @property
+    def num_samples(self):
+        return self.num if self.plan is None else len(self.plan)
+
+    def __len__(self):
+        return max(0, self.num_samples - self.start)
+
+    def draw(self, epoch, rng):
+        raise NotImplementedError
+
+    def set_epoch(self, epoch, start=0):
+        super(PlannedSampler, self).set_epoch(epoch, start)
+        self.cursor = start
+        if epoch != self.plan_epoch:
+            self.plan = self.draw(epoch, np.random.default_rng([self.seed, epoch]))
+            self.plan_epoch = epoch
+
+    def __iter__(self):
+        seeds = _seeds(np.random.default_rng([self.seed, self.plan_epoch, 1]), len(self.plan))
+        start, self.start = self.start, 0
+        for i in range(start, len(self.plan)):
+            yield int(self.plan[i]), seeds[i]
+
+    def next_batch(self, n):
+        """Indices of the next ``n`` images the training loop receives."""
+        indices = self.plan[self.cursor:self.cursor + n]
+        self.cursor += n
+        return np.sort(indices) if self.sorted_batches else indices
+
+    def state_dict(self):
+        return dict((key, getattr(self, key)) for key in self.state_keys + ('plan', 'plan_epoch'))
+
+    def load_state_dict(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class ClassBalancedBatchSampler(data.Sampler):
+    """Batches of ``P = batch_size // samples_per_class`` classes with ``K = samples_per_class``
+    images each, drawn from the ``(order, offsets)`` class index of ``store.load_class_index``.
+
+    ``samples_per_class=1`` gives plain class-balanced batches. Classes are drawn uniformly,
+    without replacement within a batch when there are enough of them; the K images of a class
+    are distinct unless the class is smaller than K. Every batch costs O(batch_size), whatever
+    the number of images or classes. An epoch has ``len(order) // batch_size`` batches unless
+    ``num_batches`` is given, so the epoch length of the training scripts does not change.
+    Batches are lists of ``(index, sample_seed)`` pairs and ``set_epoch(epoch, start)`` resumes
+    an epoch after ``start`` samples, like ``ResumableSampler``.
+    """
+    def __init__(self, class_index, batch_size, samples_per_class=1, num_batches=None, seed=0):
+        self.order, self.offsets = class_index
+        self.classes = np.flatnonzero(np.diff(self.offsets) > 0)
+        self.samples_per_class = samples_per_class
+        self.classes_per_batch = max(1, batch_size // samples_per_class)
+        self.num_batches = num_batches or max(1, len(self.order) // batch_size)
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    @property
+    def num_samples(self):
+        return self.num_batches * self.classes_per_batch * self.samples_per_class
+
+    def __len__(self):
+        return max(0, self.num_batches - self.start // (self.classes_per_batch * self.samples_per_class))
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def _batch(self, rng):
+        P, K = self.classes_per_batch, self.samples_per_class
+        if P <= len(self.classes):
+            classes = self.classes[_distinct(rng, len(self.classes), P)]
+        else:
+            classes = self.classes[rng.integers(0, len(self.classes), P)]
+        if K == 1:
+            batch = self.order[self.offsets[classes] + rng.integers(0, self.offsets[classes + 1] - self.offsets[classes])]
+        else:
+            batch = []
+            for c in classes:
+                start, size = self.offsets[c], self.offsets[c + 1] - self.offsets[c]
+                picks = _distinct(rng, size, K) if K <= size else rng.integers(0, size, K)
+                batch.append(self.order[start + picks])
+            batch = np.concatenate(batch)
+        return list(zip(batch.tolist(), _seeds(rng, len(batch))))
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        skip = self.num_batches - len(self)
+        self.start = 0
+        self.epoch += 1
+        for b in range(self.num_batches):
+            # the skipped batches are still drawn, so the generator reaches the same state
+            batch = self._batch(rng)
+            if b >= skip:
+                yield batch
+
+
+class BlockShuffleSampler(data.Sampler):
+    """Random order that stays local to blocks of ``chunks_per_block`` chunks of ``chunk_size`` images.
+
+    Every epoch the chunks are shuffled, consecutive groups of ``chunks_per_block`` chunks form
+    a block, and the images of a block are shuffled together. A worker with an LRU of at least
+    ``chunks_per_block`` decoded chunks (``datasets.packed.ChunkedArray``) then decompresses each
+    chunk at most once per block instead of once per image. Larger blocks mix more.
+    Yields ``(index, sample_seed)`` pairs and resumes like ``ResumableSampler``.
+    """
+    def __init__(self, num, chunk_size, chunks_per_block=8, seed=0):
+        self.num = num
+        self.chunk_size = chunk_size
+        self.chunks_per_block = chunks_per_block
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    @property
+    def num_samples(self):
+        return self.num
+
+    def __len__(self):
+        return max(0, self.num - self.start)
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        start, self.start = self.start, 0
+        self.epoch += 1
+        num_chunks = (self.num + self.chunk_size - 1) // self.chunk_size
+        chunks = rng.permutation(num_chunks)
+        order = np.concatenate([rng.permutation(np.concatenate([np.arange(c * self.chunk_size, min((c + 1) * self.chunk_size, self.num))
+                                                                for c in chunks[b:b + self.chunks_per_block]]))
+                                for b in range(0, num_chunks, self.chunks_per_block)])
+        seeds = _seeds(rng, self.num)
+        for i in range(start, self.num):
+            yield int(order[i]), seeds[i]
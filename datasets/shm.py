@@ -0,0 +1,152 @@
+''' Host-wide shared-memory copies of the image stores'''
+
+from __future__ import print_function
+import os
+import json
+import atexit
+import fcntl
+import numpy as np
+from datasets import store
+
+
+SHM_ROOT = '/dev/shm'
+
+# segments this process holds a reference to, released at exit
+_attached = set()
+
+
+def segment_prefix(data_name, split, shm_root=SHM_ROOT):
+    return os.path.join(shm_root, 'mtkd_%s_%s' % (data_name, store.split_prefix(split)))
+
+
+def _source_tag(data_name, root):
+    """What the segment was copied from, so a re-converted store invalidates it."""
+    if store.has_store(data_name, root):
+        path = os.path.join(store.store_dir(data_name, root), 'meta.json')
+    else:
+        path = store.h5_path(data_name, root)
+    st = os.stat(path)
+    return {'source': os.path.abspath(path), 'mtime': st.st_mtime, 'size': st.st_size}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _live_refs(prefix):
+    """Pids holding the segment; references of dead processes (crashed runs, DataLoader workers) are dropped."""
+    refs = prefix + '.refs'
+    if not os.path.isdir(refs):
+        return []
+    pids = []
+    for name in os.listdir(refs):
+        if _alive(int(name)):
+            pids.append(int(name))
+        else:
+            os.remove(os.path.join(refs, name))
+    return pids
+
+
+def _remove(prefix):
+    for suffix in ('_pixel.npy', '_label.npy', '.json'):
+        if os.path.exists(prefix + suffix):
+            os.remove(prefix + suffix)
+
+
+class _Lock(object):
+    """Exclusive ``flock`` on ``<prefix>.lock``; the last release unlinks the file, so a lock taken
+    on an unlinked file is dropped and taken again on the current one."""
+    def __init__(self, prefix):
+        self.path = prefix + '.lock'
+
+    def __enter__(self):
+        while True:
+            self.f = open(self.path, 'a')
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self.f.fileno()).st_ino:
+                    return self
+            except FileNotFoundError:
+                pass
+            self.f.close()
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def attach(data_name, split, root='datasets', shm_root=SHM_ROOT):
+    """Hold the host-wide copy of a split in ``shm_root`` and return its prefix for ``open_segment``.
+
+    The first process populates ``mtkd_<name>_<split>_{pixel,label}.npy`` under an exclusive
+    lock; every later run just maps the same pages. Each holder registers itself under
+    ``<segment>.refs/<pid>``, the references of dead processes are dropped on every attach,
+    and the last live holder removes the segment at exit. Attach in the main process:
+    DataLoader workers leave through ``os._exit`` and never run their exit handlers, so
+    they only ``open_segment`` the prefix their parent holds.
+    """
+    prefix = segment_prefix(data_name, split, shm_root)
+    tag = _source_tag(data_name, root)
+    with _Lock(prefix):
+        live = _live_refs(prefix)
+        current = None
+        if os.path.exists(prefix + '.json'):
+            with open(prefix + '.json') as f:
+                current = json.load(f)
+        if current != tag:
+            if current is not None and live:
+                raise Exception('%s is in use by runs of an older %s store...' % (prefix, data_name))
+            _remove(prefix)
+            pixels, labels = store.load_split(data_name, split, root)
+            out = np.lib.format.open_memmap(prefix + '_pixel.npy.tmp', mode='w+', dtype=np.uint8, shape=pixels.shape)
+            for start in range(0, len(pixels), 2048):
+                out[start:start + 2048] = pixels[start:start + 2048]
+            out.flush()
+            del out
+            np.save(prefix + '_label.tmp.npy', np.asarray(labels))
+            os.replace(prefix + '_pixel.npy.tmp', prefix + '_pixel.npy')
+            os.replace(prefix + '_label.tmp.npy', prefix + '_label.npy')
+            with open(prefix + '.json', 'w') as f:
+                json.dump(tag, f)
+            print('%s %s copied to %s' % (data_name, split, shm_root))
+        if not os.path.isdir(prefix + '.refs'):
+            os.makedirs(prefix + '.refs')
+        open(os.path.join(prefix + '.refs', str(os.getpid())), 'w').close()
+    _attached.add(prefix)
+    return prefix
+
+
+def open_segment(prefix):
+    """Read-only ``(pixels, labels)`` maps of a segment that a live process holds."""
+    return np.load(prefix + '_pixel.npy', mmap_mode='r'), np.load(prefix + '_label.npy', mmap_mode='r')
+
+
+def load_split(data_name, split, root='datasets', shm_root=SHM_ROOT):
+    """Like ``store.load_split``, but backed by the host-wide copy that this process holds (``attach``)."""
+    return open_segment(attach(data_name, split, root, shm_root))
+
+
+def release(prefix):
+    """Drop this process' reference; the last live holder removes the segment, its references and its lock."""
+    with _Lock(prefix) as lock:
+        ref = os.path.join(prefix + '.refs', str(os.getpid()))
+        if os.path.exists(ref):
+            os.remove(ref)
+        if not _live_refs(prefix):
+            _remove(prefix)
+            if os.path.isdir(prefix + '.refs'):
+                os.rmdir(prefix + '.refs')
+            os.remove(lock.path)
+    _attached.discard(prefix)
+
+
+@atexit.register
+def _release_all():
+    for prefix in list(_attached):
+        release(prefix)
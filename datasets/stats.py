@@ -0,0 +1,169 @@
+''' Normalization statistics of the image stores'''
+
+from __future__ import print_function
+import os
+import json
+import multiprocessing
+import numpy as np
+import torch
+from datasets import store
+from datasets import augment
+
+
+# (mean, std) per view, measured with get_mean_std.py:
+#   teacher       RandomCrop(92) + RandomHorizontalFlip training images
+#   teacher_test  TenCrop(92) test crops
+#   student       the teacher view resized to 44
+#   student_test  TenCrop(44) of the Resize(48) test images
+NORM_STATS = {
+    'RAF': {
+        'teacher': ((0.5884594, 0.45767313, 0.40865755), (0.25717735, 0.23602168, 0.23505741)),
+        'teacher_test': ((0.589667, 0.45717254, 0.40727714), (0.25235596, 0.23242524, 0.23155019)),
+        'student': ((0.58846486, 0.45766878, 0.40865615), (0.2516557, 0.23020789, 0.22939532)),
+        'student_test': ((0.59003043, 0.4573948, 0.40749523), (0.2465465, 0.22635746, 0.22564183)),
+    },
+    'PET': {
+        'teacher': ((0.47950855, 0.4454716, 0.3953508), (0.26221144, 0.25676072, 0.2640482)),
+        'teacher_test': ((0.486185, 0.45276144, 0.39575183), (0.2640792, 0.25989106, 0.26799843)),
+        'student': ((0.4794851, 0.44543326, 0.39531776), (0.24786888, 0.24236518, 0.24950708)),
+        'student_test': ((0.4862494, 0.45275217, 0.39576027), (0.24864933, 0.2446337, 0.2527274)),
+    },
+    'colorferet': {
+        'teacher': ((0.50150657, 0.4387828, 0.37715995), (0.22249317, 0.24526535, 0.25831717)),
+        'teacher_test': ((0.49930117, 0.43744352, 0.37612754), (0.22151423, 0.24302939, 0.2520711)),
+        'student': ((0.50166893, 0.43892872, 0.37727863), (0.21588857, 0.23875234, 0.25212118)),
+        'student_test': ((0.4992823, 0.4371743, 0.37574747), (0.21377444, 0.23534843, 0.24466512)),
+    },
+    'FairFace': {
+        'teacher': ((0.4911152, 0.36028033, 0.30489963), (0.25160596, 0.21829675, 0.21198231)),
+        'teacher_test': ((0.49167913, 0.36098105, 0.30529523), (0.24649838, 0.21503104, 0.20875944)),
+        'student': ((0.4911364, 0.3602937, 0.3049148), (0.24722975, 0.21383813, 0.20771481)),
+        'student_test': ((0.49202734, 0.36110377, 0.30535242), (0.24179104, 0.21022305, 0.20413795)),
+    },
+}
+
+
+def registry_path(root='datasets'):
+    return os.path.join(root, 'norm_stats.json')
+
+
+def read_registry(root='datasets'):
+    if not os.path.exists(registry_path(root)):
+        return {}
+    with open(registry_path(root)) as f:
+        return json.load(f)
+
+
+def save_stats(data_name, values, root='datasets'):
+    """Record ``{view: (mean, std)}`` of ``data_name`` in ``norm_stats.json``."""
+    registry = read_registry(root)
+    entry = registry.setdefault(data_name, {})
+    for view, (mean, std) in values.items():
+        entry[view] = [[float(v) for v in mean], [float(v) for v in std]]
+    path = registry_path(root)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def view_key(view, S_size=44):
+    """Registry key of a view; the student views of other resolutions get the size appended."""
+    if view.startswith('student') and S_size != 44:
+        return '%s_%d' % (view, S_size)
+    return view
+
+
+def norm_stats(data_name, view, S_size=44, root='datasets'):
+    """Return ``(mean, std)`` of a view.
+
+    ``norm_stats.json`` written by get_mean_std.py wins over the built-in table; a student view
+    without statistics for ``S_size`` falls back to the 44x44 ones.
+    """
+    entry = read_registry(root).get(data_name, {})
+    for key in (view_key(view, S_size), view):
+        if key in entry:
+            return tuple(entry[key][0]), tuple(entry[key][1])
+    if data_name in NORM_STATS and view in NORM_STATS[data_name]:
+        return NORM_STATS[data_name][view]
+    raise Exception('No %s normalization statistics for %s, run get_mean_std.py...' % (view, data_name))
+
+
+class RunningStats(object):
+    """Exact per-channel mean/std, merged batch by batch with Chan's parallel Welford update."""
+    def __init__(self, channels=3):
+        self.count = 0
+        self.mean = np.zeros(channels)
+        self.m2 = np.zeros(channels)
+
+    def update(self, imgs):
+        """Add a float (..., C, H, W) batch."""
+        x = imgs.movedim(-3, 0).reshape(imgs.shape[-3], -1).double()
+        mean = x.mean(1)
+        m2 = ((x - mean[:, None]) ** 2).sum(1)
+        self.merge(x.shape[1], mean.cpu().numpy(), m2.cpu().numpy())
+
+    def merge(self, count, mean, m2):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / float(total))
+        self.count = total
+
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+
+def _chunk_stats(job):
+    """Accumulate every view over ``[start, end)`` of one split; runs in a worker process."""
+    data_name, split, start, end, sizes, batch_size, seed, root = job
+    torch.set_num_threads(1)
+    torch.manual_seed(seed + start)
+    pixels, _ = store.load_split(data_name, split, root)
+    acc = {}
+
+    def add(view, imgs):
+        acc.setdefault(view, RunningStats()).update(imgs)
+
+    for first in range(start, end, batch_size):
+        imgs = torch.from_numpy(np.array(pixels[first:min(first + batch_size, end)]))
+        if split == 'Training':
+            crops = augment.to_float(augment.random_crop_flip(imgs, 92))
+            add('teacher', crops)
+            for size in sizes:
+                add(view_key('student', size), augment.resize(crops, size))
+        else:
+            add('teacher_test', augment.ten_crop(imgs.permute(0, 3, 1, 2), 92).float().div_(255))
+            for size in sizes:
+                resized = augment.resize(augment.to_float(imgs), augment.TEST_RESIZE.get(size, 48))
+                add(view_key('student_test', size), augment.ten_crop(resized, size))
+    return dict((view, (s.count, s.mean, s.m2)) for view, s in acc.items())
+
+
+def compute_stats(data_name, sizes=(44,), batch_size=256, num_workers=1, chunk=4096, seed=0, root='datasets'):
+    """One pass over both splits of ``data_name``, returns ``{view: (mean, std)}``.
+
+    Training images give the ``teacher`` view (RandomCrop(92) + flip) and the ``student`` view
+    of every size in ``sizes`` (the same crop resized); test images give ``teacher_test``
+    (TenCrop(92)) and ``student_test`` (TenCrop(S_size) of the resized image). The splits are
+    cut into chunks that ``num_workers`` processes accumulate independently.
+    """
+    jobs = []
+    for split in ('Training', 'PrivateTest'):
+        num = store.split_size(data_name, split, root)
+        jobs += [(data_name, split, start, min(start + chunk, num), tuple(sizes), batch_size, seed, root)
+                 for start in range(0, num, chunk)]
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        results = pool.map(_chunk_stats, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [_chunk_stats(job) for job in jobs]
+
+    total = {}
+    for result in results:
+        for view, (count, mean, m2) in result.items():
+            total.setdefault(view, RunningStats()).merge(count, mean, m2)
+    return dict((view, (s.mean, s.std())) for view, s in total.items())
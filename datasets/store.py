@@ -0,0 +1,245 @@
+''' Memory-mapped image store'''
+
+from __future__ import print_function
+import os
+import json
+import multiprocessing
+import numpy as np
+import h5py
+
+
+IMAGE_SIZE = 100
+
+
+def split_prefix(split):
+    return 'train' if split == 'Training' else 'valid'
+
+
+def h5_path(data_name, root='datasets'):
+    return os.path.join(root, data_name + '_data_100.h5')
+
+
+def store_dir(data_name, root='datasets'):
+    return os.path.join(root, data_name + '_store')
+
+
+def has_store(data_name, root='datasets'):
+    return os.path.exists(os.path.join(store_dir(data_name, root), 'meta.json'))
+
+
+def read_meta(data_name, root='datasets'):
+    with open(os.path.join(store_dir(data_name, root), 'meta.json')) as f:
+        return json.load(f)
+
+
+def write_meta(data_name, meta, root='datasets'):
+    path = os.path.join(store_dir(data_name, root), 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def convert_h5(data_name, root='datasets', chunk=2048):
+    """Convert ``<data_name>_data_100.h5`` into flat uint8 ``.npy`` files.
+
+    The pixels are streamed chunk by chunk into ``<split>_pixel.npy`` with shape
+    (N, 100, 100, 3) and the labels are written to ``<split>_label.npy`` as int64,
+    so the whole file never has to sit in memory during the conversion.
+    """
+    out = store_dir(data_name, root)
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    meta = {'name': data_name, 'image_size': IMAGE_SIZE, 'channels': 3, 'splits': {}}
+    with h5py.File(h5_path(data_name, root), 'r') as f:
+        for split in ('Training', 'PrivateTest'):
+            prefix = split_prefix(split)
+            labels = np.asarray(f[prefix + '_data_label']).astype(np.int64).reshape(-1)
+            pixels = f[prefix + '_data_pixel']
+            num = len(labels)
+
+            pixel_file = os.path.join(out, prefix + '_pixel.npy')
+            dst = np.lib.format.open_memmap(pixel_file + '.tmp', mode='w+', dtype=np.uint8,
+                                            shape=(num, IMAGE_SIZE, IMAGE_SIZE, 3))
+            # rows of the h5 dataset per image: 1 when stored as (N, ...), more when stored flat
+            rows = pixels.shape[0] // num
+            for start in range(0, num, chunk):
+                block = np.asarray(pixels[start * rows:(start + chunk) * rows], dtype=np.uint8)
+                block = block.reshape((-1, IMAGE_SIZE, IMAGE_SIZE, 3))
+                dst[start:start + len(block)] = block
+            dst.flush()
+            del dst
+            os.replace(pixel_file + '.tmp', pixel_file)
+            np.save(os.path.join(out, prefix + '_label.npy'), labels)
+
+            meta['splits'][prefix] = {'num': num,
+                                     'pixels': prefix + '_pixel.npy',
+                                     'labels': prefix + '_label.npy'}
+            meta['num_classes'] = max(meta.get('num_classes', 0), int(labels.max()) + 1)
+            print('%s %s: %d images' % (data_name, split, num))
+    write_meta(data_name, meta, root)
+    for split in ('Training', 'PrivateTest'):
+        build_class_index(data_name, split, root)
+    return read_meta(data_name, root)
+
+
+def load_labels(data_name, split, root='datasets'):
+    """Return the labels of one split without touching the pixels."""
+    if has_store(data_name, root):
+        entry = read_meta(data_name, root)['splits'][split_prefix(split)]
+        return np.load(os.path.join(store_dir(data_name, root), entry['labels']))
+    with h5py.File(h5_path(data_name, root), 'r') as f:
+        return np.asarray(f[split_prefix(split) + '_data_label']).astype(np.int64).reshape(-1)
+
+
+def split_size(data_name, split, root='datasets'):
+    if has_store(data_name, root):
+        return read_meta(data_name, root)['splits'][split_prefix(split)]['num']
+    return len(load_labels(data_name, split, root))
+
+
+def num_classes(data_name, root='datasets'):
+    if has_store(data_name, root):
+        meta = read_meta(data_name, root)
+        if 'num_classes' in meta:
+            return meta['num_classes']
+    labels = np.concatenate([load_labels(data_name, split, root) for split in ('Training', 'PrivateTest')])
+    return int(labels.max()) + 1
+
+
+def load_split(data_name, split, root='datasets'):
+    """Return ``(pixels, labels)`` of one split.
+
+    When the converted store exists the pixels are opened read-only with ``np.memmap``:
+    every DataLoader worker and every split then shares the same page-cache pages and no
+    process holds a private copy. Without a store the legacy h5 file is read as before.
+    Labels are always a plain ndarray so ``__getitem__`` never touches h5. A split whose raw
+    pixel file was deleted after ``datasets.packed.pack`` is served from the compressed chunks.
+    """
+    if has_store(data_name, root):
+        entry = read_meta(data_name, root)['splits'][split_prefix(split)]
+        path = store_dir(data_name, root)
+        labels = np.load(os.path.join(path, entry['labels']))
+        if not os.path.exists(os.path.join(path, entry['pixels'])):
+            # only the compressed copy of datasets.packed was kept
+            from datasets import packed
+            return packed.load_pixels(data_name, split, root=root), labels
+        pixels = np.load(os.path.join(path, entry['pixels']), mmap_mode='r')
+        return pixels, labels
+
+    prefix = split_prefix(split)
+    with h5py.File(h5_path(data_name, root), 'r', driver='core') as f:
+        labels = np.asarray(f[prefix + '_data_label']).astype(np.int64).reshape(-1)
+        pixels = np.asarray(f[prefix + '_data_pixel'], dtype=np.uint8)
+    pixels = pixels.reshape((len(labels), IMAGE_SIZE, IMAGE_SIZE, 3))
+    return pixels, labels
+
+
+def _pyramid_chunk(job):
+    """Resize rows ``[start, end)`` of a split into every level of the pyramid file; runs in a worker process."""
+    from PIL import Image
+    from torchvision import transforms
+
+    data_name, split, path, start, end, levels, num, root = job
+    pixels, _ = load_split(data_name, split, root)
+    dst = np.load(path, mmap_mode='r+')
+    resizes = [(size, transforms.Resize(size), dst[offset:offset + num * size * size * 3].reshape((num, size, size, 3)))
+               for size, offset in levels]
+    for i in range(start, end):
+        img = Image.fromarray(pixels[i])
+        for size, resize, level in resizes:
+            level[i] = np.asarray(resize(img))
+    dst.flush()
+    return end - start
+
+
+def build_pyramid(data_name, split, sizes, num_workers=8, chunk=1024, root='datasets'):
+    """Precompute ``Resize(size)`` of every image of a split for all ``sizes``.
+
+    The levels are written back to back into one flat uint8 ``<split>_pyramid.npy``
+    next to the pixels and their offsets are recorded in meta.json, so the datasets can
+    memory-map the level they need instead of resizing the same images every epoch.
+    ``num_workers`` processes resize chunks of ``chunk`` images into all levels at once and
+    write them straight into the preallocated file.
+    """
+    if not has_store(data_name, root):
+        raise Exception('Build the memory-mapped store of %s first...' % data_name)
+    num = split_size(data_name, split, root)
+    levels = {}
+    total = 0
+    for size in sizes:
+        levels[str(size)] = total
+        total += num * size * size * 3
+
+    prefix = split_prefix(split)
+    path = os.path.join(store_dir(data_name, root), prefix + '_pyramid.npy')
+    dst = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.uint8, shape=(total,))
+    del dst
+    jobs = [(data_name, split, path + '.tmp', start, min(start + chunk, num), [(size, levels[str(size)]) for size in sizes], num, root)
+            for start in range(0, num, chunk)]
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 and len(jobs) > 1 else None
+    try:
+        results = pool.imap_unordered(_pyramid_chunk, jobs) if pool is not None else map(_pyramid_chunk, jobs)
+        done = 0
+        for count in results:
+            done += count
+            print('%s %s: %d/%d images resized to %s' % (data_name, split, done, num, ','.join(str(size) for size in sizes)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    os.replace(path + '.tmp', path)
+
+    meta = read_meta(data_name, root)
+    meta.setdefault('pyramid', {})[prefix] = {'file': prefix + '_pyramid.npy', 'num': num, 'levels': levels}
+    write_meta(data_name, meta, root)
+
+
+def load_level(data_name, split, size, root='datasets'):
+    """Return the precomputed ``Resize(size)`` images of a split as a read-only (N, size, size, 3)
+    memmap, or None when that level has not been built."""
+    if not has_store(data_name, root):
+        return None
+    entry = read_meta(data_name, root).get('pyramid', {}).get(split_prefix(split))
+    if entry is None or str(size) not in entry['levels']:
+        return None
+    flat = np.load(os.path.join(store_dir(data_name, root), entry['file']), mmap_mode='r')
+    offset = entry['levels'][str(size)]
+    num = entry['num']
+    return flat[offset:offset + num * size * size * 3].reshape((num, size, size, 3))
+
+
+def class_index(labels):
+    """``(order, offsets)``: the images of class ``c`` are ``order[offsets[c]:offsets[c + 1]]``."""
+    labels = np.asarray(labels).reshape(-1)
+    order = np.argsort(labels, kind='stable').astype(np.int64)
+    offsets = np.zeros(int(labels.max()) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(labels), out=offsets[1:])
+    return order, offsets
+
+
+def build_class_index(data_name, split, root='datasets'):
+    """Write the class -> indices index of a split next to its labels and record it in meta.json."""
+    order, offsets = class_index(load_labels(data_name, split, root))
+    prefix = split_prefix(split)
+    path = store_dir(data_name, root)
+    np.save(os.path.join(path, prefix + '_class_order.npy'), order)
+    np.save(os.path.join(path, prefix + '_class_offsets.npy'), offsets)
+    meta = read_meta(data_name, root)
+    meta.setdefault('class_index', {})[prefix] = {'order': prefix + '_class_order.npy',
+                                                  'offsets': prefix + '_class_offsets.npy'}
+    write_meta(data_name, meta, root)
+    return order, offsets
+
+
+def load_class_index(data_name, split, root='datasets'):
+    """``(order, offsets)`` of a split, from the store when it was built, otherwise from the labels."""
+    if has_store(data_name, root):
+        entry = read_meta(data_name, root).get('class_index', {}).get(split_prefix(split))
+        if entry is not None:
+            path = store_dir(data_name, root)
+            return np.load(os.path.join(path, entry['order'])), np.load(os.path.join(path, entry['offsets']))
+    return class_index(load_labels(data_name, split, root))
+
+
+def class_counts(data_name, split, root='datasets'):
+    return np.diff(load_class_index(data_name, split, root)[1])
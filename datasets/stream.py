@@ -0,0 +1,118 @@
+''' Sharded streaming over the training split of an image store'''
+
+from __future__ import print_function
+import math
+import queue
+import threading
+import numpy as np
+import torch
+import torch.utils.data as data
+
+
+def dist_info():
+    """``(rank, world_size)`` of the default process group, ``(0, 1)`` outside distributed runs."""
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
+def _put(out, item, stop):
+    """Blocking put that gives up once the consumer has gone away."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class ShardedStream(data.IterableDataset):
+    """Stream a store-backed training set shard by shard instead of sampling it at random.
+
+    The split is cut into contiguous shards of ``shard_size`` images. Every epoch the shard
+    order is shuffled with the same seed on every rank, and the shards are dealt out
+    round-robin to ranks and then to DataLoader workers. A background thread reads at most
+    ``read_ahead`` shards ahead with one sequential copy each. Samples pass through a
+    shuffle buffer of ``buffer_size`` images, so memory stays constant whatever the size of
+    the split.
+
+    Args:
+        dataset: a ``datasets.generic`` dataset; its ``make_sample`` builds every sample, so
+            the stream yields exactly what the map-style dataset would.
+        shard_size (int): images per shard.
+        buffer_size (int): size of the in-memory shuffle buffer, 0 keeps the shard order.
+        read_ahead (int): shards read ahead of the one being consumed.
+        seed (int): base seed of the shard order and the shuffle buffer.
+    """
+    def __init__(self, dataset, shard_size=1024, buffer_size=4096, read_ahead=2, seed=0):
+        super(ShardedStream, self).__init__()
+        self.dataset = dataset
+        self.shard_size = shard_size
+        self.buffer_size = buffer_size
+        self.read_ahead = read_ahead
+        self.seed = seed
+        self.epoch = 0
+        self.num_shards = int(math.ceil(len(dataset) / float(shard_size)))
+
+    def set_epoch(self, epoch):
+        """Reshuffle the shards; call before iterating, like ``DistributedSampler.set_epoch``."""
+        self.epoch = epoch
+
+    def shards(self):
+        """Shard indices of this rank and DataLoader worker for the current epoch."""
+        rank, world_size = dist_info()
+        worker = data.get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        order = np.random.RandomState(self.seed + self.epoch).permutation(self.num_shards)
+        return order[rank * num_workers + worker_id::world_size * num_workers]
+
+    def _read(self, shards, out, stop):
+        pixels, labels = self.dataset.data, self.dataset.labels
+        for shard in shards:
+            start = shard * self.shard_size
+            end = min(start + self.shard_size, len(labels))
+            if not _put(out, (np.array(pixels[start:end]), np.array(labels[start:end])), stop):
+                return
+        _put(out, None, stop)
+
+    def _images(self):
+        shards = self.shards()
+        out = queue.Queue(maxsize=max(self.read_ahead, 1))
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read, args=(shards, out, stop))
+        reader.daemon = True
+        reader.start()
+        try:
+            while True:
+                block = out.get()
+                if block is None:
+                    break
+                for img, target in zip(*block):
+                    yield img, target
+        finally:
+            stop.set()
+
+    def __iter__(self):
+        rank, _ = dist_info()
+        worker = data.get_worker_info()
+        worker_id = worker.id if worker is not None else 0
+        rng = np.random.RandomState(((self.seed + self.epoch) * 1000003 + rank * 1009 + worker_id) % 2 ** 32)
+        buffer = []
+        for img, target in self._images():
+            if self.buffer_size == 0:
+                yield self.dataset.make_sample(img, target)
+                continue
+            if len(buffer) < self.buffer_size:
+                buffer.append((img, target))
+                continue
+            i = rng.randint(len(buffer))
+            buffer[i], (img, target) = (img, target), buffer[i]
+            yield self.dataset.make_sample(img, target)
+        rng.shuffle(buffer)
+        for img, target in buffer:
+            yield self.dataset.make_sample(img, target)
+
+    def __len__(self):
+        _, world_size = dist_info()
+        return int(math.ceil(len(self.dataset) / float(world_size)))
@@ -0,0 +1,302 @@
+''' Offline caches of the frozen teachers' logits and features over a fixed pool of training augmentations'''
+
+from __future__ import print_function
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from datasets import store
+from datasets import augment
+
+
+CACHE_VERSION = 1
+FP16_MAX = float(np.finfo(np.float16).max)
+# the outputs of Teacher.forward before the logits
+FEATURE_LAYERS = ('rb1', 'rb2', 'rb3', 'mimic')
+
+
+def cache_dir(root='datasets'):
+    return os.path.join(root, 'teacher_cache')
+
+
+def cache_params(data_name, checkpoint, keys, mean, std, pool=8, crop_size=92, topk=0, seed=0, root='datasets'):
+    """Everything the cached logits depend on; any change gives a new cache file.
+
+    ``checkpoint`` is the file the teachers were loaded from and ``keys`` their entries in it,
+    so retraining the teachers invalidates the cache through its mtime.
+    """
+    source = os.path.join(store.store_dir(data_name, root), 'meta.json') if store.has_store(data_name, root) \
+        else store.h5_path(data_name, root)
+    return {'version': CACHE_VERSION, 'data_name': data_name, 'checkpoint': os.path.abspath(checkpoint),
+            'checkpoint_mtime': os.stat(checkpoint).st_mtime, 'keys': list(keys),
+            'mean': [float(v) for v in mean], 'std': [float(v) for v in std], 'pool': pool,
+            'crop_size': crop_size, 'topk': topk, 'seed': seed, 'source_mtime': os.stat(source).st_mtime}
+
+
+def cache_path(params, root='datasets'):
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir(root), '%s_pool%d_%s' % (params['data_name'], params['pool'], key))
+
+
+def augment_params(num, pool, height, width, crop_size=92, seed=0):
+    """(num, pool, 3) int16 ``(top, left, flip)`` of the ``RandomCrop(crop_size)`` + ``RandomHorizontalFlip``
+    augmentations recorded for every image, a pure function of ``seed``."""
+    rng = np.random.default_rng([seed, pool])
+    out = np.empty((num, pool, 3), dtype=np.int16)
+    out[..., 0] = rng.integers(0, height - crop_size + 1, (num, pool))
+    out[..., 1] = rng.integers(0, width - crop_size + 1, (num, pool))
+    out[..., 2] = rng.random((num, pool)) < 0.5
+    return out
+
+
+def _write(path, array):
+    np.save(path + '.tmp.npy', array)
+    os.replace(path + '.tmp.npy', path + '.npy')
+
+
+def _teacher_outputs(pixels, aug, teachers, mean, std, crop_size=92, batch_size=512):
+    """Yield ``(start, slot, outputs)`` over every recorded augmentation, ``outputs`` holding the forward of each teacher.
+
+    The images are read in contiguous slices of ``batch_size``, cropped/flipped and normalized
+    on the teachers' device, and each forward covers a whole slice at one pool slot. The
+    teachers are left in eval mode with ``set_input_norm(None)``.
+    """
+    device = next(teachers[0].parameters()).device
+    for net in teachers:
+        net.eval()
+        net.set_input_norm(None)
+    for start in range(0, len(pixels), batch_size):
+        imgs = torch.from_numpy(np.array(pixels[start:start + batch_size])).to(device)
+        for slot in range(aug.shape[1]):
+            top, left, flip = torch.from_numpy(aug[start:start + len(imgs), slot].astype(np.int64)).unbind(1)
+            crops = augment.crop_flip(imgs, top, left, flip.bool(), crop_size).permute(0, 3, 1, 2)
+            with torch.no_grad():
+                inputs = augment.to_normalized(crops, mean, std)
+                yield start, slot, [net(inputs) for net in teachers]
+
+
+def _finish(path, params, arrays, aug):
+    for name, array in arrays.items():
+        array.flush()
+        os.replace(path + '_%s.tmp.npy' % name, path + '_%s.npy' % name)
+    _write(path + '_aug', aug)
+    with open(path + '.json', 'w') as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+
+
+def build(data_name, teachers, checkpoint, keys, mean, std, pool=8, crop_size=92, topk=0, seed=0, batch_size=512,
+          root='datasets'):
+    """Run every teacher over ``pool`` recorded augmentations of every training image, once, and return the cache path.
+
+    The logits are stored as float16 (N, pool, teachers, classes). With ``topk`` only the
+    ``topk`` largest logits of every teacher are kept, with their classes and the log of the
+    mean exp of the others (``tail``): the softmax at temperature 1 is then exact and the KD
+    targets at higher temperatures close to it, for many-class sets like colorferet.
+    """
+    num_classes = teachers[0].fc.out_features
+    topk = topk if topk < num_classes else 0
+    params = cache_params(data_name, checkpoint, keys, mean, std, pool, crop_size, topk, seed, root)
+    path = cache_path(params, root)
+    if os.path.exists(path + '.json'):
+        return path
+    if not os.path.isdir(cache_dir(root)):
+        os.makedirs(cache_dir(root))
+    pixels, _ = store.load_split(data_name, 'Training', root)
+    num, height, width = pixels.shape[:3]
+    aug = augment_params(num, pool, height, width, crop_size, seed)
+    if topk:
+        arrays = {'values': np.lib.format.open_memmap(path + '_values.tmp.npy', mode='w+', dtype=np.float16, shape=(num, pool, len(teachers), topk)),
+                  'classes': np.lib.format.open_memmap(path + '_classes.tmp.npy', mode='w+', dtype=np.int16, shape=(num, pool, len(teachers), topk)),
+                  'tail': np.lib.format.open_memmap(path + '_tail.tmp.npy', mode='w+', dtype=np.float16, shape=(num, pool, len(teachers)))}
+    else:
+        arrays = {'logits': np.lib.format.open_memmap(path + '_logits.tmp.npy', mode='w+', dtype=np.float16, shape=(num, pool, len(teachers), num_classes))}
+    for start, slot, outputs in _teacher_outputs(pixels, aug, teachers, mean, std, crop_size, batch_size):
+        out = torch.stack([output[-1] for output in outputs], 1).float().clamp_(-FP16_MAX, FP16_MAX)
+        rows = slice(start, start + len(out))
+        if topk:
+            top_values, top_classes = out.topk(topk, dim=2)
+            rest = out.scatter(2, top_classes, float('-inf'))
+            arrays['values'][rows, slot] = top_values.cpu().numpy()
+            arrays['classes'][rows, slot] = top_classes.cpu().numpy()
+            arrays['tail'][rows, slot] = (torch.logsumexp(rest, 2) - np.log(num_classes - topk)).cpu().numpy()
+        else:
+            arrays['logits'][rows, slot] = out.cpu().numpy()
+    params['num_classes'] = num_classes
+    _finish(path, params, arrays, aug)
+    print('teacher logits of %s (%d images x %d augmentations) written to %s' % (data_name, num, pool, path))
+    return path
+
+
+def quantize(x, dims):
+    """Symmetric int8 quantization of ``x`` with one float16 scale per slice reduced over ``dims``; returns ``(q, scale)``."""
+    scale = (x.abs().amax(dims) / 127.).clamp_(min=np.finfo(np.float16).tiny, max=FP16_MAX).half()
+    for _ in dims:
+        scale = scale.unsqueeze(-1)
+    q = torch.round(x / scale.float()).clamp_(-127, 127).to(torch.int8)
+    for _ in dims:
+        scale = scale.squeeze(-1)
+    return q, scale
+
+
+def build_features(data_name, teachers, checkpoint, keys, mean, std, layers=('rb3',), pool=8, crop_size=92, dtype='float16',
+                   sizes=None, ensemble=False, seed=0, batch_size=512, root='datasets'):
+    """Store the intermediate outputs ``layers`` of every teacher over the recorded augmentations, once; returns the cache path.
+
+    ``layers`` is any subset of ``FEATURE_LAYERS``. The augmentations are those of ``build``
+    with the same ``pool``, ``crop_size`` and ``seed``, so a ``FeatureCache`` and a
+    ``TeacherCache`` index the same crop with the same ``(index, slot)``. ``sizes`` maps a
+    layer to the side its maps are average-pooled to, typically the matching map of the
+    student (22/11/5 for ``CNN_RIS`` at 44), which divides their size by about 4. With
+    ``ensemble`` only the mean over the teachers is stored. ``dtype`` 'float16' keeps the
+    values, 'int8' quantizes them symmetrically with one float16 scale per channel of every
+    map (per vector for ``mimic``), half the size again.
+    """
+    layers = [layer for layer in FEATURE_LAYERS if layer in layers]
+    if not layers or dtype not in ('float16', 'int8'):
+        raise Exception('invalid feature cache layers %s or dtype %s...' % (layers, dtype))
+    sizes = dict((layer, int(sizes[layer])) for layer in layers if sizes and layer in sizes and layer != 'mimic')
+    params = cache_params(data_name, checkpoint, keys, mean, std, pool, crop_size, 0, seed, root)
+    params.update({'layers': layers, 'dtype': dtype, 'sizes': sizes, 'ensemble': bool(ensemble)})
+    path = cache_path(params, root)
+    if os.path.exists(path + '.json'):
+        return path
+    if not os.path.isdir(cache_dir(root)):
+        os.makedirs(cache_dir(root))
+    pixels, _ = store.load_split(data_name, 'Training', root)
+    num, height, width = pixels.shape[:3]
+    aug = augment_params(num, pool, height, width, crop_size, seed)
+    arrays = {}
+    shapes = {}
+    for start, slot, outputs in _teacher_outputs(pixels, aug, teachers, mean, std, crop_size, batch_size):
+        rows = slice(start, start + len(outputs[0][0]))
+        for layer in layers:
+            feature = [output[FEATURE_LAYERS.index(layer)] for output in outputs]
+            if layer in sizes:
+                feature = [F.adaptive_avg_pool2d(f, sizes[layer]) for f in feature]
+            feature = torch.stack(feature, 1).float()
+            if ensemble:
+                feature = feature.mean(1, keepdim=True)
+            if layer not in arrays:
+                shapes[layer] = list(feature.shape[1:])
+                shape = (num, pool) + tuple(feature.shape[1:])
+                arrays[layer] = np.lib.format.open_memmap(path + '_%s.tmp.npy' % layer, mode='w+', dtype=np.dtype(dtype), shape=shape)
+                if dtype == 'int8':
+                    arrays[layer + '_scale'] = np.lib.format.open_memmap(path + '_%s_scale.tmp.npy' % layer, mode='w+', dtype=np.float16,
+                                                                         shape=shape[:4] if feature.dim() > 3 else shape[:3])
+            if dtype == 'int8':
+                feature, scale = quantize(feature, (3, 4) if feature.dim() > 3 else (2,))
+                arrays[layer + '_scale'][rows, slot] = scale.cpu().numpy()
+            else:
+                feature = feature.clamp_(-FP16_MAX, FP16_MAX).half()
+            arrays[layer][rows, slot] = feature.cpu().numpy()
+    params['shapes'] = shapes
+    _finish(path, params, arrays, aug)
+    print('teacher features %s of %s (%d images x %d augmentations, %.1f GB) written to %s'
+          % (','.join(layers), data_name, num, pool, sum(a.nbytes for a in arrays.values()) / 1e9, path))
+    return path
+
+
+class AugmentationPool(object):
+    """Read side shared by the caches: the recorded augmentations of ``path`` and their memory-mapped arrays.
+
+    The arrays are memory-mapped on first use, inside every DataLoader worker, and dropped when pickled.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json') as f:
+            self.params = json.load(f)
+        self.pool = self.params['pool']
+        self.crop_size = self.params['crop_size']
+        self.num_teachers = len(self.params['keys'])
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def array_names(self):
+        return ()
+
+    def _open(self):
+        if self._arrays is None:
+            self._arrays = dict((name, np.load('%s_%s.npy' % (self.path, name), mmap_mode='r'))
+                                for name in ('aug',) + tuple(self.array_names()))
+        return self._arrays
+
+    def same_augmentations(self, other):
+        """Whether ``other`` recorded the very same crops/flips, so that both can be read with one ``(index, slot)``."""
+        return all(self.params[key] == other.params[key] for key in ('data_name', 'source_mtime', 'pool', 'crop_size', 'seed'))
+
+    def augmentation(self, indices, slots):
+        """``(top, left, flip)`` of the recorded augmentations, ints or int64/bool tensors for arrays of indices."""
+        aug = self._open()['aug'][indices, slots]
+        if aug.ndim == 1:
+            return int(aug[0]), int(aug[1]), bool(aug[2])
+        aug = torch.from_numpy(aug.astype(np.int64))
+        return aug[:, 0], aug[:, 1], aug[:, 2].bool()
+
+    def replay(self, img, index, slot):
+        """The crop/flip of pool slot ``slot`` applied to the PIL image of ``index``, like ``RandomCrop`` + ``RandomHorizontalFlip``."""
+        top, left, flip = self.augmentation(index, slot)
+        img = img.crop((left, top, left + self.crop_size, top + self.crop_size))
+        return img.transpose(Image.FLIP_LEFT_RIGHT) if flip else img
+
+
+class FeatureCache(AugmentationPool):
+    """Read side of a cache written by ``build_features``, handed to ``DualViewDataset(feature_cache=...)``.
+
+    ``features`` returns the float16 maps of ``layers`` the teachers computed for the crop of
+    an ``(index, slot)``, dequantized when they are stored as int8.
+    """
+    def __init__(self, path):
+        super(FeatureCache, self).__init__(path)
+        self.layers = self.params['layers']
+        self.dtype = self.params['dtype']
+        self.shapes = self.params['shapes']
+
+    def array_names(self):
+        if self.dtype == 'int8':
+            return self.layers + [layer + '_scale' for layer in self.layers]
+        return self.layers
+
+    def features(self, indices, slots):
+        """One float16 (teachers, C, H, W) map ((teachers, C) for ``mimic``) per layer, with a leading N for arrays of indices."""
+        arrays = self._open()
+        out = []
+        for layer in self.layers:
+            feature = np.array(arrays[layer][indices, slots])
+            if self.dtype == 'int8':
+                scale = np.array(arrays[layer + '_scale'][indices, slots]).astype(np.float32)
+                feature = feature.astype(np.float32) * scale.reshape(scale.shape + (1,) * (feature.ndim - scale.ndim))
+            out.append(torch.from_numpy(feature.astype(np.float16)))
+        return tuple(out)
+
+
+class TeacherCache(AugmentationPool):
+    """Read side of a cache written by ``build``, handed to ``DualViewDataset(teacher_cache=...)``.
+
+    ``replay`` recomputes the student's crop/flip of a pool slot and ``logits`` returns what the
+    teachers output for exactly that crop.
+    """
+    def __init__(self, path):
+        super(TeacherCache, self).__init__(path)
+        self.topk = self.params['topk']
+        self.num_classes = self.params['num_classes']
+
+    def array_names(self):
+        return ('values', 'classes', 'tail') if self.topk else ('logits',)
+
+    def logits(self, indices, slots):
+        """float16 (teachers, classes) logits of one ``(index, slot)``, (N, teachers, classes) for arrays of them."""
+        arrays = self._open()
+        if not self.topk:
+            return torch.from_numpy(np.array(arrays['logits'][indices, slots]))
+        values = torch.from_numpy(np.array(arrays['values'][indices, slots]))
+        classes = torch.from_numpy(np.array(arrays['classes'][indices, slots]).astype(np.int64))
+        tail = torch.from_numpy(np.array(arrays['tail'][indices, slots]))
+        out = tail.unsqueeze(-1).expand(tail.shape + (self.num_classes,)).clone()
+        return out.scatter_(-1, classes, values)
@@ -0,0 +1,66 @@
+'''Evaluate student checkpoints on every noise x severity cell of the test split.'''
+from __future__ import print_function
+
+import os
+import argparse
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from datasets import store, stats
+from datasets import augment
+from datasets import corrupt
+from datasets.generic import DualViewDataset
+from network.studentNet import CNN_RIS
+from utils import ACC_evaluation
+
+parser = argparse.ArgumentParser(description='Robustness of the students to test-set corruptions')
+parser.add_argument('--data_name', type=str, default='RAF', help='RAF,FairFace,colorferet,PET')
+parser.add_argument('--checkpoints', type=str, required=True, help='comma separated Student_Test_model.t7 files')
+parser.add_argument('--S_size', default=44, type=int, help='44,32,24,16,8')
+parser.add_argument('--noise', type=str, default='all', help='GaussianBlur,AverageBlur,MedianBlur,BilateralFilter,Salt-and-pepper or all')
+parser.add_argument('--severity', type=str, default='1,2,3,4,5', help='severities to evaluate')
+parser.add_argument('--test_bs', default=256, type=int, help='batch size')
+parser.add_argument('--num_workers', type=int, default=4, help='num_workers')
+parser.add_argument('--cuda', type=int, default=1)
+args = parser.parse_args()
+
+NUM_CLASSES = store.num_classes(args.data_name)
+noises = list(corrupt.NOISE_TYPES) if args.noise == 'all' else args.noise.split(',')
+severities = [int(severity) for severity in args.severity.split(',')]
+device = 'cuda' if args.cuda else 'cpu'
+
+snets = []
+for checkpoint in args.checkpoints.split(','):
+    snet = CNN_RIS(num_classes=NUM_CLASSES, S_size=args.S_size)
+    snet.load_state_dict(torch.load(checkpoint, map_location='cpu', weights_only=False)['snet'])
+    snets.append(snet.to(device).eval())
+
+test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'student_test', S_size=args.S_size))
+batch_tencrop = augment.TenCropNormalize(args.S_size, test_Normalize.mean, test_Normalize.std,
+                                         resize=augment.TEST_RESIZE.get(args.S_size, 48))
+
+
+def evaluate(noise, severity):
+    """Accuracy, mAP and F1 of every checkpoint; each corrupted batch is shared by all of them."""
+    testset = DualViewDataset(args.data_name, split='PrivateTest', transform=None, S_size=args.S_size,
+                              noise=noise, severity=severity)
+    testloader = torch.utils.data.DataLoader(testset, batch_size=args.test_bs, shuffle=False, num_workers=args.num_workers)
+    conf_mats = [np.zeros((NUM_CLASSES, NUM_CLASSES)) for _ in snets]
+    results = [None for _ in snets]
+    for img, target in testloader:
+        img = batch_tencrop(img.to(device, non_blocking=True))
+        test_bs, ncrops, c, h, w = img.shape
+        img = img.reshape(-1, c, h, w)
+        with torch.no_grad():
+            for i, snet in enumerate(snets):
+                outputs_avg = snet(img)[-1].view(test_bs, ncrops, -1).mean(1)
+                conf_mats[i], acc, mAP, F1_score = ACC_evaluation(conf_mats[i], outputs_avg.cpu(), target, NUM_CLASSES)
+                results[i] = (100. * acc, 100. * mAP, 100. * F1_score)
+    return results
+
+
+print('%-16s %-8s %-40s %8s %8s %8s' % ('noise', 'severity', 'checkpoint', 'acc', 'mAP', 'F1'))
+cells = [('None', 0)] + [(noise, severity) for noise in noises for severity in severities]
+for noise, severity in cells:
+    for checkpoint, (acc, mAP, F1_score) in zip(args.checkpoints.split(','), evaluate(noise, severity)):
+        print('%-16s %-8d %-40s %8.3f %8.3f %8.3f' % (noise, severity, os.path.dirname(checkpoint)[-40:], acc, mAP, F1_score))
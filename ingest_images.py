@@ -0,0 +1,30 @@
+'''Build a memory-mapped image store from folders of images or label CSVs.'''
+from __future__ import print_function
+
+import argparse
+from datasets import ingest
+
+parser = argparse.ArgumentParser(description='Ingest JPEG/PNG images into a memory-mapped store')
+parser.add_argument('--data_name', type=str, required=True, help='name of the new store, used as --data_name afterwards')
+parser.add_argument('--train', type=str, required=True, help='<class>/<image> folder tree or label CSV of the training split')
+parser.add_argument('--test', type=str, default='', help='folder tree or label CSV of the test split')
+parser.add_argument('--test_fraction', type=float, default=0.1, help='held-out fraction of --train when there is no --test')
+parser.add_argument('--image_root', type=str, default=None, help='directory the CSV paths are relative to, default the CSV directory')
+parser.add_argument('--path_col', type=str, default='file', help='CSV column with the image path')
+parser.add_argument('--label_col', type=str, default='label', help='CSV column with the label')
+parser.add_argument('--num_workers', type=int, default=8, help='decoding processes')
+parser.add_argument('--chunk', type=int, default=256, help='images per job')
+parser.add_argument('--seed', type=int, default=0, help='seed of the --test_fraction split')
+parser.add_argument('--root', type=str, default='datasets', help='directory holding the stores')
+args = parser.parse_args()
+
+read = lambda path: ingest.read_source(path, args.image_root, args.path_col, args.label_col)
+train = read(args.train)
+if args.test:
+    test = read(args.test)
+else:
+    train, test = ingest.holdout(train[0], train[1], args.test_fraction, seed=args.seed)
+print('==> Ingesting %s: %d training and %d test images..' % (args.data_name, len(train[0]), len(test[0])))
+meta = ingest.ingest(args.data_name, {'Training': train, 'PrivateTest': test}, num_workers=args.num_workers,
+                     chunk=args.chunk, root=args.root, source={'train': args.train, 'test': args.test or None})
+print('classes: ' + ', '.join(meta['class_names']))
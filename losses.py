@@ -61,8 +61,9 @@ def KW_Variance(outputs1,outputs2,outputs3,outputs4,targets,KW_Variance):
     
 
 class Diversity(nn.Module):
-    def __init__(self, direction, variance, temperature = 20):
+    def __init__(self, direction, variance, temperature = 20, reduction = 'mean'):
         super(Diversity, self).__init__()
+        self.reduction = reduction
         self.direction = direction
         self.variance = variance
         self.cos = nn.CosineSimilarity(dim=1, eps=1e-6)
@@ -89,6 +90,8 @@ class Diversity(nn.Module):
                          torch.var(preds[:,:,4],dim=0).unsqueeze(1),torch.var(preds[:,:,5],dim=0).unsqueeze(1),
                          torch.var(preds[:,:,6],dim=0).unsqueeze(1)),1)
         loss = self.direction*d - self.variance*Var.sum(1)
+        if self.reduction == 'none':
+            return loss
         final_loss = torch.mean(loss)
         return final_loss
     
@@ -146,8 +149,9 @@ class Threshold_weights(nn.Module):
 
 
 class Dynamic_MultiTeacher(nn.Module):
-    def __init__(self):
+    def __init__(self, reduction = 'mean'):
         super(Dynamic_MultiTeacher, self).__init__()
+        self.reduction = reduction
         self.calculate_dynamic_weights = Calculate_dynamic_weights().cuda()
         self.threshold_weights = Threshold_weights(temperature = 6).cuda()
         
@@ -191,8 +195,30 @@ class Dynamic_MultiTeacher(nn.Module):
         loss4 = self.CE_KD(outputs4, out_s, targets, weights41, weights42, n_test)
         loss6 = self.CE_KD(mimic, out_s, targets, weights61, weights62, n_test)
         
-        loss = (out_threshold[:,0] * loss1 + out_threshold[:,1] * loss2 + out_threshold[:,2] * loss3 + out_threshold[:,3] * loss4 + out_threshold[:,4] * loss6).mean()
+        loss = out_threshold[:,0] * loss1 + out_threshold[:,1] * loss2 + out_threshold[:,2] * loss3 + out_threshold[:,3] * loss4 + out_threshold[:,4] * loss6
+        if self.reduction == 'none':
+            return loss
         
-        return loss
+        return loss.mean()
+
+
+
+class FeatureHint(nn.Module):
+    """Mean squared error between a student map and the teachers' map of the same layer (FitNets-style hint).
 
+    ``teacher_feature`` is (N, teachers, C, H, W) or (N, teachers, C) as read from a
+    ``datasets.teacher_cache.FeatureCache``; the teachers are averaged and their maps
+    average-pooled to the student's spatial size.
+    """
+    def __init__(self, reduction = 'mean'):
+        super(FeatureHint, self).__init__()
+        self.reduction = reduction
 
+    def forward(self, student_feature, teacher_feature):
+        teacher_feature = teacher_feature.float().mean(1)
+        if teacher_feature.dim() == 4 and teacher_feature.shape[-2:] != student_feature.shape[-2:]:
+            teacher_feature = F.adaptive_avg_pool2d(teacher_feature, student_feature.shape[-2:])
+        loss = (student_feature - teacher_feature).pow(2).flatten(1).mean(1)
+        if self.reduction == 'none':
+            return loss
+        return loss.mean()
@@ -0,0 +1,303 @@
+''' N identical teachers run as one vectorized forward, or packed into one wide network'''
+
+import copy
+import math
+import collections
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.utils.checkpoint as cp
+from torch.func import functional_call, stack_module_state, vmap
+from network.input_norm import InputNorm
+from network.teacherNet import Transition, _DenseLayer
+
+
+def _mangle(name):
+    # parameter names cannot hold dots
+    return name.replace('.', '__')
+
+
+class EnsembleMember(object):
+    """``state_dict``/``load_state_dict`` of member ``index`` of a ``TeacherEnsemble``, with the keys of a single teacher.
+
+    Stands for the teacher module wherever only its state is needed, like the ``modules`` of a
+    ``snapshot.Snapshot``.
+    """
+    def __init__(self, ensemble, index):
+        self.ensemble = ensemble
+        self.index = index
+
+    def state_dict(self):
+        return self.ensemble.member_state_dict(self.index)
+
+    def load_state_dict(self, state_dict):
+        self.ensemble.load_member_state_dict(self.index, state_dict)
+
+
+class MemberStates(object):
+    """``member``/``unstack`` of the ensembles, on top of their ``member_state_dict``/``load_member_state_dict``."""
+    def member(self, index):
+        return EnsembleMember(self, index)
+
+    def unstack(self, nets):
+        """Copy the members into the modules ``nets``, e.g. the teachers the ensemble was built from."""
+        for index, net in enumerate(nets):
+            net.load_state_dict(self.member_state_dict(index))
+        return nets
+
+
+class TeacherEnsemble(MemberStates, nn.Module):
+    """The members of ``nets``, all of the same architecture, run on the same input as one vectorized forward.
+
+    The parameters and buffers of the members are stacked along a new first dimension
+    (``torch.func.stack_module_state``) and ``forward`` maps the architecture over them with
+    ``torch.func.vmap``: every convolution of the N members becomes one batched kernel instead of
+    N small ones. Each output of the architecture comes back with a leading N, so the logits of a
+    ``Teacher`` ensemble are (N, B, classes).
+
+    The stacked tensors are the parameters of the ensemble, so it trains like one module: the
+    optimizer, weight decay and gradient clipping act element-wise, exactly as on the members,
+    and BatchNorm updates the running statistics of every member in train mode. ``nets`` are
+    copied, not shared; ``member_state_dict(i)`` and ``load_member_state_dict(i, ...)`` (or
+    ``member(i)``) read and write member ``i`` with the keys of the architecture, so checkpoints
+    keep their ``Teacher1..N`` entries, and ``unstack(nets)`` writes all members back.
+
+    Under ``vmap`` the ``_DenseLayer`` bottlenecks are not checkpointed, which costs activation
+    memory. The checkpointed teachers recompute them in the backward and so update the running
+    statistics of their ``norm0`` twice per training step with the same batch statistics; the
+    ensemble does both updates in one, with the momentum ``1 - (1 - m)**2``, and counts two batches.
+    """
+    def __init__(self, nets):
+        super(TeacherEnsemble, self).__init__()
+        nets = list(nets)
+        self.num_members = len(nets)
+        self.param_names = [name for name, _ in nets[0].named_parameters()]
+        self.buffer_names = [name for name in nets[0].state_dict().keys() if name not in self.param_names]
+        params, buffers = stack_module_state(nets)
+        for name in self.param_names:
+            self.register_parameter(_mangle(name), nn.Parameter(params[name]))
+        for name in self.buffer_names:
+            self.register_buffer(_mangle(name), buffers[name])
+        # the architecture, without storage: vmap swaps in the slices of the stacked tensors
+        base = copy.deepcopy(nets[0]).to('meta')
+        self.__dict__['base'] = base
+        self.input_mean = self.input_std = None
+        # the bottleneck BatchNorms the teachers update again when recomputing the checkpoint
+        self.recomputed = [(name + '.norm0', module.norm0, module.norm0.momentum) for name, module in base.named_modules()
+                           if isinstance(module, _DenseLayer) and module.norm0.momentum is not None]
+
+    def train(self, mode=True):
+        super(TeacherEnsemble, self).train(mode)
+        self.base.train(mode)
+        return self
+
+    def set_input_norm(self, norm):
+        """``Teacher.set_input_norm`` of every member: (mean, std) makes them take [0, 255] pixels, ``None`` normalized ones."""
+        device = getattr(self, _mangle(self.param_names[0])).device
+        for name, value in zip(('input_mean', 'input_std'), norm or (None, None)):
+            setattr(self, name, None if value is None else torch.tensor(value, dtype=torch.float32, device=device))
+        return self
+
+    def _member_forward(self, params, buffers, x):
+        tensors = dict(params)
+        tensors.update(buffers)
+        if self.input_mean is not None:
+            tensors.update({'input_mean': self.input_mean, 'input_std': self.input_std})
+        return functional_call(self.base, tensors, (x,))
+
+    def forward(self, x):
+        params = dict((name, getattr(self, _mangle(name))) for name in self.param_names)
+        buffers = dict((name, getattr(self, _mangle(name))) for name in self.buffer_names)
+        # the checkpoint only recomputes what the backward goes through
+        twice = self.training and torch.is_grad_enabled()
+        for _, norm, momentum in self.recomputed:
+            norm.momentum = 1 - (1 - momentum) ** 2 if twice else momentum
+        out = vmap(self._member_forward, in_dims=(0, 0, None))(params, buffers, x)
+        if twice:
+            with torch.no_grad():
+                for name, _, _ in self.recomputed:
+                    getattr(self, _mangle(name + '.num_batches_tracked')).add_(1)
+        return out
+
+    def member_state_dict(self, index):
+        """The state dict of member ``index``, with the keys and shapes of the architecture."""
+        return collections.OrderedDict((name, getattr(self, _mangle(name))[index].detach().clone())
+                                       for name in self.base.state_dict().keys())
+
+    def load_member_state_dict(self, index, state_dict):
+        with torch.no_grad():
+            for name in self.base.state_dict().keys():
+                getattr(self, _mangle(name))[index].copy_(state_dict[name])
+
+
+def _members(x, num):
+    # (B, N * C, ...) -> (B, N, C, ...), the packed channels are member-major
+    return x.view(x.size(0), num, -1, *x.shape[2:])
+
+
+def _packed_cat(features, num):
+    """``torch.cat(features, 1)`` of every member, keeping the channels of each member contiguous."""
+    return torch.cat([_members(feature, num) for feature in features], 2).flatten(1, 2)
+
+
+class _PackedDenseLayer(nn.Module):
+    def __init__(self, num, num_input_features, growth_rate):
+        super(_PackedDenseLayer, self).__init__()
+        self.num = num
+        self.add_module('conv0', nn.Conv2d(num * num_input_features, num * 4 * growth_rate, kernel_size=3, padding=1, groups=num)),
+        self.add_module('norm0', nn.BatchNorm2d(num * 4 * growth_rate)),
+        self.add_module('relu0', nn.ReLU(inplace=True)),
+
+        self.add_module('conv1', nn.Conv2d(num * 4 * growth_rate, num * growth_rate, kernel_size=3, padding=1, groups=num)),
+        self.add_module('norm1', nn.BatchNorm2d(num * growth_rate)),
+
+    def bn_function(self, *inputs):
+        return self.relu0(self.norm0(self.conv0(_packed_cat(inputs, self.num))))
+
+    def forward(self, *prev_features):
+        if any(prev_feature.requires_grad for prev_feature in prev_features):
+            bottleneck_output = cp.checkpoint(self.bn_function, *prev_features)
+        else:
+            bottleneck_output = self.bn_function(*prev_features)
+        return self.norm1(self.conv1(bottleneck_output))
+
+
+class _PackedEdgeBlock(nn.Module):
+    def __init__(self, num, nChannels, growth_rate):
+        super(_PackedEdgeBlock, self).__init__()
+        self.num = num
+        self.layer = _PackedDenseLayer(num, nChannels, growth_rate)
+
+    def forward(self, init_features):
+        return _packed_cat([init_features, self.layer(init_features)], self.num)
+
+
+class _PackedResblock(nn.Module):
+    def __init__(self, num, in_channels, out_channels):
+        super(_PackedResblock, self).__init__()
+        self.conv1 = nn.Conv2d(num * in_channels, num * out_channels, kernel_size=3, stride=1, padding=1, bias=True, groups=num)
+        self.bn1 = nn.BatchNorm2d(num * out_channels)
+        self.relu1 = nn.ReLU()
+
+        self.conv2 = nn.Conv2d(num * out_channels, num * out_channels, kernel_size=3, stride=1, padding=1, bias=True, groups=num)
+        self.bn2 = nn.BatchNorm2d(num * out_channels)
+
+    def forward(self, x):
+        return x + self.bn2(self.conv2(self.relu1(self.bn1(self.conv1(x)))))
+
+
+class _PackedLinear(nn.Module):
+    """N ``nn.Linear(in_features, out_features)`` heads, weights concatenated to (N * out, in) like the packed convolutions."""
+    def __init__(self, num, in_features, out_features):
+        super(_PackedLinear, self).__init__()
+        self.num = num
+        self.in_features = in_features
+        self.out_features = out_features
+        bound = 1. / math.sqrt(in_features)
+        self.weight = nn.Parameter(torch.empty(num * out_features, in_features).uniform_(-bound, bound))
+        self.bias = nn.Parameter(torch.zeros(num * out_features))
+
+    def forward(self, x):
+        # (B, N, in) -> (N, B, out)
+        weight = self.weight.view(self.num, self.out_features, self.in_features)
+        return torch.einsum('bni,noi->nbo', x, weight) + self.bias.view(self.num, 1, -1)
+
+
+class PackedTeacher(MemberStates, InputNorm, nn.Module):
+    """``num_members`` ``Teacher`` networks fused into one wide network with grouped convolutions.
+
+    Every ``Conv2d`` of the dense and residual blocks becomes a ``groups=num_members``
+    convolution over the channels of all members side by side (member-major), every
+    BatchNorm is ``num_members`` times wider and the ``fc`` heads are batched. ``conv1``,
+    whose input all members share, is a single convolution with the output channels of all
+    of them. The members stay independent and the network computes exactly what the N
+    teachers do, but as one set of large kernels. Outputs come back like those of a
+    ``TeacherEnsemble``, with a leading N: (N, B, classes) logits.
+
+    Every tensor of the packed state dict is the concatenation along its first dimension of
+    the same tensor of the members, under the same key, so ``from_teachers``,
+    ``member_state_dict`` and ``load_member_state_dict`` convert exactly from and to
+    ``Teacher1..N`` checkpoints.
+    """
+    def __init__(self, num_members=4, ResNet_factor=4, num_classes=7, input_norm=None):
+        super(PackedTeacher, self).__init__()
+        self.num_members = num = num_members
+
+        nChannels = 32
+        growthRate = 16
+        nDenseBlocks = [4, 4, 7]
+        self.conv1 = nn.Conv2d(3, num * nChannels, kernel_size=3, padding=1, bias=True)
+        self.pool1 = nn.MaxPool2d(kernel_size=3, stride=2, padding=1)
+
+        self.dense1 = self._make_dense(nChannels, growthRate, nDenseBlocks[0])
+        nChannels += nDenseBlocks[0]*growthRate
+        self.res2 = self.make_layer(ResNet_factor, nChannels)
+        self.trans1 = Transition(nChannels, nChannels)
+
+        self.dense2 = self._make_dense(nChannels, growthRate, nDenseBlocks[1])
+        nChannels += nDenseBlocks[1]*growthRate
+        self.res3 = self.make_layer(ResNet_factor, nChannels)
+        self.trans2 = Transition(nChannels, nChannels)
+
+        self.dense3 = self._make_dense(nChannels, growthRate, nDenseBlocks[2])
+        nChannels += nDenseBlocks[2]*growthRate
+        self.res4 = self.make_layer(ResNet_factor, nChannels)
+
+        self.fc = _PackedLinear(num, nChannels, num_classes)
+
+        for m in self.modules():
+            if isinstance(m, nn.Conv2d):
+                # the fan of one member, as in Teacher
+                n = m.kernel_size[0] * m.kernel_size[1] * m.out_channels // num
+                m.weight.data.normal_(0, math.sqrt(2. / n))
+            elif isinstance(m, nn.BatchNorm2d):
+                m.weight.data.fill_(1)
+                m.bias.data.zero_()
+        self.set_input_norm(input_norm)
+
+    @classmethod
+    def from_teachers(cls, nets):
+        """The packed copy of the ``Teacher`` modules ``nets``, on their device and in their dtype."""
+        nets = list(nets)
+        packed = cls(len(nets), ResNet_factor=len(nets[0].res2), num_classes=nets[0].fc.out_features)
+        packed.to(nets[0].conv1.weight.device, nets[0].conv1.weight.dtype)
+        for index, net in enumerate(nets):
+            packed.load_member_state_dict(index, net.state_dict())
+        return packed
+
+    def _make_dense(self, nChannels, growthRate, nDenseBlocks):
+        layers = []
+        for i in range(int(nDenseBlocks)):
+            layers.append(_PackedEdgeBlock(self.num_members, nChannels, growthRate))
+            nChannels += growthRate
+        return nn.Sequential(*layers)
+
+    def make_layer(self, num, channels):  # num must >=2
+        return nn.Sequential(*[_PackedResblock(self.num_members, channels, channels) for i in range(num)])
+
+    def forward(self, x):
+        out = self.pool1(self.input_conv(x))
+
+        rb1 = self.res2(self.dense1(out))
+        rb2 = self.res3(self.dense2(self.trans1(rb1)))
+        rb3 = self.res4(self.dense3(self.trans2(rb2)))
+
+        out = F.relu(rb3, inplace=True)
+        mimic = _members(F.adaptive_avg_pool2d(out, 1).view(out.size(0), -1), self.num_members)
+        out = self.fc(mimic)
+        rb1, rb2, rb3 = [_members(rb, self.num_members).transpose(0, 1) for rb in (rb1, rb2, rb3)]
+        return rb1, rb2, rb3, mimic.transpose(0, 1), out
+
+    def member_state_dict(self, index):
+        """The ``Teacher`` state dict of member ``index``: slice ``index`` of every packed tensor."""
+        return collections.OrderedDict(
+            (name, value.clone() if value.dim() == 0 else value.view(self.num_members, -1, *value.shape[1:])[index].clone())
+            for name, value in self.state_dict().items())
+
+    def load_member_state_dict(self, index, state_dict):
+        with torch.no_grad():
+            for name, value in self.state_dict().items():
+                if value.dim() == 0:
+                    value.copy_(state_dict[name])
+                else:
+                    value.view(self.num_members, -1, *value.shape[1:])[index].copy_(state_dict[name].view(-1, *value.shape[1:]))
@@ -0,0 +1,41 @@
+''' Input normalization folded into the first convolution'''
+
+import torch
+import torch.nn.functional as F
+
+
+def folded_conv(conv, x, mean, std):
+    """``conv(((x / 255) - mean) / std)`` computed on raw [0, 255] pixels.
+
+    ``1 / (255 * std)`` is folded into the weights and ``mean / std`` into a bias map, the
+    convolution of the constant mean image with the same padding. The map is what makes the
+    fold exact at the borders too, where ``conv`` zero-pads the *normalized* input.
+    """
+    scale = (1. / (255. * std)).view(1, -1, 1, 1)
+    out = F.conv2d(x, conv.weight * scale, conv.bias, conv.stride, conv.padding, conv.dilation, conv.groups)
+    shift = (mean / std).view(1, -1, 1, 1).expand(1, x.size(1), x.size(2), x.size(3))
+    return out - F.conv2d(shift, conv.weight, None, conv.stride, conv.padding, conv.dilation, conv.groups)
+
+
+class InputNorm(object):
+    """Mixin of the networks that can take uint8 batches instead of normalized float ones.
+
+    After ``set_input_norm((mean, std))`` the network expects pixels in [0, 255], as (B, C, H, W)
+    or uint8 (B, H, W, C) straight from the loaders, and normalizes them inside ``conv1``; the
+    parameters and the state dict are untouched, so checkpoints are interchangeable with
+    ``set_input_norm(None)``, which restores the normalized float input.
+    """
+    def set_input_norm(self, norm):
+        device = self.conv1.weight.device
+        for name, value in zip(('input_mean', 'input_std'), norm or (None, None)):
+            value = None if value is None else torch.tensor(value, dtype=torch.float32, device=device)
+            self.register_buffer(name, value, persistent=False)
+        return self
+
+    def input_conv(self, x):
+        if self.input_mean is None:
+            return self.conv1(x)
+        if x.dtype == torch.uint8 and x.dim() == 4 and x.size(-1) == self.conv1.in_channels:
+            x = x.permute(0, 3, 1, 2)
+        x = x.to(self.conv1.weight.dtype)
+        return folded_conv(self.conv1, x, self.input_mean.to(x.dtype), self.input_std.to(x.dtype))
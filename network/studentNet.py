@@ -5,6 +5,7 @@ from torch.autograd import Variable
 import math
 
 import torch.utils.checkpoint as cp
+from network.input_norm import InputNorm
 
 def _bn_function_factory(conv, norm, relu):
     def bn_function(*inputs):
@@ -55,8 +56,8 @@ class Transition(nn.Module):
         return out
 
 
-class CNN_RIS(nn.Module):
-    def __init__(self, num_classes=7, S_size=44):
+class CNN_RIS(InputNorm, nn.Module):
+    def __init__(self, num_classes=7, S_size=44, input_norm=None):
         super(CNN_RIS, self).__init__()
 
         nChannels = 32
@@ -88,6 +89,8 @@ class CNN_RIS(nn.Module):
                 m.bias.data.zero_()
             elif isinstance(m, nn.Linear):
                 m.bias.data.zero_()
+        # (mean, std): take raw [0, 255] pixels and normalize them inside conv1
+        self.set_input_norm(input_norm)
 
     def _make_dense(self, nChannels, growthRate, nDenseBlocks):
         layers = []
@@ -97,7 +100,7 @@ class CNN_RIS(nn.Module):
         return nn.Sequential(*layers)
 
     def forward(self, x):
-        out = self.pool1(self.conv1(x))
+        out = self.pool1(self.input_conv(x))
         rb1 = self.dense1(out)
 
         rb2 = self.dense2(self.trans1(rb1))
@@ -105,16 +108,8 @@ class CNN_RIS(nn.Module):
         rb3 = self.dense3(self.trans2(rb2))
         
         out = F.relu(rb3, inplace=True)
-        if self.S_size == 32:
-            mimic = F.avg_pool2d(out, kernel_size=4).view(out.size(0), -1)
-        elif self.S_size == 24:
-            mimic = F.avg_pool2d(out, kernel_size=3).view(out.size(0), -1)
-        elif self.S_size == 16:
-            mimic = F.avg_pool2d(out, kernel_size=2).view(out.size(0), -1)
-        elif self.S_size == 8:
-            mimic = F.avg_pool2d(out, kernel_size=1).view(out.size(0), -1)
-        else:
-            mimic = F.avg_pool2d(out, kernel_size=5).view(out.size(0), -1)
+        # adaptive: the same as the S_size-specific kernels at S_size, and any other input size works too
+        mimic = F.adaptive_avg_pool2d(out, 1).view(out.size(0), -1)
         out = self.fc(mimic)
         return rb1, rb2, rb3, mimic, out
 
@@ -5,6 +5,7 @@ from torch.autograd import Variable
 import math
 
 import torch.utils.checkpoint as cp
+from network.input_norm import InputNorm
 
 def _bn_function_factory(conv, norm, relu):
     def bn_function(*inputs):
@@ -77,8 +78,8 @@ class Transition(nn.Module):
         return out
 
 
-class Teacher(nn.Module):
-    def __init__(self, ResNet_factor=4, num_classes=7):
+class Teacher(InputNorm, nn.Module):
+    def __init__(self, ResNet_factor=4, num_classes=7, input_norm=None):
         super(Teacher, self).__init__()
 
         nChannels = 32
@@ -112,6 +113,8 @@ class Teacher(nn.Module):
                 m.bias.data.zero_()
             elif isinstance(m, nn.Linear):
                 m.bias.data.zero_()
+        # (mean, std): take raw [0, 255] pixels and normalize them inside conv1
+        self.set_input_norm(input_norm)
 
     def _make_dense(self, nChannels, growthRate, nDenseBlocks):
         layers = []
@@ -128,7 +131,7 @@ class Teacher(nn.Module):
         return nn.Sequential(*layers)
 
     def forward(self, x):
-        out = self.conv1(x)
+        out = self.input_conv(x)
         out = self.pool1(out)
 
         rb1 = self.dense1(out)
@@ -141,7 +144,7 @@ class Teacher(nn.Module):
         rb3 = self.res4(rb3)
         
         out = F.relu(rb3, inplace=True)
-        mimic = F.avg_pool2d(out, kernel_size=11).view(out.size(0), -1)
+        mimic = F.adaptive_avg_pool2d(out, 1).view(out.size(0), -1)
         out = self.fc(mimic)
         return rb1, rb2, rb3, mimic, out
 
@@ -0,0 +1,129 @@
+''' Preemption-safe snapshots of the training runs'''
+from __future__ import print_function
+
+import os
+import sys
+import random
+import signal
+import numpy as np
+import torch
+
+
+def rng_state():
+    """States of every RNG a training step draws from."""
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class Snapshot(object):
+    """Rolling ``snapshot.t7`` of a run that a SIGTERM or SIGUSR1 can take mid-epoch.
+
+    It holds the ``modules`` (``{key: nn.Module}``, or anything else with a ``state_dict``, like
+    ``datasets.pruning.ConsensusPruner``), the optimizer, whose param groups carry the
+    decayed learning rate, every RNG state, the best-so-far metrics ``names`` of the script
+    namespace ``scope``, and the epoch and number of samples already trained on. The
+    signal handlers only raise a flag; ``step`` honours it between two optimizer steps, so the
+    snapshot is always consistent. SIGUSR1 saves and goes on, SIGTERM saves and exits.
+
+    ``order`` is the resumable sampler of the training loader (``datasets.sampler``), positioned
+    by ``begin``; ``load`` then continues a run bit-exactly, given deterministic kernels
+    (``cudnn.benchmark`` picks its algorithms anew in every process). Without an ``order``,
+    e.g. with ``--stream``, only the end-of-epoch snapshots can be resumed and a signal
+    mid-epoch is deferred to the end of the epoch.
+    """
+    def __init__(self, path, modules, optimizer, order=None, scope=None, names=(), name='snapshot.t7'):
+        self.path = path
+        self.file = os.path.join(path, name)
+        self.modules = modules
+        self.optimizer = optimizer
+        self.order = order
+        self.scope = scope if scope is not None else {}
+        self.names = names
+        self.epoch = None
+        self.position = 0
+        self.pending = None
+        self.pid = os.getpid()
+        for signum in (signal.SIGTERM, signal.SIGUSR1):
+            signal.signal(signum, self._handler)
+
+    def _handler(self, signum, frame):
+        if os.getpid() != self.pid:
+            # forked DataLoader workers keep the default behaviour
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+            return
+        self.pending = signum
+
+    def save(self, epoch, position=0):
+        """Write the snapshot of ``position`` samples into ``epoch``, atomically."""
+        state = {
+            'epoch': epoch,
+            'position': position,
+            'modules': dict((key, module.state_dict()) for key, module in self.modules.items()),
+            'optimizer': self.optimizer.state_dict(),
+            'best': dict((name, self.scope[name]) for name in self.names if name in self.scope),
+            'rng': rng_state(),
+        }
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        torch.save(state, self.file + '.tmp')
+        os.replace(self.file + '.tmp', self.file)
+
+    def load(self, start_epoch=0):
+        """Restore the snapshot, returns the epoch to continue from (``start_epoch`` when there is none)."""
+        if not os.path.isfile(self.file):
+            print('no snapshot in %s, training from scratch' % self.path)
+            return start_epoch
+        state = torch.load(self.file, map_location='cpu', weights_only=False)
+        for key, module in self.modules.items():
+            module.load_state_dict(state['modules'][key])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.scope.update(state['best'])
+        set_rng_state(state['rng'])
+        self.epoch, self.position = state['epoch'], state['position']
+        print('==> Resuming from epoch %d, %d samples in' % (self.epoch, self.position))
+        return self.epoch
+
+    def begin(self, epoch):
+        """Position the sampler at the start of ``epoch``, or where the loaded snapshot stopped in it."""
+        if epoch != self.epoch:
+            self.epoch, self.position = epoch, 0
+        if self.order is not None:
+            self.order.set_epoch(epoch, self.position)
+        return self.position
+
+    def _exit(self, signum):
+        print('==> Snapshot saved to %s, exiting on signal %d' % (self.file, signum))
+        sys.exit(128 + signum)
+
+    def step(self, num):
+        """Count the ``num`` samples of the last optimizer step, and snapshot if a signal came in."""
+        self.position += num
+        if self.pending is None or self.order is None:
+            return
+        if self.position >= self.order.num_samples:
+            # the end-of-epoch snapshot follows right after the test
+            return
+        signum, self.pending = self.pending, None
+        self.save(self.epoch, self.position)
+        if signum == signal.SIGTERM:
+            self._exit(signum)
+        print('==> Snapshot saved to %s' % self.file)
+
+    def end_epoch(self, epoch):
+        """Snapshot the start of the next epoch, and exit if a SIGTERM is pending."""
+        self.save(epoch + 1)
+        self.epoch, self.position = epoch + 1, 0
+        signum, self.pending = self.pending, None
+        if signum == signal.SIGTERM:
+            self._exit(signum)
@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+# the scripts import datasets/ and network/ from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def smooth_images(num, size=100, seed=0):
+    """uint8 (num, size, size, 3) gradients, on which the antialiased resizes of PIL and torch agree closely."""
+    rng = np.random.RandomState(seed)
+    grid = np.linspace(0, 1, size)
+    imgs = []
+    for _ in range(num):
+        a, b, c = rng.uniform(0.2, 1, 3)
+        imgs.append(np.stack([np.outer(grid, grid) * a, np.outer(grid, 1 - grid) * b, np.outer(1 - grid, grid) * c], -1))
+    return (np.stack(imgs) * 255).astype(np.uint8)
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    """Write a small ``<name>_store`` under ``tmp_path``, returns the root to pass as ``root``."""
+    def make(name='Tiny', num_train=24, num_test=8, num_classes=7):
+        out = tmp_path / (name + '_store')
+        out.mkdir()
+        meta = {'name': name, 'image_size': 100, 'channels': 3, 'num_classes': num_classes, 'splits': {}}
+        for prefix, num, seed in (('train', num_train, 0), ('valid', num_test, 1)):
+            np.save(str(out / (prefix + '_pixel.npy')), smooth_images(num, seed=seed))
+            np.save(str(out / (prefix + '_label.npy')), np.arange(num, dtype=np.int64) % num_classes)
+            meta['splits'][prefix] = {'num': num, 'pixels': prefix + '_pixel.npy', 'labels': prefix + '_label.npy'}
+        with open(str(out / 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return str(tmp_path)
+    return make
@@ -0,0 +1,43 @@
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from datasets import augment
+
+MEAN, STD = (0.5, 0.45, 0.4), (0.25, 0.2, 0.3)
+
+
+def per_image_tencrop(imgs, size, resize=None):
+    normalize = transforms.Normalize(MEAN, STD)
+    crops = []
+    for img in imgs:
+        img = Image.fromarray(img)
+        if resize is not None:
+            img = transforms.Resize(resize)(img)
+        crops.append(torch.stack([normalize(transforms.ToTensor()(crop)) for crop in transforms.TenCrop(size)(img)]))
+    return torch.stack(crops)
+
+
+def test_tencrop_normalize_matches_per_image_pipeline():
+    imgs = np.random.RandomState(0).randint(0, 256, (3, 48, 48, 3)).astype(np.uint8)
+    out = augment.TenCropNormalize(44, MEAN, STD)(torch.from_numpy(imgs))
+    assert torch.allclose(out, per_image_tencrop(imgs, 44), atol=1e-5)
+
+
+def test_tencrop_normalize_with_resize():
+    # smooth images, so that the antialiased resizes of PIL and torch agree closely
+    grid = np.linspace(0, 1, 100)
+    base = np.stack([np.outer(grid, grid), np.outer(grid, 1 - grid), np.outer(1 - grid, grid)], -1)
+    for in_size in (100, 48):
+        imgs = np.stack([base * (0.5 + 0.2 * i) * 255 for i in range(2)]).astype(np.uint8)
+        if in_size != 100:
+            imgs = np.stack([np.array(Image.fromarray(img).resize((in_size, in_size), Image.BILINEAR)) for img in imgs])
+        out = augment.TenCropNormalize(44, MEAN, STD, resize=48)(torch.from_numpy(imgs))
+        assert out.shape == (2, 10, 3, 44, 44)
+        assert out.is_contiguous()
+        # test() flattens the crops into the batch
+        out.view(-1, 3, 44, 44)
+        ref = per_image_tencrop(imgs, 44, resize=48)
+        assert (out - ref).abs().mean() < 0.01
+        assert (out - ref).abs().max() < 0.1
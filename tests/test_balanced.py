@@ -0,0 +1,45 @@
+import numpy as np
+
+from datasets import sampler, store
+
+
+def test_class_index_matches_a_stable_argsort(make_store):
+    labels = np.random.RandomState(0).randint(0, 9, 200)
+    labels[labels == 4] = 5
+    order, offsets = store.class_index(labels)
+    assert np.array_equal(order, np.argsort(labels, kind='stable'))
+    assert np.array_equal(offsets, np.concatenate([[0], np.cumsum(np.bincount(labels))]))
+    # class 4 is empty, every other one lists its images in ascending order
+    assert offsets[5] == offsets[4]
+    for c in range(9):
+        assert np.array_equal(order[offsets[c]:offsets[c + 1]], np.flatnonzero(labels == c))
+
+    root = make_store(num_train=30)
+    _, train_labels = store.load_split('Tiny', 'Training', root)
+    built = store.build_class_index('Tiny', 'Training', root)
+    loaded = store.load_class_index('Tiny', 'Training', root)
+    for expected, value in zip(store.class_index(train_labels), loaded):
+        assert np.array_equal(value, expected)
+    assert all(np.array_equal(a, b) for a, b in zip(built, loaded))
+    assert store.class_counts('Tiny', 'Training', root).tolist() == [5, 5, 4, 4, 4, 4, 4]
+
+
+def test_balanced_batches_are_p_classes_of_k_images():
+    labels = np.repeat(np.arange(10), [3, 8, 2, 9, 5, 5, 7, 4, 6, 1])
+    order = sampler.ClassBalancedBatchSampler(store.class_index(labels), batch_size=12, samples_per_class=3, seed=2)
+    assert len(order) == len(labels) // 12
+    batches = list(order)
+    assert len(batches) == len(order)
+    for batch in batches:
+        indices = [index for index, _ in batch]
+        classes = labels[indices]
+        assert len(indices) == 12
+        # P = 4 distinct classes, K = 3 consecutive images of each
+        assert len(set(classes.tolist())) == 4
+        for group in np.split(np.array(indices), 4):
+            assert len(set(labels[group].tolist())) == 1
+            if np.bincount(labels)[labels[group[0]]] >= 3:
+                assert len(set(group.tolist())) == 3
+    # a resumed epoch yields the batches it had left
+    order.set_epoch(0, start=24)
+    assert list(order) == batches[2:]
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+from conftest import smooth_images
+from datasets import corrupt, store
+
+
+def noisy_images(num, size=40):
+    """Smooth images with noise on top, so that every filter changes them."""
+    imgs = smooth_images(num, size=size).astype(np.int16)
+    imgs += np.random.RandomState(1).randint(-40, 40, imgs.shape)
+    return imgs.clip(0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('noise, blur', [('GaussianBlur', lambda img, k: cv2.GaussianBlur(img, (k, k), 0)),
+                                         ('AverageBlur', lambda img, k: cv2.blur(img, (k, k))),
+                                         ('MedianBlur', lambda img, k: cv2.medianBlur(img, k))])
+def test_batched_blurs_equal_the_per_image_ones(noise, blur):
+    # more images than one stacked cv2 call takes
+    imgs = noisy_images(50)
+    for severity in corrupt.SEVERITIES:
+        k = corrupt.NOISE_PARAMS[noise][severity - 1]
+        expected = np.stack([blur(img, k) for img in imgs])
+        out = corrupt.corrupt_batch(imgs, noise, severity, num_threads=3)
+        assert out.shape == imgs.shape and out.dtype == np.uint8
+        assert np.array_equal(out, expected)
+
+
+def test_bilateral_filter_and_salt_and_pepper():
+    imgs = noisy_images(5)
+    diameter, sigma = corrupt.NOISE_PARAMS['BilateralFilter'][2]
+    assert np.array_equal(corrupt.corrupt_batch(imgs, 'BilateralFilter', 3),
+                          np.stack([cv2.bilateralFilter(img, diameter, sigma, sigma) for img in imgs]))
+    out = corrupt.corrupt_batch(imgs, 'Salt-and-pepper', 5, seed=3)
+    hit = (out != imgs).any(-1)
+    # whole pixels turn black or white, about the severity's share of them
+    assert np.all(np.isin(out[hit], (0, 255))) and abs(hit.mean() - 0.2) < 0.02
+    assert np.array_equal(out, corrupt.corrupt_batch(imgs, 'Salt-and-pepper', 5, seed=3))
+    assert corrupt.corrupt_batch(imgs, 'None') is imgs
+
+
+def test_materialized_copies_are_read_back(make_store):
+    root = make_store()
+    corrupt.materialize('Tiny', noises=('GaussianBlur',), severities=(2,), batch_size=3, root=root)
+    pixels, _ = store.load_split('Tiny', 'PrivateTest', root)
+    assert np.array_equal(corrupt.load_corrupted('Tiny', 'GaussianBlur', 2, root),
+                          corrupt.corrupt_batch(np.array(pixels), 'GaussianBlur', 2))
+    assert corrupt.load_corrupted('Tiny', 'GaussianBlur', 3, root) is None
@@ -0,0 +1,96 @@
+import copy
+
+import torch
+import torch.nn.functional as F
+
+from network.ensemble import PackedTeacher, TeacherEnsemble
+from network.teacherNet import Teacher
+
+
+def make_teachers(num=2):
+    nets = []
+    for seed in range(num):
+        torch.manual_seed(seed)
+        # double precision: the batched and per-teacher kernels round differently in float32
+        nets.append(Teacher(num_classes=7).double())
+    return nets
+
+
+def test_vmap_ensemble_trains_like_the_teachers():
+    nets = make_teachers()
+    ensemble = TeacherEnsemble(copy.deepcopy(nets)).train()
+    for net in nets:
+        net.train()
+    x, target = torch.randn(4, 3, 92, 92, dtype=torch.float64), torch.tensor([0, 3, 5, 6])
+
+    outputs = ensemble(x)[-1]
+    sum(F.cross_entropy(output, target) for output in outputs).backward()
+    for index, net in enumerate(nets):
+        ref = net(x)[-1]
+        F.cross_entropy(ref, target).backward()
+        assert torch.allclose(outputs[index], ref, atol=1e-10)
+        state = ensemble.member_state_dict(index)
+        # the running statistics too, with the second update of the recomputed bottlenecks
+        for name, value in net.state_dict().items():
+            if 'running' in name or 'num_batches_tracked' in name:
+                assert torch.allclose(state[name].double(), value.double(), atol=1e-10), name
+        grads = dict(ensemble.named_parameters())
+        for name, param in net.named_parameters():
+            assert torch.allclose(grads[name.replace('.', '__')].grad[index], param.grad, atol=1e-10), name
+
+
+def test_vmap_ensemble_eval_leaves_statistics():
+    ensemble = TeacherEnsemble(make_teachers()).eval()
+    before = copy.deepcopy(ensemble.state_dict())
+    with torch.no_grad():
+        ensemble(torch.randn(2, 3, 92, 92, dtype=torch.float64))
+    for name, value in ensemble.state_dict().items():
+        assert torch.equal(value, before[name]), name
+
+
+def test_packed_teacher_converts_checkpoints_exactly():
+    nets = make_teachers()
+    packed = PackedTeacher.from_teachers(nets)
+    for index, net in enumerate(nets):
+        state = packed.member_state_dict(index)
+        assert list(state) == list(net.state_dict())
+        for name, value in net.state_dict().items():
+            assert torch.equal(state[name], value), name
+    torch.manual_seed(2)
+    other = Teacher(num_classes=7).double()
+    packed.load_member_state_dict(1, other.state_dict())
+    for name, value in other.state_dict().items():
+        assert torch.equal(packed.member_state_dict(1)[name], value), name
+        assert torch.equal(packed.member_state_dict(0)[name], nets[0].state_dict()[name]), name
+
+
+def test_packed_teacher_computes_the_teachers():
+    nets = make_teachers()
+    packed = PackedTeacher.from_teachers(nets).eval()
+    x = torch.randn(2, 3, 92, 92, dtype=torch.float64)
+    with torch.no_grad():
+        _, _, _, mimics, outputs = packed(x)
+        for index, net in enumerate(nets):
+            _, _, _, mimic, ref = net.eval()(x)
+            assert torch.allclose(outputs[index], ref, atol=1e-10)
+            assert torch.allclose(mimics[index], mimic, atol=1e-10)
+
+
+def test_packed_teacher_trains_like_the_teachers():
+    nets = make_teachers()
+    packed = PackedTeacher.from_teachers(nets).train()
+    x, target = torch.randn(4, 3, 92, 92, dtype=torch.float64), torch.tensor([0, 3, 5, 6])
+
+    outputs = packed(x)[-1]
+    sum(F.cross_entropy(output, target) for output in outputs).backward()
+    grads = dict((name, param.grad) for name, param in packed.named_parameters())
+    for index, net in enumerate(nets):
+        ref = net.train()(x)[-1]
+        F.cross_entropy(ref, target).backward()
+        assert torch.allclose(outputs[index], ref, atol=1e-10)
+        state = packed.member_state_dict(index)
+        for name, value in net.state_dict().items():
+            assert torch.allclose(state[name].double(), value.double(), atol=1e-10), name
+        for name, param in net.named_parameters():
+            grad = grads[name].chunk(len(nets))[index].reshape(param.shape)
+            assert torch.allclose(grad, param.grad, atol=1e-10), name
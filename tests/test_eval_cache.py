@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import torch
+
+from datasets import augment, eval_cache
+from datasets.generic import StoreDataset
+
+MEAN, STD = (0.5, 0.45, 0.4), (0.25, 0.2, 0.3)
+
+
+def reference(root, size=92):
+    """The TenCrop batches of the uncached test path."""
+    testset = StoreDataset('Tiny', split='PrivateTest', root=root)
+    pixels = torch.from_numpy(np.stack([testset[i][0] for i in range(len(testset))]))
+    return augment.TenCropNormalize(size, MEAN, STD)(pixels), testset.labels
+
+
+def test_cached_tencrop_matches_the_test_transform(make_store):
+    root = make_store()
+    expected, labels = reference(root)
+    for dtype, tolerance in (('uint8', 1e-6), ('float16', 1e-2)):
+        path = eval_cache.build('Tiny', 92, MEAN, STD, dtype=dtype, batch_size=3, num_workers=0, root=root)
+        loader = eval_cache.CachedTestLoader(path, batch_size=5, device='cpu')
+        assert len(loader) == 2
+        img, target = zip(*loader)
+        img, target = torch.cat(img), torch.cat(target)
+        assert img.shape == expected.shape
+        # what test() does with every batch
+        img.view(-1, *img.shape[2:])
+        assert (img - expected).abs().max() < tolerance
+        assert target.tolist() == np.asarray(labels).tolist()
+
+
+def test_cache_is_reused_and_keyed_by_its_parameters(make_store):
+    root = make_store()
+    path = eval_cache.build('Tiny', 92, MEAN, STD, num_workers=0, root=root)
+    mtime = os.stat(path + '_tencrop.npy').st_mtime_ns
+    assert eval_cache.build('Tiny', 92, MEAN, STD, num_workers=0, root=root) == path
+    assert os.stat(path + '_tencrop.npy').st_mtime_ns == mtime
+    others = [eval_cache.build('Tiny', 92, (0.4, 0.4, 0.4), STD, num_workers=0, root=root),
+              eval_cache.build('Tiny', 92, MEAN, STD, dtype='float16', num_workers=0, root=root),
+              eval_cache.build('Tiny', 88, MEAN, STD, num_workers=0, root=root)]
+    assert len(set(others + [path])) == 4
+
+
+def test_cached_student_view_matches_the_batched_tencrop(make_store):
+    root = make_store()
+    testset = StoreDataset('Tiny', split='PrivateTest', root=root)
+    pixels = torch.from_numpy(np.stack([testset[i][0] for i in range(len(testset))]))
+    expected = augment.TenCropNormalize(44, MEAN, STD, resize=augment.TEST_RESIZE[44])(pixels)
+    path = eval_cache.build('Tiny', 44, MEAN, STD, S_size=44, num_workers=0, root=root)
+    img = torch.cat([img for img, _ in eval_cache.CachedTestLoader(path, device='cpu')])
+    # PIL resizes the cached images, torch the batched ones
+    assert img.shape == expected.shape
+    assert (img - expected).abs().mean() < 0.01 and (img - expected).abs().max() < 0.1
@@ -0,0 +1,45 @@
+import torch
+import torchvision.transforms as transforms
+
+from datasets import augment
+from datasets.generic import DualViewDataset, StoreDataset, collated
+
+MEAN, STD = (0.5, 0.45, 0.4), (0.25, 0.2, 0.3)
+
+
+def test_batched_tencrop_test_loader(make_store):
+    root = make_store()
+    normalize = transforms.Normalize(MEAN, STD)
+    transform_test = transforms.Compose([
+        transforms.TenCrop(44),
+        transforms.Lambda(lambda crops: torch.stack([normalize(transforms.ToTensor()(crop)) for crop in crops]))])
+    per_image = DualViewDataset('Tiny', split='PrivateTest', transform=transform_test, S_size=44, root=root)
+    batched = DualViewDataset('Tiny', split='PrivateTest', transform=None, S_size=44, root=root, batched=True,
+                              batch_transform=augment.TenCropNormalize(44, MEAN, STD, resize=augment.TEST_RESIZE[44]))
+    ref = torch.utils.data.DataLoader(per_image, batch_size=4)
+    loader = torch.utils.data.DataLoader(batched, batch_size=4, collate_fn=collated)
+    for (img, target), (ref_img, ref_target) in zip(loader, ref):
+        test_bs, ncrops, c, h, w = img.shape
+        # what test() does with every batch
+        img = img.view(-1, c, h, w)
+        assert torch.equal(target, ref_target)
+        assert (img - ref_img.view(-1, c, h, w)).abs().mean() < 0.01
+
+
+def test_seeded_samples_leave_global_rng_alone(make_store, monkeypatch):
+    root = make_store()
+    transform = transforms.Compose([transforms.RandomCrop(92), transforms.RandomHorizontalFlip(), transforms.PILToTensor()])
+    per_image = StoreDataset('Tiny', transform=transform, root=root)
+    batched = StoreDataset('Tiny', root=root, batched=True, batch_transform=augment.CropFlipNormalize(92, MEAN, STD))
+    reseeded = []
+    monkeypatch.setattr(torch.cuda, 'manual_seed_all', lambda seed: reseeded.append(seed))
+    torch.manual_seed(0)
+    reseeded.clear()
+    state = torch.get_rng_state()
+    first, first_batch = per_image[(3, 1234)][0], batched.get_batch([(3, 1234), (5, 1235)])[0]
+    assert torch.equal(torch.get_rng_state(), state)
+    # the sample's seed alone fixes its augmentation, the CUDA generators are never touched
+    torch.rand(10)
+    assert torch.equal(per_image[(3, 1234)][0], first)
+    assert torch.equal(batched.get_batch([(3, 1234), (5, 1235)])[0], first_batch)
+    assert not reseeded
@@ -0,0 +1,71 @@
+import copy
+
+import numpy as np
+import torch
+
+from datasets import importance
+
+
+def scored(num=50, seed=0, **kwargs):
+    """A sampler past its first epoch, every image measured with the loss ``1 + index % 7``."""
+    order = importance.LossProportionalSampler(num, seed=seed, **kwargs)
+    order.set_epoch(0)
+    # no score yet: a plain permutation with unit weights
+    assert sorted(order.plan) == list(range(num))
+    assert torch.equal(order.weights(order.plan), torch.ones(num))
+    order.update(np.arange(num), torch.arange(num) % 7 + 1.)
+    return order
+
+
+def test_weights_make_the_loss_unbiased():
+    order = scored(uniform=0.2)
+    order.set_epoch(1)
+    loss = np.arange(50) % 7 + 1.
+    weights = order.weights(np.arange(50)).double().numpy()
+    # the larger the loss, the likelier the image
+    assert np.all(np.diff(order.probs[:7]) > 0)
+    # E[w * loss] over one draw is the mean loss of the set
+    assert abs((order.probs * weights * loss).sum() - loss.mean()) < 1e-5
+    # and so is the weighted mean over the drawn plans, up to sampling noise
+    estimates = []
+    for epoch in range(1, 201):
+        order.set_epoch(epoch)
+        estimates.append((order.weights(order.plan).double().numpy() * loss[order.plan]).mean())
+    assert abs(np.mean(estimates) - loss.mean()) < 0.05 * loss.mean()
+    # stale scores count as at least the mean one
+    assert order.probs[0] == order.probs[1] == order.probs[2] < order.probs[6]
+
+
+def test_plan_is_a_function_of_seed_and_epoch():
+    first, second = scored(seed=3), scored(seed=3)
+    first.set_epoch(4)
+    second.set_epoch(4)
+    assert np.array_equal(first.plan, second.plan) and list(first) == list(second)
+    other = scored(seed=3)
+    other.set_epoch(5)
+    assert not np.array_equal(other.plan, first.plan)
+    # starting the epoch again keeps its plan
+    plan = first.plan
+    first.set_epoch(4, 8)
+    assert first.plan is plan
+
+
+def test_importance_sampler_resumes_the_planned_epoch():
+    order = scored(seed=1)
+    order.set_epoch(1)
+    full = list(order)
+    order.set_epoch(1)
+    head = order.next_batch(12)
+    order.update(head, torch.full((12,), 100.))
+    # what a snapshot taken after the first 12 samples holds
+    state = copy.deepcopy(order.state_dict())
+
+    resumed = importance.LossProportionalSampler(50, seed=1)
+    resumed.load_state_dict(state)
+    resumed.set_epoch(1, 12)
+    assert list(resumed) == full[12:]
+    assert np.array_equal(resumed.next_batch(38), order.next_batch(38))
+    indices = np.array([index for index, _ in full])
+    assert torch.equal(resumed.weights(indices), order.weights(indices))
+    # the losses recorded before the snapshot are kept
+    assert np.array_equal(resumed.scores, order.scores) and np.array_equal(resumed.seen, order.seen)
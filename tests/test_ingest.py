@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from conftest import smooth_images
+from datasets import ingest, store
+
+
+def write_images(folder, imgs, ext='.png'):
+    os.makedirs(folder)
+    paths = []
+    for i, img in enumerate(imgs):
+        paths.append(os.path.join(folder, '%02d%s' % (i, ext)))
+        Image.fromarray(img).save(paths[-1])
+    return paths
+
+
+def test_ingest_folders_and_csv_round_trip(tmp_path):
+    train_dir, test_dir = str(tmp_path / 'train'), str(tmp_path / 'test')
+    cats, dogs = smooth_images(5, seed=0), smooth_images(4, seed=1)
+    write_images(os.path.join(train_dir, 'dog'), dogs)
+    write_images(os.path.join(train_dir, 'cat'), cats)
+    # an unreadable file is reported and dropped with its label
+    with open(os.path.join(train_dir, 'cat', 'broken.jpg'), 'wb') as f:
+        f.write(b'not an image')
+    tests = smooth_images(3, size=150, seed=2)
+    paths = write_images(test_dir, tests)
+    with open(os.path.join(test_dir, 'labels.csv'), 'w') as f:
+        f.write('file,label\n')
+        for path, label in zip(paths, ('dog', 'cat', 'dog')):
+            f.write('%s,%s\n' % (os.path.basename(path), label))
+
+    root = str(tmp_path / 'stores')
+    splits = {'Training': ingest.read_source(train_dir), 'PrivateTest': ingest.read_source(os.path.join(test_dir, 'labels.csv'))}
+    assert len(splits['Training'][0]) == 10
+    meta = ingest.ingest('Folders', splits, num_workers=2, chunk=2, root=root)
+
+    assert meta['class_names'] == ['cat', 'dog'] and meta['num_classes'] == 2
+    pixels, labels = store.load_split('Folders', 'Training', root)
+    assert np.array_equal(pixels, np.concatenate([cats, dogs]))
+    assert labels.tolist() == [0] * 5 + [1] * 4
+    pixels, labels = store.load_split('Folders', 'PrivateTest', root)
+    assert pixels.shape == (3, 100, 100, 3)
+    assert np.array_equal(pixels, np.stack([ingest.load_image(path) for path in paths]))
+    assert labels.tolist() == [1, 0, 1]
+    assert store.class_counts('Folders', 'Training', root).tolist() == [5, 4]
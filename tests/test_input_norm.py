@@ -0,0 +1,46 @@
+import torch
+import torch.nn as nn
+
+from network.ensemble import TeacherEnsemble
+from network.input_norm import folded_conv
+from network.studentNet import CNN_RIS
+from network.teacherNet import Teacher
+
+MEAN, STD = (0.5, 0.45, 0.4), (0.25, 0.2, 0.3)
+
+
+def pixels(num, size):
+    torch.manual_seed(num)
+    return torch.randint(0, 256, (num, size, size, 3), dtype=torch.uint8)
+
+
+def normalized(imgs):
+    mean, std = torch.tensor(MEAN, dtype=torch.float64), torch.tensor(STD, dtype=torch.float64)
+    return (imgs.permute(0, 3, 1, 2).double() / 255 - mean.view(1, -1, 1, 1)) / std.view(1, -1, 1, 1)
+
+
+def test_folded_conv_matches_at_the_borders():
+    imgs = pixels(2, 17)
+    for stride, padding in ((1, 1), (2, 1), (1, 2)):
+        conv = nn.Conv2d(3, 5, kernel_size=3, stride=stride, padding=padding).double()
+        folded = folded_conv(conv, imgs.permute(0, 3, 1, 2).double(), torch.tensor(MEAN, dtype=torch.float64),
+                             torch.tensor(STD, dtype=torch.float64))
+        assert torch.allclose(folded, conv(normalized(imgs)), atol=1e-10)
+
+
+def test_networks_take_uint8_batches():
+    torch.manual_seed(0)
+    nets = ((Teacher(num_classes=7), 92), (CNN_RIS(num_classes=7, S_size=44), 44),
+            (TeacherEnsemble([Teacher(num_classes=7), Teacher(num_classes=7)]), 92))
+    for net, size in nets:
+        net = net.double().eval()
+        imgs = pixels(2, size)
+        with torch.no_grad():
+            ref = net(normalized(imgs))
+            out = net.set_input_norm((MEAN, STD))(imgs)
+            # checkpoints stay interchangeable: the fold leaves the parameters alone
+            back = net.set_input_norm(None)(normalized(imgs))
+        for value, expected, restored in zip(out, ref, back):
+            # the folded mean and std are kept in float32, and the untrained activations grow large
+            assert (value - expected).abs().max() < 1e-6 * expected.abs().max()
+            assert torch.equal(restored, expected)
@@ -0,0 +1,53 @@
+import argparse
+
+import pytest
+import torch
+import torchvision.transforms as transforms
+
+from datasets import loaders, sampler, stream
+from datasets.generic import StoreDataset
+
+MEAN, STD = (0.5, 0.45, 0.4), (0.25, 0.2, 0.3)
+
+
+def flags(**kwargs):
+    """The data flags of train_one_teacher.py, plus ``kwargs``."""
+    values = dict(data_name='Tiny', train_bs=8, test_bs=4, epochs=10, eval_cache='', prefetch=0, progressive=0, batch_tencrop=0)
+    values.update(kwargs)
+    return argparse.Namespace(**values)
+
+
+def datasets(root, repeats=1):
+    transform = transforms.Compose([transforms.RandomCrop(92), transforms.PILToTensor()])
+    return (StoreDataset('Tiny', transform=transform, root=root, repeats=repeats),
+            StoreDataset('Tiny', split='PrivateTest', transform=transforms.PILToTensor(), root=root))
+
+
+def test_repeated_training_batches_and_plain_test_batches(make_store):
+    root = make_store()
+    trainset, testset = datasets(root, repeats=2)
+    args = flags(num_workers=0, repeats=2, batched=0)
+    _, trainloader, order, testloader = loaders.build_loaders(args, trainset, testset, 92, MEAN, STD)
+    assert isinstance(order, sampler.RepeatedAugmentSampler)
+    img, target = next(iter(trainloader))
+    assert img.shape == (8, 3, 92, 92) and torch.equal(target[0::2], target[1::2])
+    # the test split has one view per image, the repeated collate would fail on it
+    img, target = next(iter(testloader))
+    assert img.shape == (4, 3, 100, 100)
+
+
+def test_flags_the_script_lacks_are_off(make_store):
+    trainset, testset = datasets(make_store())
+    trainset, _, order, _ = loaders.build_loaders(flags(), trainset, testset, 92, MEAN, STD)
+    assert type(order) is sampler.ResumableSampler
+    assert loaders.progressive_resizing(flags(), 92) is None
+    args = flags(num_workers=0, stream=8, stream_buffer=4)
+    trainset, _, order, _ = loaders.build_loaders(args, *datasets(make_store('Other')), crop=92, mean=MEAN, std=STD)
+    assert order is None and isinstance(trainset, stream.ShardedStream)
+
+
+@pytest.mark.parametrize('kwargs', [dict(stream=8, repeats=2), dict(balanced=1, stream=8), dict(chunked=1, prune=0.5),
+                                    dict(importance=1, prune=0.5), dict(repeats=3)])
+def test_conflicting_orders_are_refused(kwargs):
+    with pytest.raises(Exception):
+        loaders.check_order_flags(flags(**kwargs))
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+from datasets import packed, sampler, store
+from datasets.generic import StoreDataset
+
+
+def test_sub_filter_round_trips_through_the_uint8_wraparound():
+    imgs = np.random.RandomState(0).randint(0, 256, (3, 5, 7, 3)).astype(np.uint8)
+    imgs[0, :, :4] = [[0, 0, 0], [255, 255, 255], [0, 0, 0], [1, 2, 3]]
+    filtered = packed.sub_filter(imgs)
+    # 255 - 0 and 0 - 255 wrap modulo 256
+    assert filtered[0, 0, 1].tolist() == [255] * 3 and filtered[0, 0, 2].tolist() == [1] * 3
+    assert np.array_equal(packed.unsub_filter(filtered), imgs)
+
+
+def test_pack_round_trips_and_serves_the_split(make_store):
+    root = make_store(num_train=23)
+    pixels, labels = store.load_split('Tiny', 'Training', root)
+    pixels = np.array(pixels)
+    entry = packed.pack('Tiny', 'Training', chunk_size=5, root=root)
+    assert entry['codec'] == packed.default_codec() and packed.chunk_size('Tiny', 'Training', root) == 5
+    chunked = packed.load_pixels('Tiny', 'Training', root=root)
+    assert chunked.shape == pixels.shape and len(chunked) == 23
+    assert np.array_equal(np.asarray(chunked), pixels)
+    assert np.array_equal(chunked[7], pixels[7]) and np.array_equal(chunked[-1], pixels[-1])
+    assert np.array_equal(chunked[3:12], pixels[3:12])
+    assert np.array_equal(chunked[[22, 0, 6, 5, 21]], pixels[[22, 0, 6, 5, 21]])
+    # the raw pixels can go, the store serves the chunks
+    os.remove(os.path.join(store.store_dir('Tiny', root), 'train_pixel.npy'))
+    served, served_labels = store.load_split('Tiny', 'Training', root)
+    assert isinstance(served, packed.ChunkedArray)
+    assert np.array_equal(np.asarray(served), pixels) and np.array_equal(served_labels, labels)
+    trainset = StoreDataset('Tiny', root=root, chunked=True)
+    assert np.array_equal(trainset[9][0], pixels[9])
+
+
+def test_zlib_is_the_fallback_codec(make_store, monkeypatch):
+    monkeypatch.setattr(packed, 'CODECS', {'zlib': packed.CODECS['zlib']})
+    assert packed.default_codec() == 'zlib'
+    root = make_store()
+    entry = packed.pack('Tiny', 'PrivateTest', chunk_size=3, root=root)
+    assert entry['codec'] == 'zlib'
+    assert np.array_equal(np.asarray(packed.load_pixels('Tiny', 'PrivateTest', root=root)),
+                          store.load_split('Tiny', 'PrivateTest', root)[0])
+
+
+def test_decoded_chunks_are_evicted_least_recently_used(make_store):
+    root = make_store(num_train=20)
+    packed.pack('Tiny', 'Training', chunk_size=5, root=root)
+    chunked = packed.load_pixels('Tiny', 'Training', cache_chunks=2, root=root)
+    reads = []
+    for index in (0, 6, 1, 11, 2, 7):
+        chunked[index]
+        reads.append(chunked.reads)
+    # chunk 0 was used after chunk 1, so chunk 2 evicts chunk 1
+    assert reads == [1, 2, 2, 3, 3, 4]
+    # a batch over the same chunk decodes it once
+    chunked[[15, 16, 17, 18, 19, 15]]
+    assert chunked.reads == 5
+
+
+def test_block_shuffle_covers_every_index_once_per_epoch():
+    order = sampler.BlockShuffleSampler(23, chunk_size=4, chunks_per_block=2, seed=3)
+    epochs = []
+    for epoch in range(2):
+        indices = [index for index, _ in order]
+        assert sorted(indices) == list(range(23))
+        epochs.append(indices)
+    assert epochs[0] != epochs[1]
+    order.set_epoch(1, start=10)
+    assert len(order) == 13 and [index for index, _ in order] == epochs[1][10:]
+
+
+def test_block_shuffle_stays_within_blocks_of_chunks():
+    indices = [index for index, _ in sampler.BlockShuffleSampler(24, chunk_size=4, chunks_per_block=2, seed=3)]
+    # each block of two chunks is drawn whole before the next one starts
+    for start in range(0, 24, 8):
+        assert len(set(index // 4 for index in indices[start:start + 8])) == 2
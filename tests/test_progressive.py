@@ -0,0 +1,48 @@
+import argparse
+
+import pytest
+import torch
+
+from datasets import loaders, progressive, sampler, store
+from datasets.generic import StoreDataset
+
+
+def test_schedule_reaches_the_full_size_at_the_end_epoch():
+    args = argparse.Namespace(train_bs=16, epochs=10, progressive=0.5, progressive_end=0.6, progressive_bs=3)
+    resizing = loaders.progressive_resizing(args, 92, first_epoch=1)
+    assert resizing.end_epoch == 7
+    sizes = [resizing.input_size(epoch) for epoch in range(1, 11)]
+    assert sizes[0] == 48 and sizes[6:] == [92] * 4
+    assert sizes == sorted(sizes) and all(size % 4 == 0 for size in sizes)
+    # the batch grows with the pixels saved, up to progressive_bs times, the learning rate with it
+    assert resizing.train_bs(1) == 48 and resizing.lr_scale(1) == 3
+    assert resizing.train_bs(4) == int(16 * (92. / resizing.input_size(4)) ** 2)
+    assert [resizing.train_bs(epoch) for epoch in range(7, 11)] == [16] * 4
+
+
+def test_batch_size_changes_between_epochs_and_resumes(make_store):
+    root = make_store(num_train=40)
+    trainset = StoreDataset('Tiny', root=root)
+    order = sampler.ResumableSampler(len(trainset), seed=0)
+    loader = torch.utils.data.DataLoader(trainset, batch_size=4, sampler=order)
+    resizing = progressive.ProgressiveResizing(92, 4, 0, 2, min_scale=0.5, max_batch_scale=4)
+    sizes = []
+    for epoch in range(3):
+        order.set_epoch(epoch)
+        resizing.begin(epoch, loader)
+        assert loader.batch_sampler.batch_size == resizing.train_bs(epoch)
+        sizes.append([len(target) for _, target in loader])
+    # 48x48 then 68x68 inputs, then the full size
+    assert sizes == [[14, 14, 12], [7] * 5 + [5], [4] * 10]
+
+    # a snapshot after 14 samples of epoch 1 resumes with that epoch's batch size and the same order
+    order.set_epoch(1)
+    expected = [img for img, _ in loader]
+    order.set_epoch(1, start=14)
+    resizing.begin(1, loader)
+    assert len(order) == 26 and len(loader) == 4
+    assert torch.equal(torch.cat([img for img, _ in loader]), torch.cat(expected)[14:])
+
+    balanced = sampler.ClassBalancedBatchSampler(store.load_class_index('Tiny', 'Training', root), 8)
+    with pytest.raises(Exception):
+        resizing.begin(0, torch.utils.data.DataLoader(trainset, batch_sampler=balanced))
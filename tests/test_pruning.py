@@ -0,0 +1,49 @@
+import copy
+
+import numpy as np
+import torch
+
+from datasets import pruning
+
+
+def score_all(pruner, num, num_classes=7):
+    """Every teacher right and confident on every image, the student loss low on the even ones."""
+    target = torch.arange(num) % num_classes
+    logits = [torch.nn.functional.one_hot(target, num_classes).float() * 10 for _ in range(pruner.num_teachers)]
+    pruner.update(np.arange(num), logits, target, (torch.arange(num) % 2).float() + 0.1)
+
+
+def test_pruned_epoch_keeps_the_expected_gradient():
+    pruner = pruning.ConsensusPruner(200, ratio=0.5, recheck_every=0, seed=0)
+    pruner.set_epoch(0)
+    # nothing scored yet: a full pass
+    assert sorted(pruner.plan) == list(range(200))
+    score_all(pruner, 200)
+    pruner.set_epoch(1)
+    plan = pruner.plan
+    assert 100 < len(plan) < 200
+    # only the solved (even) images are dropped, the kept ones weigh for the dropped ones
+    assert set(range(1, 200, 2)) <= set(plan.tolist())
+    weights = pruner.weights(plan).numpy()
+    assert np.all(weights[plan % 2 == 1] == 1)
+    assert np.all(weights[plan % 2 == 0] == 2)
+    assert abs(weights.sum() - 200) < 30
+
+
+def test_pruner_resumes_the_planned_epoch():
+    pruner = pruning.ConsensusPruner(60, ratio=0.5, recheck_every=0, seed=4)
+    pruner.set_epoch(0)
+    score_all(pruner, 60)
+    pruner.set_epoch(1)
+    full = list(pruner)
+    pruner.set_epoch(1)
+    head = pruner.next_batch(10)
+    # what a snapshot taken after the first 10 samples holds
+    state = copy.deepcopy(pruner.state_dict())
+
+    resumed = pruning.ConsensusPruner(60, ratio=0.5, recheck_every=0, seed=4)
+    resumed.load_state_dict(state)
+    resumed.set_epoch(1, 10)
+    assert list(resumed) == full[10:]
+    assert np.array_equal(resumed.next_batch(len(full) - 10), pruner.next_batch(len(full) - 10))
+    assert [index for index, _ in full[:10]] == head.tolist()
@@ -0,0 +1,75 @@
+import glob
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from datasets import shm, store
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a training run in miniature: the main process builds the shared dataset, two workers read it
+RUN = '''
+import os, sys, torch
+sys.path.insert(0, %r)
+from datasets.generic import StoreDataset
+trainset = StoreDataset(%r, root=%r, shared=True)
+loader = torch.utils.data.DataLoader(trainset, batch_size=4, num_workers=2)
+print(sum(len(target) for _, target in loader))
+print(' '.join(sorted(os.listdir(%r + '.refs'))))
+print(os.getpid())
+'''
+
+
+def run(name, root):
+    """Samples read, holders and pid of a separate process training one epoch on the shared ``name`` split."""
+    code = RUN % (REPO, name, root, shm.segment_prefix(name, 'Training'))
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    return out.stdout.strip().split('\n')[-3:]
+
+
+def segments(name):
+    return glob.glob(os.path.join(shm.SHM_ROOT, 'mtkd_%s_*' % name))
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_worker_loaders_leave_no_segment_behind(make_store):
+    name = 'Shm%d' % os.getpid()
+    root = make_store(name)
+    prefix = shm.segment_prefix(name, 'Training')
+    # the reference of a crashed run is dropped on the next attach
+    os.makedirs(prefix + '.refs')
+    open(os.path.join(prefix + '.refs', str(dead_pid())), 'w').close()
+    try:
+        lines = run(name, root)
+        assert lines[0] == '24'
+        # only the main process holds the segment, not its workers
+        assert lines[1].split() == [lines[2]]
+        assert segments(name) == []
+    finally:
+        for path in segments(name):
+            subprocess.call(['rm', '-rf', path])
+
+
+def test_segment_lives_until_the_last_holder_releases_it(make_store):
+    name = 'Shm%d' % os.getpid()
+    root = make_store(name)
+    prefix = shm.attach(name, 'Training', root)
+    try:
+        assert run(name, root)[0] == '24'
+        # the other run is gone, this process still maps the copy
+        pixels, labels = shm.open_segment(prefix)
+        expected, expected_labels = store.load_split(name, 'Training', root)
+        assert np.array_equal(pixels, expected) and np.array_equal(labels, expected_labels)
+        assert os.listdir(prefix + '.refs') == [str(os.getpid())]
+        shm.release(prefix)
+        assert segments(name) == []
+    finally:
+        for path in segments(name):
+            subprocess.call(['rm', '-rf', path])
@@ -0,0 +1,65 @@
+import torch
+import torch.nn as nn
+
+import snapshot
+from datasets import sampler
+from datasets.generic import seeded
+
+
+class NoisyPoints(torch.utils.data.Dataset):
+    """A random 'augmentation' per sample, drawn like the store datasets draw theirs."""
+    def __init__(self, num):
+        self.points = torch.arange(num * 3, dtype=torch.float32).view(num, 3) / num
+
+    def __len__(self):
+        return len(self.points)
+
+    @seeded
+    def __getitem__(self, index):
+        return self.points[index] + torch.randn(3), index
+
+
+def test_resumed_epoch_continues_the_order():
+    for order in (sampler.ResumableSampler(50, seed=3), sampler.RepeatedAugmentSampler(50, repeats=2, seed=3)):
+        order.set_epoch(4)
+        full = list(order)
+        # the start counts samples, i.e. views of the repeated images
+        order.set_epoch(4, 16)
+        remaining = len(order)
+        rest = list(order)
+        assert len(rest) == remaining < len(full)
+        assert rest == full[len(full) - len(rest):]
+        order.set_epoch(5)
+        assert list(order) != full
+
+
+def train(path, epochs, stop=None):
+    """Train a linear model on ``NoisyPoints``, saving and returning early after ``stop`` samples of epoch 1."""
+    torch.manual_seed(0)
+    net = nn.Linear(3, 2)
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.1, momentum=0.9)
+    order = sampler.ResumableSampler(20, seed=1)
+    loader = torch.utils.data.DataLoader(NoisyPoints(20), batch_size=4, sampler=order)
+    snap = snapshot.Snapshot(str(path), {'net': net}, optimizer, order=order)
+    for epoch in range(snap.load(), epochs):
+        snap.begin(epoch)
+        for inputs, targets in loader:
+            loss = (net(inputs) - targets.float().view(-1, 1)).pow(2).mean() + 0.01 * torch.randn(()).abs()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            snap.step(len(targets))
+            if epoch == 1 and snap.position == stop:
+                snap.save(epoch, snap.position)
+                return net
+        snap.end_epoch(epoch)
+    return net
+
+
+def test_snapshot_resumes_mid_epoch_bit_exactly(tmp_path):
+    reference = train(tmp_path / 'uninterrupted', 3)
+    preempted = train(tmp_path / 'preempted', 3, stop=8)
+    assert not torch.equal(preempted.weight, reference.weight)
+    resumed = train(tmp_path / 'preempted', 3)
+    for ref, value in zip(reference.state_dict().values(), resumed.state_dict().values()):
+        assert torch.equal(ref, value)
@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+from datasets import augment, stats, store
+
+
+def reference(pixels):
+    """Per-channel mean/std of uint8 (N, H, W, 3) pixels in [0, 1], in one go."""
+    values = np.asarray(pixels, dtype=np.float64).reshape(-1, 3) / 255
+    return values.mean(0), values.std(0)
+
+
+def test_running_stats_merge_equals_the_whole_split(make_store):
+    root = make_store(num_train=23)
+    pixels, _ = store.load_split('Tiny', 'Training', root)
+    mean, std = reference(pixels)
+    # uneven batches into one accumulator, and chunks accumulated apart then merged like the pool does
+    single = stats.RunningStats()
+    chunks = []
+    for start, end in ((0, 1), (1, 9), (9, 10), (10, 23)):
+        imgs = augment.to_float(torch.from_numpy(np.array(pixels[start:end])))
+        single.update(imgs)
+        chunks.append(stats.RunningStats())
+        chunks[-1].update(imgs)
+    merged = stats.RunningStats()
+    for chunk in chunks:
+        merged.merge(chunk.count, chunk.mean, chunk.m2)
+    for running in (single, merged):
+        assert running.count == 23 * 100 * 100
+        assert np.allclose(running.mean, mean, rtol=0, atol=1e-6)
+        assert np.allclose(running.std(), std, rtol=0, atol=1e-6)
+
+
+def test_pooled_chunks_equal_one_pass(make_store):
+    root = make_store(num_train=23, num_test=11)
+    pooled = stats.compute_stats('Tiny', num_workers=2, chunk=5, batch_size=3, root=root)
+    serial = stats.compute_stats('Tiny', num_workers=1, chunk=5, batch_size=3, root=root)
+    assert sorted(pooled) == ['student', 'student_test', 'teacher', 'teacher_test']
+    for view in pooled:
+        for value, expected in zip(pooled[view], serial[view]):
+            assert np.allclose(value, expected, rtol=0, atol=1e-6)
+    # the test crops are deterministic: the TenCrop(92) pixels of the whole split
+    pixels, _ = store.load_split('Tiny', 'PrivateTest', root)
+    crops = augment.ten_crop(torch.from_numpy(np.array(pixels)).permute(0, 3, 1, 2), 92)
+    mean, std = reference(crops.movedim(-3, -1).numpy())
+    assert np.allclose(pooled['teacher_test'][0], mean, rtol=0, atol=1e-6)
+    assert np.allclose(pooled['teacher_test'][1], std, rtol=0, atol=1e-6)
@@ -0,0 +1,41 @@
+import h5py
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+
+from datasets import store
+
+
+def write_h5(root, name, train, test, flat):
+    with h5py.File(store.h5_path(name, str(root)), 'w') as f:
+        for prefix, (pixels, labels) in (('train', train), ('valid', test)):
+            f[prefix + '_data_pixel'] = pixels.reshape(-1) if flat else pixels.reshape(len(labels), -1)
+            f[prefix + '_data_label'] = labels
+
+
+def test_convert_h5_in_chunks(tmp_path):
+    rng = np.random.RandomState(0)
+    train = rng.randint(0, 256, (7, 100, 100, 3)).astype(np.uint8), rng.randint(0, 4, 7)
+    test = rng.randint(0, 256, (3, 100, 100, 3)).astype(np.uint8), np.arange(3)
+    for name, flat in (('Rows', False), ('Flat', True)):
+        write_h5(tmp_path, name, train, test, flat)
+        meta = store.convert_h5(name, str(tmp_path), chunk=2)
+        assert meta['num_classes'] == 4
+        for split, (pixels, labels) in (('Training', train), ('PrivateTest', test)):
+            got_pixels, got_labels = store.load_split(name, split, str(tmp_path))
+            assert np.array_equal(got_pixels, pixels)
+            assert np.array_equal(got_labels, labels)
+
+
+def test_pyramid_levels_equal_resize(make_store):
+    root = make_store(num_test=11)
+    # uneven chunks over two workers
+    store.build_pyramid('Tiny', 'PrivateTest', (48, 20), num_workers=2, chunk=3, root=root)
+    pixels, _ = store.load_split('Tiny', 'PrivateTest', root)
+    for size in (48, 20):
+        level = store.load_level('Tiny', 'PrivateTest', size, root)
+        assert level.shape == (11, size, size, 3)
+        expected = np.stack([np.asarray(transforms.Resize(size)(Image.fromarray(img))) for img in pixels])
+        assert np.array_equal(level, expected)
+    assert store.load_level('Tiny', 'PrivateTest', 36, root) is None
+    assert store.load_level('Tiny', 'Training', 48, root) is None
@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+
+from datasets import stream
+from datasets.generic import StoreDataset
+
+
+def stream_indices(trainset, sharded, num_workers=0):
+    """Indices into the store of the images an epoch of ``sharded`` yields, in order."""
+    index = dict((trainset[i][0].tobytes(), i) for i in range(len(trainset)))
+    loader = torch.utils.data.DataLoader(sharded, batch_size=4, num_workers=num_workers, collate_fn=lambda batch: batch)
+    seen = []
+    for batch in loader:
+        for img, target in batch:
+            seen.append(index[img.tobytes()])
+            assert target == trainset.labels[seen[-1]]
+    return seen
+
+
+def test_stream_covers_the_split_once_per_epoch(make_store):
+    trainset = StoreDataset('Tiny', root=make_store(num_train=23))
+    sharded = stream.ShardedStream(trainset, shard_size=5, buffer_size=6, seed=1)
+    assert len(sharded) == 23
+    first = stream_indices(trainset, sharded)
+    assert sorted(first) == list(range(23))
+    # both workers read their own shards, still every image once
+    assert sorted(stream_indices(trainset, sharded, num_workers=2)) == list(range(23))
+    sharded.set_epoch(1)
+    second = stream_indices(trainset, sharded)
+    assert sorted(second) == list(range(23)) and second != first
+
+
+def test_stream_without_buffer_keeps_the_shards_contiguous(make_store):
+    trainset = StoreDataset('Tiny', root=make_store(num_train=23))
+    sharded = stream.ShardedStream(trainset, shard_size=5, buffer_size=0, seed=1)
+    seen = stream_indices(trainset, sharded)
+    order = np.random.RandomState(1).permutation(5)
+    # shards in the epoch's order, each one as stored; the last one is short
+    start = 0
+    for shard in order:
+        size = min(5, 23 - shard * 5)
+        assert seen[start:start + size] == list(range(shard * 5, shard * 5 + size))
+        start += size
+    assert start == 23
@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+from datasets import augment, store, teacher_cache
+from network.teacherNet import Teacher
+
+MEAN, STD = (0.5, 0.45, 0.4), (0.25, 0.2, 0.3)
+KEYS = ('Teacher1', 'Teacher2')
+
+
+def make_teachers(tmp_path):
+    """Two frozen teachers and the checkpoint they are loaded from."""
+    nets = []
+    for seed in range(2):
+        torch.manual_seed(seed)
+        net = Teacher(num_classes=7)
+        # running statistics of normalized inputs, the untrained defaults overflow float16
+        for module in net.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.momentum = None
+        with torch.no_grad():
+            net(torch.randn(8, 3, 92, 92))
+        nets.append(net.eval())
+    checkpoint = str(tmp_path / 'Best_MultiTeacher_model.t7')
+    torch.save(dict((key, net.state_dict()) for key, net in zip(KEYS, nets)), checkpoint)
+    return nets, checkpoint
+
+
+def teacher_outputs(nets, crop):
+    """What every teacher outputs for the uint8 (H, W, C) crop."""
+    inputs = augment.to_normalized(torch.from_numpy(np.array(crop)).permute(2, 0, 1)[None], MEAN, STD)
+    with torch.no_grad():
+        return [net(inputs) for net in nets]
+
+
+def test_logits_are_those_of_the_replayed_crops(make_store, tmp_path):
+    root = make_store(num_train=5)
+    nets, checkpoint = make_teachers(tmp_path)
+    pixels, _ = store.load_split('Tiny', 'Training', root)
+    cache = teacher_cache.TeacherCache(teacher_cache.build('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=3, batch_size=2, root=root))
+    topk = teacher_cache.TeacherCache(teacher_cache.build('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=3, topk=3, batch_size=2, root=root))
+    assert topk.path != cache.path and topk.same_augmentations(cache)
+    for index in range(5):
+        for slot in range(3):
+            crop = cache.replay(Image.fromarray(pixels[index]), index, slot)
+            # the crop the student sees is the one build() fed the teachers
+            top, left, flip = cache.augmentation(np.array([index]), np.array([slot]))
+            assert np.array_equal(np.array(crop), augment.crop_flip(torch.from_numpy(np.array(pixels[index:index + 1])), top, left, flip, 92)[0].numpy())
+            expected = torch.stack([output[-1][0] for output in teacher_outputs(nets, crop)])
+            logits = cache.logits(index, slot)
+            assert logits.dtype == torch.float16 and logits.shape == (2, 7)
+            assert (logits.float() - expected).abs().max() < 2e-3 * expected.abs().max()
+            # top-k + tail: the same softmax at T=1, the other classes share the rest of the mass
+            prob, approx = logits.float().softmax(1), topk.logits(index, slot).float().softmax(1)
+            top_prob, classes = prob.topk(3, 1)
+            assert torch.allclose(approx.gather(1, classes), top_prob, atol=1e-3)
+            assert torch.allclose(approx.sum(1), torch.ones(2), atol=1e-3)
+    # arrays of indices read whole batches
+    indices, slots = np.array([4, 0, 2]), np.array([1, 1, 0])
+    assert torch.equal(cache.logits(indices, slots), torch.stack([cache.logits(i, s) for i, s in zip(indices, slots)]))
+
+
+def test_int8_features_are_within_one_step_of_the_float16_ones(make_store, tmp_path):
+    root = make_store(num_train=3)
+    nets, checkpoint = make_teachers(tmp_path)
+    pixels, _ = store.load_split('Tiny', 'Training', root)
+    layers, sizes = ('rb1', 'mimic'), {'rb1': 11}
+    exact = teacher_cache.FeatureCache(teacher_cache.build_features('Tiny', nets, checkpoint, KEYS, MEAN, STD, layers=layers, pool=2,
+                                                                    sizes=sizes, root=root))
+    quantized = teacher_cache.FeatureCache(teacher_cache.build_features('Tiny', nets, checkpoint, KEYS, MEAN, STD, layers=layers, pool=2,
+                                                                        sizes=sizes, dtype='int8', root=root))
+    assert exact.path != quantized.path
+    for index in range(3):
+        for slot in range(2):
+            outputs = teacher_outputs(nets, exact.replay(Image.fromarray(pixels[index]), index, slot))
+            rb1 = torch.stack([torch.nn.functional.adaptive_avg_pool2d(output[0], 11)[0] for output in outputs])
+            mimic = torch.stack([output[3][0] for output in outputs])
+            for value, expected in zip(exact.features(index, slot), (rb1, mimic)):
+                assert (value.float() - expected).abs().max() < 2e-3 * expected.abs().max()
+            for value, reference, dims in zip(quantized.features(index, slot), exact.features(index, slot), ((2, 3), (1,))):
+                reference = reference.float()
+                step = reference.abs().amax(dims, keepdim=True) / 127
+                # rounding to the nearest step, plus the float16 scale and output
+                assert ((value.float() - reference).abs() <= 0.51 * step * (1 + 2e-3) + 1e-3 * reference.abs()).all()
+
+
+def test_cache_is_reused_and_follows_the_checkpoint(make_store, tmp_path):
+    root = make_store(num_train=2)
+    nets, checkpoint = make_teachers(tmp_path)
+    path = teacher_cache.build('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=1, root=root)
+    mtime = os.stat(path + '_logits.npy').st_mtime_ns
+    assert teacher_cache.build('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=1, root=root) == path
+    assert os.stat(path + '_logits.npy').st_mtime_ns == mtime
+    # retrained teachers: a new checkpoint mtime, a new cache
+    stat = os.stat(checkpoint)
+    os.utime(checkpoint, (stat.st_atime, stat.st_mtime + 10))
+    assert teacher_cache.build('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=1, root=root) != path
+    features = teacher_cache.build_features('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=1, root=root)
+    os.utime(checkpoint, (stat.st_atime, stat.st_mtime + 20))
+    assert teacher_cache.build_features('Tiny', nets, checkpoint, KEYS, MEAN, STD, pool=1, root=root) != features
@@ -17,18 +17,19 @@ import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
 import torchvision.transforms as transforms
 from torch.autograd import Variable
-from datasets.RAF import RAF
-from datasets.PET import PET
-from datasets.colorferet import colorferet
-from datasets.FairFace import FairFace
+from datasets import store, stats
+from datasets.generic import DualViewDataset
+from datasets import augment
+from datasets import loaders
+from datasets import teacher_cache
 from network.teacherNet import Teacher
 from network.studentNet import CNN_RIS
-import other
 
 import utils
 from utils import load_pretrained_model, count_parameters_in_MB
 
 import losses
+import snapshot
 from tensorboardX import SummaryWriter
 from network.num_student import Dynamic_MultiTeacher2,Dynamic_MultiTeacher3,Dynamic_MultiTeacher4,\
                Dynamic_MultiTeacher5,Dynamic_MultiTeacher6,Dynamic_MultiTeacher7, Dynamic_MultiTeacher8
@@ -54,7 +55,16 @@ parser.add_argument('--cuda', type=int, default=1)
 parser.add_argument('--seed', type=int, default=2, help='random seed')
 parser.add_argument('--num_workers', type=int, default=1, help='num_workers')
 parser.add_argument('--noise', type=str, default='None', help='GaussianBlur,AverageBlur,MedianBlur,BilateralFilter,Salt-and-pepper')
+parser.add_argument('--severity', type=int, default=3, help='severity of the test-set noise, 1-5')
+parser.add_argument('--batch_aug', type=int, default=0, help='crop/flip/resize/normalize whole batches on the device')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
 parser.add_argument('--number_teacher', default=2, type=int, help='Batch size')
+parser.add_argument('--prefetch', type=int, default=0, help='batches staged ahead in pinned buffers, 0 disables the prefetcher')
+parser.add_argument('--shm', type=int, default=0, help='share one copy of the dataset in /dev/shm between concurrent runs')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
+parser.add_argument('--resume', type=int, default=0, help='continue from the snapshot.t7 of an interrupted run')
+parser.add_argument('--teacher_cache', type=int, default=0, help='recorded crops/flips per training image whose teacher logits are computed once and read back, 0 runs the teachers every step')
+parser.add_argument('--teacher_cache_topk', type=int, default=0, help='keep only the top-k teacher logits in the cache, 0 keeps all classes')
 
 args, unparsed = parser.parse_known_args()
 
@@ -70,15 +80,18 @@ if args.cuda:
 else:
     pass
 
-tcheckpoint = torch.load(os.path.join('results/' + args.data_name+ '_MultiTeacher_OurDiversity_NumberTeacher_'+ \
-                                      str(args.number_teacher),'Best_MultiTeacher_model.t7'))
+tcheckpoint_path = os.path.join('results/' + args.data_name+ '_MultiTeacher_OurDiversity_NumberTeacher_'+ \
+                                str(args.number_teacher),'Best_MultiTeacher_model.t7')
+tcheckpoint = torch.load(tcheckpoint_path)
+
+NUM_CLASSES = store.num_classes(args.data_name)
 
 print ('The dataset used for training is:   '+ str(args.data_name))
 print ('The number of teachers is :       '+ str(args.number_teacher))
 
 if args.number_teacher == 2:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     print ('best_Teacher1_acc is '+ str(tcheckpoint['test_Teacher1_accuracy']))
@@ -90,9 +103,9 @@ if args.number_teacher == 2:
     for param in tnet2.parameters():
         param.requires_grad = False
 elif args.number_teacher == 3:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
-    tnet3 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet3 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -109,10 +122,10 @@ elif args.number_teacher == 3:
     for param in tnet3.parameters():
         param.requires_grad = False
 elif args.number_teacher == 4:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
-    tnet3 = Teacher().cuda()
-    tnet4 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet4 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -134,11 +147,11 @@ elif args.number_teacher == 4:
     for param in tnet4.parameters():
         param.requires_grad = False
 elif args.number_teacher == 5:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
-    tnet3 = Teacher().cuda()
-    tnet4 = Teacher().cuda()
-    tnet5 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet5 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -165,12 +178,12 @@ elif args.number_teacher == 5:
     for param in tnet5.parameters():
         param.requires_grad = False
 elif args.number_teacher == 6:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
-    tnet3 = Teacher().cuda()
-    tnet4 = Teacher().cuda()
-    tnet5 = Teacher().cuda()
-    tnet6 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet5 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet6 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -202,13 +215,13 @@ elif args.number_teacher == 6:
     for param in tnet6.parameters():
         param.requires_grad = False 
 elif args.number_teacher == 7:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
-    tnet3 = Teacher().cuda()
-    tnet4 = Teacher().cuda()
-    tnet5 = Teacher().cuda()
-    tnet6 = Teacher().cuda()
-    tnet7 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet5 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet6 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet7 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -245,14 +258,14 @@ elif args.number_teacher == 7:
     for param in tnet7.parameters():
         param.requires_grad = False 
 elif args.number_teacher == 8:
-    tnet1 = Teacher().cuda()
-    tnet2 = Teacher().cuda()
-    tnet3 = Teacher().cuda()
-    tnet4 = Teacher().cuda()
-    tnet5 = Teacher().cuda()
-    tnet6 = Teacher().cuda()
-    tnet7 = Teacher().cuda()
-    tnet8 = Teacher().cuda()
+    tnet1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet5 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet6 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet7 = Teacher(num_classes=NUM_CLASSES).cuda()
+    tnet8 = Teacher(num_classes=NUM_CLASSES).cuda()
     load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
     load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
     load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -300,7 +313,7 @@ print ('best_Teacher_Avg_accuracy is '+ str(tcheckpoint['test_Avg_accuracy']))
 print ('best_Teacher_Avg_MAP is '+ str(tcheckpoint['test_Avg_MAP'])) 
 print ('best_Teacher_Avg_F1 is '+ str(tcheckpoint['test_Avg_F1'])) 
 
-snet = CNN_RIS().cuda()
+snet = CNN_RIS(num_classes=NUM_CLASSES).cuda()
 criterion = nn.CrossEntropyLoss().cuda()
 optimizer = torch.optim.SGD(snet.parameters(), lr = args.lr, momentum = args.momentum,
                             weight_decay = args.weight_decay,nesterov = True)
@@ -310,40 +323,9 @@ transform_train = transforms.Compose([
     transforms.RandomHorizontalFlip(),
 ])
 
-if args.data_name == 'RAF':
-	transforms_teacher_Normalize = transforms.Normalize((0.5884594, 0.45767313, 0.40865755), 
-                            (0.25717735, 0.23602168, 0.23505741))
-	transforms_student_Normalize =  transforms.Normalize((0.58846486, 0.45766878, 0.40865615), 
-                            (0.2516557, 0.23020789, 0.22939532))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.59003043, 0.4573948, 0.40749523], std=[0.2465465, 0.22635746, 0.22564183])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'PET':
-	transforms_teacher_Normalize = transforms.Normalize((0.47950855, 0.4454716, 0.3953508), 
-                            (0.26221144, 0.25676072, 0.2640482))
-	transforms_student_Normalize =  transforms.Normalize((0.4794851, 0.44543326, 0.39531776), 
-                            (0.24786888, 0.24236518, 0.24950708))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.4862494, 0.45275217, 0.39576027], std=[0.24864933, 0.2446337, 0.2527274])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'colorferet':
-	transforms_teacher_Normalize = transforms.Normalize((0.50150657, 0.4387828, 0.37715995), 
-                            (0.22249317, 0.24526535, 0.25831717))
-	transforms_student_Normalize =  transforms.Normalize((0.50166893, 0.43892872, 0.37727863), 
-                            (0.21588857, 0.23875234, 0.25212118))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.4992823, 0.4371743, 0.37574747], std=[0.21377444, 0.23534843, 0.24466512])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'FairFace':
-	transforms_teacher_Normalize = transforms.Normalize((0.4911152, 0.36028033, 0.30489963), 
-                            (0.25160596, 0.21829675, 0.21198231))
-	transforms_student_Normalize =  transforms.Normalize((0.4911364, 0.3602937, 0.3049148), 
-                            (0.24722975, 0.21383813, 0.20771481))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49202734, 0.36110377, 0.30535242], std=[0.24179104, 0.21022305, 0.20413795])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-else:
-    raise Exception('Invalid dataset name...')
+transforms_teacher_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher'))
+transforms_student_Normalize =  transforms.Normalize(*stats.norm_stats(args.data_name, 'student'))
+transforms_test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'student_test'))
 
 teacher_norm = transforms.Compose([
 transforms.ToTensor(),
@@ -358,37 +340,52 @@ transforms_student_Normalize,
 
 transform_test = transforms.Compose([
 transforms.TenCrop(44),
-transforms_test_Normalize,
+transforms.Lambda(lambda crops: torch.stack([transforms_test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),
 ])
 
-if args.data_name == 'RAF':
-	trainset = RAF(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = RAF(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'PET':
-	trainset = PET(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = PET(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'colorferet':
-	trainset = colorferet(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = colorferet(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'FairFace':
-	trainset = FairFace(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = FairFace(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-else:
-	raise Exception('Invalid dataset name...')
+if args.batch_aug:
+	# the loader ships raw uint8 pixels, train() augments and normalizes the whole batch
+	batch_augment = augment.TeacherStudentAugment(transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+	                                              transforms_student_Normalize.mean, transforms_student_Normalize.std, S_size=44)
+	transform_train = None
+
+if args.batch_tencrop:
+	# the loader ships raw uint8 pixels, test() resizes, crops and normalizes the whole batch
+	batch_tencrop = augment.TenCropNormalize(44, transforms_test_Normalize.mean, transforms_test_Normalize.std,
+	                                         resize=48)
+	transform_test = None
+
+teacher_logits = None
+if args.teacher_cache:
+    # the teachers run once over a fixed pool of crops/flips of every training image, train() reads their logits back
+    if args.batch_aug:
+        raise Exception('--teacher_cache replays recorded crops and cannot be combined with --batch_aug...')
+    teachers = [globals()['tnet%d' % i] for i in range(1, args.number_teacher + 1)]
+    teacher_logits = teacher_cache.TeacherCache(teacher_cache.build(args.data_name, teachers, tcheckpoint_path, ['Teacher%d' % i for i in range(1, len(teachers) + 1)],
+                                                                    transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+                                                                    pool=args.teacher_cache, topk=args.teacher_cache_topk))
+trainset = DualViewDataset(args.data_name, split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise, shared=args.shm, teacher_cache=teacher_logits)
+PrivateTestset = DualViewDataset(args.data_name, split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise, severity=args.severity, shared=args.shm)
 
-trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, shuffle=True, num_workers=args.num_workers)
-PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=args.num_workers)
+# training order, loaders and --eval_cache/--prefetch of the data flags, see datasets.loaders
+trainset, trainloader, train_order, PrivateTestloader = loaders.build_loaders(args, trainset, PrivateTestset, 44, transforms_test_Normalize.mean, transforms_test_Normalize.std, S_size=44, seed=args.seed)
 
 best_acc = 0
 best_mAP = 0
 best_F1 = 0
-NUM_CLASSES = 7
 learning_rate_decay_start = 80  # 50
 learning_rate_decay_every = 5 # 5
 learning_rate_decay_rate = 0.9 # 0.9
 
+# snapshot.t7 after every epoch and on SIGTERM/SIGUSR1 mid-epoch, --resume continues from it
+snap = snapshot.Snapshot(path, {'snet': snet}, optimizer, order=train_order, scope=globals(), names=('best_acc', 'best_mAP', 'best_F1'))
+start_epoch = 1
+if args.resume:
+    start_epoch = snap.load(start_epoch)
+
 def train(epoch):
     print('\nEpoch: %d' % epoch)
+    snap.begin(epoch)
     snet.train()
     train_loss = 0
     
@@ -402,7 +399,14 @@ def train(epoch):
         current_lr = args.lr
     print('learning_rate: %s' % str(current_lr))
 
-    for batch_idx, (img_teacher, img_student, target) in enumerate(trainloader):
+    for batch_idx, batch in enumerate(trainloader):
+        if args.batch_aug:
+            img, target = batch
+            if args.cuda:
+                img = img.cuda(non_blocking=True)
+            img_teacher, img_student = batch_augment(img)
+        else:
+            img_teacher, img_student, target = batch
         if args.cuda:
             img_teacher = img_teacher.cuda()
             img_student = img_student.cuda()
@@ -412,51 +416,55 @@ def train(epoch):
         img_teacher, img_student, target = Variable(img_teacher), Variable(img_student), Variable(target)
         
         rb1_s, rb2_s, rb3_s, mimic_s, out_s = snet(img_student)
-        with torch.no_grad():
-            if args.number_teacher == 2:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-            elif args.number_teacher == 3:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-                _, _, _, _, out_t3 = tnet3(img_teacher)
-            elif args.number_teacher == 4:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-                _, _, _, _, out_t3 = tnet3(img_teacher)
-                _, _, _, _, out_t4 = tnet4(img_teacher)
-            elif args.number_teacher == 5:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-                _, _, _, _, out_t3 = tnet3(img_teacher)
-                _, _, _, _, out_t4 = tnet4(img_teacher)
-                _, _, _, _, out_t5 = tnet5(img_teacher)
-            elif args.number_teacher == 6:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-                _, _, _, _, out_t3 = tnet3(img_teacher)
-                _, _, _, _, out_t4 = tnet4(img_teacher)
-                _, _, _, _, out_t5 = tnet5(img_teacher)
-                _, _, _, _, out_t6 = tnet6(img_teacher)
-            elif args.number_teacher == 7:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-                _, _, _, _, out_t3 = tnet3(img_teacher)
-                _, _, _, _, out_t4 = tnet4(img_teacher)
-                _, _, _, _, out_t5 = tnet5(img_teacher)
-                _, _, _, _, out_t6 = tnet6(img_teacher)
-                _, _, _, _, out_t7 = tnet7(img_teacher)
-            elif args.number_teacher == 8:
-                _, _, _, _, out_t1 = tnet1(img_teacher)
-                _, _, _, _, out_t2 = tnet2(img_teacher)
-                _, _, _, _, out_t3 = tnet3(img_teacher)
-                _, _, _, _, out_t4 = tnet4(img_teacher)
-                _, _, _, _, out_t5 = tnet5(img_teacher)
-                _, _, _, _, out_t6 = tnet6(img_teacher)
-                _, _, _, _, out_t7 = tnet7(img_teacher)
-                _, _, _, _, out_t8 = tnet8(img_teacher)
-            else:
-                raise Exception('Invalid ...')
+        if args.teacher_cache:
+            # img_teacher holds the cached logits of the replayed crop, one row per teacher
+            out_t1, out_t2, out_t3, out_t4, out_t5, out_t6, out_t7, out_t8 = (list(img_teacher.float().unbind(1)) + [None] * 8)[:8]
+        else:
+            with torch.no_grad():
+                if args.number_teacher == 2:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                elif args.number_teacher == 3:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                    _, _, _, _, out_t3 = tnet3(img_teacher)
+                elif args.number_teacher == 4:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                    _, _, _, _, out_t3 = tnet3(img_teacher)
+                    _, _, _, _, out_t4 = tnet4(img_teacher)
+                elif args.number_teacher == 5:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                    _, _, _, _, out_t3 = tnet3(img_teacher)
+                    _, _, _, _, out_t4 = tnet4(img_teacher)
+                    _, _, _, _, out_t5 = tnet5(img_teacher)
+                elif args.number_teacher == 6:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                    _, _, _, _, out_t3 = tnet3(img_teacher)
+                    _, _, _, _, out_t4 = tnet4(img_teacher)
+                    _, _, _, _, out_t5 = tnet5(img_teacher)
+                    _, _, _, _, out_t6 = tnet6(img_teacher)
+                elif args.number_teacher == 7:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                    _, _, _, _, out_t3 = tnet3(img_teacher)
+                    _, _, _, _, out_t4 = tnet4(img_teacher)
+                    _, _, _, _, out_t5 = tnet5(img_teacher)
+                    _, _, _, _, out_t6 = tnet6(img_teacher)
+                    _, _, _, _, out_t7 = tnet7(img_teacher)
+                elif args.number_teacher == 8:
+                    _, _, _, _, out_t1 = tnet1(img_teacher)
+                    _, _, _, _, out_t2 = tnet2(img_teacher)
+                    _, _, _, _, out_t3 = tnet3(img_teacher)
+                    _, _, _, _, out_t4 = tnet4(img_teacher)
+                    _, _, _, _, out_t5 = tnet5(img_teacher)
+                    _, _, _, _, out_t6 = tnet6(img_teacher)
+                    _, _, _, _, out_t7 = tnet7(img_teacher)
+                    _, _, _, _, out_t8 = tnet8(img_teacher)
+                else:
+                    raise Exception('Invalid ...')
         if args.number_teacher == 2:
             loss = Dynamic_MultiTeacher2().cuda()(out_t1, out_t2, out_s, target)
         elif args.number_teacher == 3:
@@ -476,6 +484,7 @@ def train(epoch):
         loss.backward()
         utils.clip_gradient(optimizer, 0.1)
         optimizer.step()
+        snap.step(len(target))
         train_loss += loss.item()
         
         conf_mat += losses.confusion_matrix(out_s, target, NUM_CLASSES)
@@ -489,6 +498,9 @@ def train(epoch):
         f1 = 2 * precision*recall/(precision+recall + 1e-10)
         F1_score = f1.mean()
     
+    if args.prefetch:
+        print(trainloader.report())
+        trainloader.reset_stats()
     return train_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
 def test(epoch):
@@ -498,6 +510,10 @@ def test(epoch):
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
     for batch_idx, (img, target) in enumerate(PrivateTestloader):
         t = time.time()
+        if args.batch_tencrop:
+            if args.cuda:
+                img = img.cuda(non_blocking=True)
+            img = batch_tencrop(img)
         test_bs, ncrops, c, h, w = np.shape(img)
         img = img.view(-1, c, h, w)
         if args.cuda:
@@ -525,7 +541,7 @@ def test(epoch):
   
     return PrivateTest_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
-for epoch in range(1, args.epochs+1):
+for epoch in range(start_epoch, args.epochs+1):
     train_loss, train_acc, train_mAP, train_F1 = train(epoch)
     test_loss, test_acc, test_mAP, test_F1 = test(epoch)
     print("train_loss:  %0.3f, train_acc:  %0.3f, train_mAP:  %0.3f, train_F1:  %0.3f"%
@@ -554,6 +570,7 @@ for epoch in range(1, args.epochs+1):
             'test_epoch': epoch,
         } 
         torch.save(state, os.path.join(path,'Student_Test_model.t7'))
+    snap.end_epoch(epoch)
 
 print("best_PrivateTest_acc: %0.3f" % best_acc)
 print("best_PrivateTest_mAP: %0.3f" % best_mAP)
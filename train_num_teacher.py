@@ -17,14 +17,15 @@ import math
 import argparse
 import utils
 import losses
-import other
+import snapshot
 from utils import load_pretrained_model
-from datasets.RAF import RAF_multi_teacher
-from datasets.PET import PET_multi_teacher
-from datasets.colorferet import colorferet_multi_teacher
-from datasets.FairFace import FairFace_multi_teacher
+from datasets import store, stats
+from datasets.generic import StoreDataset
+from datasets import augment
+from datasets import loaders
 from torch.autograd import Variable
 from network.teacherNet import Teacher
+from network.ensemble import TeacherEnsemble, PackedTeacher
 from tensorboardX import SummaryWriter
 from utils import ACC_evaluation
 
@@ -41,12 +42,20 @@ parser.add_argument('--variance', default=0, type=float, help='variance')
 parser.add_argument('--fusion', type=str, default="OurDiversity", help='OurDiversity')
 parser.add_argument('--number_teacher', default=2, type=int, help='Batch size')
 parser.add_argument('--num_workers', type=int, default=1, help='num_workers')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
+parser.add_argument('--prefetch', type=int, default=0, help='batches staged ahead in pinned buffers, 0 disables the prefetcher')
+parser.add_argument('--shm', type=int, default=0, help='share one copy of the dataset in /dev/shm between concurrent runs')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
+parser.add_argument('--resume', type=int, default=0, help='continue from the snapshot.t7 of an interrupted run')
+parser.add_argument('--uint8_input', type=int, default=0, help='ship uint8 crops and normalize them inside the first convolution')
+parser.add_argument('--vmap', type=int, default=0, help='stack the teachers and run them as one vectorized forward')
+parser.add_argument('--packed', type=int, default=0, help='pack the teachers into one network of grouped convolutions')
 args = parser.parse_args()
 
 use_cuda = torch.cuda.is_available()
 
 best_ACC = 0
-NUM_CLASSES = 7
+NUM_CLASSES = store.num_classes(args.data_name)
 learning_rate_decay_start = 80  # 50
 learning_rate_decay_every = 5 # 5
 learning_rate_decay_rate = 0.9 # 0.9
@@ -65,138 +74,129 @@ print ('The variance is:                           '+ str(args.variance))
 print ('The number of teachers is:                    '+ str(args.number_teacher))
 print('==> Preparing data..')
 
-if args.data_name == 'RAF':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.5884594, 0.45767313, 0.40865755), 
-                      (0.25717735, 0.23602168, 0.23505741)),
-    ]) 
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.589667, 0.45717254, 0.40727714], std=[0.25235596, 0.23242524, 0.23155019])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'PET':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.47950855, 0.4454716, 0.3953508), 
-                      (0.26221144, 0.25676072, 0.2640482)),])
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.486185, 0.45276144, 0.39575183], std=[0.2640792, 0.25989106, 0.26799843])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'colorferet':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.50150657, 0.4387828, 0.37715995), 
-                      (0.22249317, 0.24526535, 0.25831717)),
-    ]) 
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49930117, 0.43744352, 0.37612754], std=[0.22151423, 0.24302939, 0.2520711])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'FairFace':
+transform_train = transforms.Compose([
+    transforms.RandomCrop(92),
+    transforms.RandomHorizontalFlip(),
+    transforms.ToTensor(),
+    transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher')),
+])
+test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher_test'))
+transform_test = transforms.Compose([
+    transforms.TenCrop(92),
+    transforms.Lambda(lambda crops: torch.stack([test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),])
+
+if args.uint8_input:
+    # the loaders ship uint8 crops, the networks fold the normalization into conv1
     transform_train = transforms.Compose([
         transforms.RandomCrop(92),
         transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.4911152, 0.36028033, 0.30489963), 
-                      (0.25160596, 0.21829675, 0.21198231)),
-    ]) 
+        transforms.PILToTensor(),
+    ])
     transform_test = transforms.Compose([
         transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49167913, 0.36098105, 0.30529523], std=[0.24649838, 0.21503104, 0.20875944])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-else:
-    raise Exception('Invalid ...')
+        transforms.Lambda(lambda crops: torch.stack([transforms.PILToTensor()(crop) for crop in crops])),])
 
-if args.data_name == 'RAF':
-    trainset = RAF_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = RAF_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'PET':
-    trainset = PET_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = PET_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'colorferet':
-    trainset = colorferet_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = colorferet_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'FairFace':
-    trainset = FairFace_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = FairFace_multi_teacher(split = 'PrivateTest', transform=transform_test)
-else:
-    raise Exception('Invalid dataset name...')
-trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, shuffle=True, num_workers=args.num_workers)
-PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=args.num_workers)
+if args.batch_tencrop:
+    # the loader ships raw uint8 pixels, test() crops and normalizes the whole batch
+    batch_tencrop = augment.TenCropNormalize(92, test_Normalize.mean, test_Normalize.std)
+    transform_test = None
+
+trainset = StoreDataset(args.data_name, split = 'Training', transform=transform_train, shared=args.shm)
+PrivateTestset = StoreDataset(args.data_name, split = 'PrivateTest', transform=transform_test, shared=args.shm)
+# training order, loaders and --eval_cache/--prefetch of the data flags, see datasets.loaders
+trainset, trainloader, train_order, PrivateTestloader = loaders.build_loaders(args, trainset, PrivateTestset, 92, test_Normalize.mean, test_Normalize.std)
 criterion = nn.CrossEntropyLoss()
+# (mean, std) folded into conv1 with --uint8_input, None where the batches arrive normalized
+train_input_norm = stats.norm_stats(args.data_name, 'teacher') if args.uint8_input else None
+test_input_norm = test_Normalize.mean, test_Normalize.std
+if not args.uint8_input or args.batch_tencrop or args.eval_cache:
+    test_input_norm = None
 
 if args.number_teacher == 2:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 elif args.number_teacher == 3:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
-    net3 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net3 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 elif args.number_teacher == 4:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
-    net3 = Teacher().cuda()
-    net4 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net4 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),\
                                           net4.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 elif args.number_teacher == 5:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
-    net3 = Teacher().cuda()
-    net4 = Teacher().cuda()
-    net5 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net5 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),net4.parameters(),\
                                           net5.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 elif args.number_teacher == 6:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
-    net3 = Teacher().cuda()
-    net4 = Teacher().cuda()
-    net5 = Teacher().cuda()
-    net6 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net5 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net6 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),net4.parameters(),\
                                 net5.parameters(),net6.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 elif args.number_teacher == 7:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
-    net3 = Teacher().cuda()
-    net4 = Teacher().cuda()
-    net5 = Teacher().cuda()
-    net6 = Teacher().cuda()
-    net7 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net5 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net6 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net7 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),net4.parameters(),\
                                 net5.parameters(),net6.parameters(),net7.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 elif args.number_teacher == 8:
-    net1 = Teacher().cuda()
-    net2 = Teacher().cuda()
-    net3 = Teacher().cuda()
-    net4 = Teacher().cuda()
-    net5 = Teacher().cuda()
-    net6 = Teacher().cuda()
-    net7 = Teacher().cuda()
-    net8 = Teacher().cuda()
+    net1 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net2 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net3 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net4 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net5 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net6 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net7 = Teacher(num_classes=NUM_CLASSES).cuda()
+    net8 = Teacher(num_classes=NUM_CLASSES).cuda()
     optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),net4.parameters(),\
                    net5.parameters(),net6.parameters(),net7.parameters(),net8.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 else:
     raise Exception('Invalid ...')
+nets = [globals()['net%d' % i] for i in range(1, args.number_teacher + 1)]
+
+if args.vmap or args.packed:
+    # one stacked (--vmap) or packed (--packed) copy of the teachers trains instead of them; they only
+    # receive its weights to be saved
+    teachers = PackedTeacher.from_teachers(nets) if args.packed else TeacherEnsemble(nets)
+    for net in nets:
+        net.cpu()
+    optimizer = optim.SGD(teachers.parameters(), lr=args.lr, momentum=0.9, weight_decay=5e-4)
+
+# snapshot.t7 after every epoch and on SIGTERM/SIGUSR1 mid-epoch, --resume continues from it
+snap_state = dict(('Teacher%d' % (i + 1), net) for i, net in enumerate(nets))
+if args.vmap or args.packed:
+    snap_state = dict(('Teacher%d' % (i + 1), teachers.member(i)) for i in range(len(nets)))
+snap = snapshot.Snapshot(path, snap_state, optimizer, order=train_order, scope=globals(), names=('best_ACC',))
+start_epoch = 0
+if args.resume:
+    start_epoch = snap.load(start_epoch)
+
+def forward(inputs):
+    """The logits of the teachers, one vectorized forward with --vmap/--packed."""
+    if args.vmap or args.packed:
+        return teachers(inputs)[-1].unbind(0)
+    return [net(inputs)[-1] for net in nets]
 
 # Training
 def train(epoch):
     print('\nEpoch: %d' % epoch)
+    snap.begin(epoch)
     if args.number_teacher == 2:
         net1.train()
         net2.train()
@@ -276,6 +276,11 @@ def train(epoch):
         conf_mat8 = np.zeros((NUM_CLASSES, NUM_CLASSES))
     else:
         raise Exception('Invalid ...')
+    for net in nets:
+        net.set_input_norm(train_input_norm)
+    if args.vmap or args.packed:
+        teachers.train()
+        teachers.set_input_norm(train_input_norm)
     train_loss = 0
 
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
@@ -297,8 +302,7 @@ def train(epoch):
         inputs, targets = Variable(inputs), Variable(targets)
         
         if args.number_teacher == 2:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
+            outputs1, outputs2 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             mimic = (outputs1+outputs2)/2
@@ -307,9 +311,7 @@ def train(epoch):
             conf_mat1, acc1, mAP1, F1_score1 = ACC_evaluation(conf_mat1, outputs1, targets, NUM_CLASSES)
             conf_mat2, acc2, mAP2, F1_score2 = ACC_evaluation(conf_mat2, outputs2, targets, NUM_CLASSES)
         elif args.number_teacher == 3:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
-            _, _, _, _, outputs3 = net3(inputs)
+            outputs1, outputs2, outputs3 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             loss3 = criterion(outputs3, targets)
@@ -320,10 +322,7 @@ def train(epoch):
             conf_mat2, acc2, mAP2, F1_score2 = ACC_evaluation(conf_mat2, outputs2, targets, NUM_CLASSES)
             conf_mat3, acc3, mAP3, F1_score3 = ACC_evaluation(conf_mat3, outputs3, targets, NUM_CLASSES)
         elif args.number_teacher == 4:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
-            _, _, _, _, outputs3 = net3(inputs)
-            _, _, _, _, outputs4 = net4(inputs)
+            outputs1, outputs2, outputs3, outputs4 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             loss3 = criterion(outputs3, targets)
@@ -336,11 +335,7 @@ def train(epoch):
             conf_mat3, acc3, mAP3, F1_score3 = ACC_evaluation(conf_mat3, outputs3, targets, NUM_CLASSES)
             conf_mat4, acc4, mAP4, F1_score4 = ACC_evaluation(conf_mat4, outputs4, targets, NUM_CLASSES)
         elif args.number_teacher == 5:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
-            _, _, _, _, outputs3 = net3(inputs)
-            _, _, _, _, outputs4 = net4(inputs)
-            _, _, _, _, outputs5 = net5(inputs)
+            outputs1, outputs2, outputs3, outputs4, outputs5 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             loss3 = criterion(outputs3, targets)
@@ -355,12 +350,7 @@ def train(epoch):
             conf_mat4, acc4, mAP4, F1_score4 = ACC_evaluation(conf_mat4, outputs4, targets, NUM_CLASSES)
             conf_mat5, acc5, mAP5, F1_score5 = ACC_evaluation(conf_mat5, outputs5, targets, NUM_CLASSES)
         elif args.number_teacher == 6:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
-            _, _, _, _, outputs3 = net3(inputs)
-            _, _, _, _, outputs4 = net4(inputs)
-            _, _, _, _, outputs5 = net5(inputs)
-            _, _, _, _, outputs6 = net6(inputs)
+            outputs1, outputs2, outputs3, outputs4, outputs5, outputs6 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             loss3 = criterion(outputs3, targets)
@@ -377,13 +367,7 @@ def train(epoch):
             conf_mat5, acc5, mAP5, F1_score5 = ACC_evaluation(conf_mat5, outputs5, targets, NUM_CLASSES)
             conf_mat6, acc6, mAP6, F1_score6 = ACC_evaluation(conf_mat6, outputs6, targets, NUM_CLASSES)
         elif args.number_teacher == 7:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
-            _, _, _, _, outputs3 = net3(inputs)
-            _, _, _, _, outputs4 = net4(inputs)
-            _, _, _, _, outputs5 = net5(inputs)
-            _, _, _, _, outputs6 = net6(inputs)
-            _, _, _, _, outputs7 = net7(inputs)
+            outputs1, outputs2, outputs3, outputs4, outputs5, outputs6, outputs7 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             loss3 = criterion(outputs3, targets)
@@ -402,14 +386,7 @@ def train(epoch):
             conf_mat6, acc6, mAP6, F1_score6 = ACC_evaluation(conf_mat6, outputs6, targets, NUM_CLASSES)
             conf_mat7, acc7, mAP7, F1_score7 = ACC_evaluation(conf_mat7, outputs7, targets, NUM_CLASSES)
         elif args.number_teacher == 8:
-            _, _, _, _, outputs1 = net1(inputs)
-            _, _, _, _, outputs2 = net2(inputs)
-            _, _, _, _, outputs3 = net3(inputs)
-            _, _, _, _, outputs4 = net4(inputs)
-            _, _, _, _, outputs5 = net5(inputs)
-            _, _, _, _, outputs6 = net6(inputs)
-            _, _, _, _, outputs7 = net7(inputs)
-            _, _, _, _, outputs8 = net8(inputs)
+            outputs1, outputs2, outputs3, outputs4, outputs5, outputs6, outputs7, outputs8 = forward(inputs)
             loss1 = criterion(outputs1, targets)
             loss2 = criterion(outputs2, targets)
             loss3 = criterion(outputs3, targets)
@@ -435,10 +412,17 @@ def train(epoch):
         loss.backward()
         utils.clip_gradient(optimizer, 0.1)
         optimizer.step()
+        snap.step(len(targets))
         train_loss += loss.item()
         
         conf_mat, acc, mAP, F1_score = ACC_evaluation(conf_mat, mimic, targets, NUM_CLASSES)
     
+    if args.prefetch:
+        print(trainloader.report())
+        trainloader.reset_stats()
+    if args.vmap or args.packed:
+        # the teachers receive the trained weights the epoch loop saves
+        teachers.unstack(nets)
     if args.number_teacher == 2:
         return train_loss/(batch_idx+1), 100.*acc1, 100.*acc2, 100.*acc, 100.* mAP, 100 * F1_score
     elif args.number_teacher == 3:
@@ -536,6 +520,11 @@ def test(epoch):
         conf_mat8 = np.zeros((NUM_CLASSES, NUM_CLASSES))
     else:
         raise Exception('Invalid ...')
+    for net in nets:
+        net.set_input_norm(test_input_norm)
+    if args.vmap or args.packed:
+        teachers.eval()
+        teachers.set_input_norm(test_input_norm)
     
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
     
@@ -543,6 +532,8 @@ def test(epoch):
 
     for batch_idx, (inputs, targets) in enumerate(PrivateTestloader):
         t = time.time()
+        if args.batch_tencrop:
+            inputs = batch_tencrop(inputs.cuda(non_blocking=True))
         test_bs, ncrops, c, h, w = np.shape(inputs)
         inputs = inputs.view(-1, c, h, w)
         if use_cuda:
@@ -551,17 +542,14 @@ def test(epoch):
         
         with torch.no_grad():
             if args.number_teacher == 2:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
+                outputs1, outputs2 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 mimic = (outputs1+outputs2)/2
                 conf_mat1, acc1, mAP1, F1_score1 = ACC_evaluation(conf_mat1, outputs1, targets, NUM_CLASSES)
                 conf_mat2, acc2, mAP2, F1_score2 = ACC_evaluation(conf_mat2, outputs2, targets, NUM_CLASSES)
             elif args.number_teacher == 3:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
-                _, _, _, _, outputs3 = net3(inputs)
+                outputs1, outputs2, outputs3 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 outputs3 = outputs3.view(test_bs, ncrops, -1).mean(1)
@@ -570,10 +558,7 @@ def test(epoch):
                 conf_mat2, acc2, mAP2, F1_score2 = ACC_evaluation(conf_mat2, outputs2, targets, NUM_CLASSES)
                 conf_mat3, acc3, mAP3, F1_score3 = ACC_evaluation(conf_mat3, outputs3, targets, NUM_CLASSES)
             elif args.number_teacher == 4:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
-                _, _, _, _, outputs3 = net3(inputs)
-                _, _, _, _, outputs4 = net4(inputs)
+                outputs1, outputs2, outputs3, outputs4 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 outputs3 = outputs3.view(test_bs, ncrops, -1).mean(1)
@@ -584,11 +569,7 @@ def test(epoch):
                 conf_mat3, acc3, mAP3, F1_score3 = ACC_evaluation(conf_mat3, outputs3, targets, NUM_CLASSES)
                 conf_mat4, acc4, mAP4, F1_score4 = ACC_evaluation(conf_mat4, outputs4, targets, NUM_CLASSES)
             elif args.number_teacher == 5:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
-                _, _, _, _, outputs3 = net3(inputs)
-                _, _, _, _, outputs4 = net4(inputs)
-                _, _, _, _, outputs5 = net5(inputs)
+                outputs1, outputs2, outputs3, outputs4, outputs5 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 outputs3 = outputs3.view(test_bs, ncrops, -1).mean(1)
@@ -601,12 +582,7 @@ def test(epoch):
                 conf_mat4, acc4, mAP4, F1_score4 = ACC_evaluation(conf_mat4, outputs4, targets, NUM_CLASSES)
                 conf_mat5, acc5, mAP5, F1_score5 = ACC_evaluation(conf_mat5, outputs5, targets, NUM_CLASSES)
             elif args.number_teacher == 6:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
-                _, _, _, _, outputs3 = net3(inputs)
-                _, _, _, _, outputs4 = net4(inputs)
-                _, _, _, _, outputs5 = net5(inputs)
-                _, _, _, _, outputs6 = net6(inputs)
+                outputs1, outputs2, outputs3, outputs4, outputs5, outputs6 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 outputs3 = outputs3.view(test_bs, ncrops, -1).mean(1)
@@ -621,13 +597,7 @@ def test(epoch):
                 conf_mat5, acc5, mAP5, F1_score5 = ACC_evaluation(conf_mat5, outputs5, targets, NUM_CLASSES)
                 conf_mat6, acc6, mAP6, F1_score6 = ACC_evaluation(conf_mat6, outputs6, targets, NUM_CLASSES)
             elif args.number_teacher == 7:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
-                _, _, _, _, outputs3 = net3(inputs)
-                _, _, _, _, outputs4 = net4(inputs)
-                _, _, _, _, outputs5 = net5(inputs)
-                _, _, _, _, outputs6 = net6(inputs)
-                _, _, _, _, outputs7 = net7(inputs)
+                outputs1, outputs2, outputs3, outputs4, outputs5, outputs6, outputs7 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 outputs3 = outputs3.view(test_bs, ncrops, -1).mean(1)
@@ -644,14 +614,7 @@ def test(epoch):
                 conf_mat6, acc6, mAP6, F1_score6 = ACC_evaluation(conf_mat6, outputs6, targets, NUM_CLASSES)
                 conf_mat7, acc7, mAP7, F1_score7 = ACC_evaluation(conf_mat7, outputs7, targets, NUM_CLASSES)
             elif args.number_teacher == 8:
-                _, _, _, _, outputs1 = net1(inputs)
-                _, _, _, _, outputs2 = net2(inputs)
-                _, _, _, _, outputs3 = net3(inputs)
-                _, _, _, _, outputs4 = net4(inputs)
-                _, _, _, _, outputs5 = net5(inputs)
-                _, _, _, _, outputs6 = net6(inputs)
-                _, _, _, _, outputs7 = net7(inputs)
-                _, _, _, _, outputs8 = net8(inputs)
+                outputs1, outputs2, outputs3, outputs4, outputs5, outputs6, outputs7, outputs8 = forward(inputs)
                 outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
                 outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1)
                 outputs3 = outputs3.view(test_bs, ncrops, -1).mean(1)
@@ -693,7 +656,7 @@ def test(epoch):
     else:
         raise Exception('Invalid ...')
 
-for epoch in range(0, total_epoch):
+for epoch in range(start_epoch, total_epoch):
     
     if args.number_teacher == 2:
         train_loss, train_acc1, train_acc2, train_avgACC, train_avgMAP, train_avgF1 = train(epoch)
@@ -1012,6 +975,7 @@ for epoch in range(0, total_epoch):
     
     else:
         raise Exception('Invalid ...')
+    snap.end_epoch(epoch)
 
 print("best_PrivateTest_avgACC: %0.3f" % best_ACC)
 writer.close()
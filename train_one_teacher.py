@@ -13,11 +13,12 @@ import time
 import argparse
 import utils
 import losses
+import snapshot
 from utils import load_pretrained_model
-from datasets.RAF import RAF_multi_teacher
-from datasets.PET import PET_multi_teacher
-from datasets.colorferet import colorferet_multi_teacher
-from datasets.FairFace import FairFace_multi_teacher
+from datasets import store, stats
+from datasets.generic import StoreDataset
+from datasets import augment
+from datasets import loaders
 from torch.autograd import Variable
 from network.teacherNet import Teacher
 from tensorboardX import SummaryWriter
@@ -31,6 +32,15 @@ parser.add_argument('--train_bs', default=32, type=int, help='Batch size')
 parser.add_argument('--test_bs', default=8, type=int, help='Batch size')
 parser.add_argument('--lr', default=0.01, type=float, help='learning rate')
 parser.add_argument('--augmentation', default=False, type=int, help='use mixup and cutout')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
+parser.add_argument('--prefetch', type=int, default=0, help='batches staged ahead in pinned buffers, 0 disables the prefetcher')
+parser.add_argument('--shm', type=int, default=0, help='share one copy of the dataset in /dev/shm between concurrent runs')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
+parser.add_argument('--uint8_input', type=int, default=0, help='ship uint8 crops and normalize them inside the first convolution')
+parser.add_argument('--resume', type=int, default=0, help='continue from the snapshot.t7 of an interrupted run')
+parser.add_argument('--progressive', type=float, default=0, help='start training at this fraction of the input size and ramp it up to the full size, 0 disables')
+parser.add_argument('--progressive_end', type=float, default=0.5, help='fraction of the epochs after which the input size is the full one')
+parser.add_argument('--progressive_bs', type=int, default=4, help='largest multiple of --train_bs at low resolution, the learning rate scales with the batch size')
 args = parser.parse_args()
 
 use_cuda = torch.cuda.is_available()
@@ -39,12 +49,7 @@ best_acc = 0
 learning_rate_decay_start = 80  # 50
 learning_rate_decay_every = 5 # 5
 learning_rate_decay_rate = 0.9 # 0.9
-if args.data_name == 'colorferet':
-    NUM_CLASSES = 994
-elif args.data_name == 'PET':
-    NUM_CLASSES = 37
-else:
-    NUM_CLASSES = 7
+NUM_CLASSES = store.num_classes(args.data_name)
 
 total_epoch = args.epochs
 
@@ -57,86 +62,64 @@ print ('The training mode is:                            '+ str(args.model))
 print ('Whether to use data enhancement:                 '+ str(args.augmentation))
 print('==> Preparing data..')
 
-if args.data_name == 'RAF':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.5884594, 0.45767313, 0.40865755), 
-                             (0.25717735, 0.23602168, 0.23505741)),
-    ]) 
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.589667, 0.45717254, 0.40727714], std=[0.25235596, 0.23242524, 0.23155019])
-                            (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'PET':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.47950855, 0.4454716, 0.3953508), 
-                      (0.26221144, 0.25676072, 0.2640482)),])
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.486185, 0.45276144, 0.39575183], std=[0.2640792, 0.25989106, 0.26799843])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'colorferet':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.50150657, 0.4387828, 0.37715995), 
-                             (0.22249317, 0.24526535, 0.25831717)),
-    ]) 
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49930117, 0.43744352, 0.37612754], std=[0.22151423, 0.24302939, 0.2520711])
-                            (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'FairFace':
+transform_train = transforms.Compose([
+    transforms.RandomCrop(92),
+    transforms.RandomHorizontalFlip(),
+    transforms.ToTensor(),
+    transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher')),
+])
+test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher_test'))
+transform_test = transforms.Compose([
+    transforms.TenCrop(92),
+    transforms.Lambda(lambda crops: torch.stack([test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),])
+
+if args.uint8_input:
+    # the loaders ship uint8 crops, the network folds the normalization into conv1
     transform_train = transforms.Compose([
         transforms.RandomCrop(92),
         transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.4911152, 0.36028033, 0.30489963), 
-                             (0.25160596, 0.21829675, 0.21198231)),
-    ]) 
+        transforms.PILToTensor(),
+    ])
     transform_test = transforms.Compose([
         transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49167913, 0.36098105, 0.30529523], std=[0.24649838, 0.21503104, 0.20875944])
-                            (transforms.ToTensor()(crop)) for crop in crops])),])
-else:
-    raise Exception('Invalid ...')
+        transforms.Lambda(lambda crops: torch.stack([transforms.PILToTensor()(crop) for crop in crops])),])
 
-if args.data_name == 'RAF':
-    trainset = RAF_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = RAF_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'PET':
-    trainset = PET_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = PET_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'colorferet':
-    trainset = colorferet_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = colorferet_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'FairFace':
-    trainset = FairFace_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = FairFace_multi_teacher(split = 'PrivateTest', transform=transform_test)
-else:
-    raise Exception('Invalid dataset name...')
-trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, shuffle=True, num_workers=1)
-PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=1)
+if args.batch_tencrop:
+    # the loader ships raw uint8 pixels, test() crops and normalizes the whole batch
+    batch_tencrop = augment.TenCropNormalize(92, test_Normalize.mean, test_Normalize.std)
+    transform_test = None
+
+trainset = StoreDataset(args.data_name, split = 'Training', transform=transform_train, shared=args.shm)
+PrivateTestset = StoreDataset(args.data_name, split = 'PrivateTest', transform=transform_test, shared=args.shm)
+# training order, loaders and --eval_cache/--prefetch of the data flags, see datasets.loaders
+trainset, trainloader, train_order, PrivateTestloader = loaders.build_loaders(args, trainset, PrivateTestset, 92, test_Normalize.mean, test_Normalize.std)
+resizing = loaders.progressive_resizing(args, 92)
 
 net = Teacher(num_classes=NUM_CLASSES).cuda()
+# (mean, std) folded into conv1 with --uint8_input, None where the batches arrive normalized
+train_input_norm = stats.norm_stats(args.data_name, 'teacher') if args.uint8_input else None
+test_input_norm = test_Normalize.mean, test_Normalize.std
+if not args.uint8_input or args.batch_tencrop or args.eval_cache:
+    test_input_norm = None
 
 criterion = nn.CrossEntropyLoss().cuda()
 optimizer = optim.SGD(net.parameters(), lr=args.lr, momentum=0.9, weight_decay=5e-4)
 
+# snapshot.t7 after every epoch and on SIGTERM/SIGUSR1 mid-epoch, --resume continues from it
+snap = snapshot.Snapshot(path, {'tnet': net}, optimizer, order=train_order, scope=globals(), names=('best_acc', 'best_mAP', 'best_F1'))
+start_epoch = 0
+if args.resume:
+    start_epoch = snap.load(start_epoch)
+
 # Training
 def train(epoch):
     print('\nEpoch: %d' % epoch)
+    snap.begin(epoch)
+    if args.progressive:
+        input_size = resizing.begin(epoch, trainloader)
+        print(resizing.report(epoch))
     net.train()
+    net.set_input_norm(train_input_norm)
     train_loss = 0
 
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
@@ -150,11 +133,17 @@ def train(epoch):
         utils.set_lr(optimizer, current_lr)  # set the decayed rate
     else:
         current_lr = args.lr
+    if args.progressive:
+        # the learning rate follows the batch size of the epoch
+        current_lr *= resizing.lr_scale(epoch)
+        utils.set_lr(optimizer, current_lr)
     print('learning_rate: %s' % str(current_lr))
 
     for batch_idx, (inputs, targets) in enumerate(trainloader):
         if use_cuda:
                 inputs, targets = inputs.cuda(), targets.cuda()
+        if args.progressive:
+            inputs = resizing.resize(inputs, input_size)
         optimizer.zero_grad()
         
         if args.augmentation:
@@ -173,6 +162,7 @@ def train(epoch):
         loss.backward()
         utils.clip_gradient(optimizer, 0.1)
         optimizer.step()
+        snap.step(len(targets))
         train_loss += loss.item()
         
         if args.augmentation:
@@ -205,14 +195,20 @@ def train(epoch):
                 recall = np.array(recall)
                 f1 = 2 * precision*recall/(precision+recall + 1e-10)
                 F1_score = f1.mean()
+    if args.prefetch:
+        print(trainloader.report())
+        trainloader.reset_stats()
     return train_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
 def test(epoch):
     net.eval()
+    net.set_input_norm(test_input_norm)
     PrivateTest_loss = 0
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
 
     for batch_idx, (inputs, targets) in enumerate(PrivateTestloader):
+        if args.batch_tencrop:
+            inputs = batch_tencrop(inputs.cuda(non_blocking=True))
         test_bs, ncrops, c, h, w = np.shape(inputs)
         inputs = inputs.view(-1, c, h, w)
         if use_cuda:
@@ -237,7 +233,7 @@ def test(epoch):
     return PrivateTest_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
 
-for epoch in range(0, total_epoch):
+for epoch in range(start_epoch, total_epoch):
 	# train one epoch
 	train_loss, train_acc, train_mAP, train_F1 = train(epoch)
 	# evaluate on testing set
@@ -270,6 +266,7 @@ for epoch in range(0, total_epoch):
 		if not os.path.isdir(path):
 				os.mkdir(path)
 		torch.save(state, os.path.join(path,'Best_Teacher_model.t7'))
+	snap.end_epoch(epoch)
 
 print("best_PrivateTest_acc: %0.3f" % best_acc)
 print("best_PrivateTest_mAP: %0.3f" % best_mAP)
@@ -18,10 +18,11 @@ import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
 import torchvision.transforms as transforms
 from torch.autograd import Variable
-from datasets.RAF import RAF
-from datasets.PET import PET
-from datasets.colorferet import colorferet
-from datasets.FairFace import FairFace
+from datasets import store, stats
+from datasets.generic import DualViewDataset
+from datasets import augment
+from datasets import loaders
+from datasets import teacher_cache
 from network.teacherNet import Teacher
 from network.studentNet import CNN_RIS
 
@@ -29,6 +30,7 @@ import utils
 from utils import load_pretrained_model, count_parameters_in_MB, ACC_evaluation
 
 import losses
+import snapshot
 from tensorboardX import SummaryWriter
 
 parser = argparse.ArgumentParser(description='train kd')
@@ -52,6 +54,26 @@ parser.add_argument('--num_workers', type=int, default=4, help='num_workers')
 parser.add_argument('--best_teacher', type=int, default=1, help='Best teacher')
 parser.add_argument('--seed', type=int, default=2, help='random seed')
 parser.add_argument('--noise', type=str, default='None', help='GaussianBlur,AverageBlur,MedianBlur,BilateralFilter,Salt-and-pepper') 
+parser.add_argument('--severity', type=int, default=3, help='severity of the test-set noise, 1-5')
+parser.add_argument('--batch_aug', type=int, default=0, help='crop/flip/resize/normalize whole batches on the device')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
+parser.add_argument('--stream', type=int, default=0, help='stream the training set in shards of this many images, 0 samples it at random')
+parser.add_argument('--stream_buffer', type=int, default=4096, help='shuffle buffer of the streamed training set')
+parser.add_argument('--prefetch', type=int, default=0, help='batches staged ahead in pinned buffers, 0 disables the prefetcher')
+parser.add_argument('--shm', type=int, default=0, help='share one copy of the dataset in /dev/shm between concurrent runs')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
+parser.add_argument('--balanced', type=int, default=0, help='class-balanced batches drawn from the class index of the store')
+parser.add_argument('--samples_per_class', type=int, default=1, help='images per class of the balanced batches, P x K batches when > 1')
+parser.add_argument('--chunked', type=int, default=0, help='read the compressed chunks of build_store.py --pack in block-shuffled order')
+parser.add_argument('--batched', type=int, default=0, help='fetch whole batches with one gather and augment them in the workers')
+parser.add_argument('--uint8_input', type=int, default=0, help='ship uint8 views and normalize them inside the first convolution')
+parser.add_argument('--resume', type=int, default=0, help='continue from the snapshot.t7 of an interrupted run')
+parser.add_argument('--progressive', type=float, default=0, help='start training at this fraction of the input size and ramp it up to the full size, 0 disables')
+parser.add_argument('--progressive_end', type=float, default=0.5, help='fraction of the epochs after which the input size is the full one')
+parser.add_argument('--progressive_bs', type=int, default=4, help='largest multiple of --train_bs at low resolution, the learning rate scales with the batch size')
+parser.add_argument('--repeats', type=int, default=1, help='augmented views of every loaded image in the same batch (repeated augmentation), 1 disables')
+parser.add_argument('--teacher_cache', type=int, default=0, help='recorded crops/flips per training image whose teacher logits are computed once and read back, 0 runs the teachers every step')
+parser.add_argument('--teacher_cache_topk', type=int, default=0, help='keep only the top-k teacher logits in the cache, 0 keeps all classes')
 
 args, unparsed = parser.parse_known_args()
 
@@ -73,12 +95,7 @@ best_F1 = 0
 learning_rate_decay_start = 80  # 50
 learning_rate_decay_every = 5 # 5
 learning_rate_decay_rate = 0.9 # 0.9
-if args.data_name == 'colorferet':
-    NUM_CLASSES = 994
-elif args.data_name == 'PET':
-    NUM_CLASSES = 37
-else:
-    NUM_CLASSES = 7
+NUM_CLASSES = store.num_classes(args.data_name)
 
 if args.s_model == 'CNNRIS':
 	snet = CNN_RIS(num_classes=NUM_CLASSES).cuda()
@@ -90,8 +107,9 @@ if args.t_model == 'Teacher':
 else:
 	raise Exception('Invalid name of the teacher network...')
 
-tcheckpoint = torch.load(os.path.join('results/' + args.data_name+ '_MultiTeacher_OurDiversity_'+ str(args.direction)+ '_' + str(args.variance), \
-                                      'Best_MultiTeacher_model.t7'))
+tcheckpoint_path = os.path.join('results/' + args.data_name+ '_MultiTeacher_OurDiversity_'+ str(args.direction)+ '_' + str(args.variance), \
+                                'Best_MultiTeacher_model.t7')
+tcheckpoint = torch.load(tcheckpoint_path)
 if args.best_teacher == 1:
     load_pretrained_model(tnet, tcheckpoint['Teacher1'])
 elif args.best_teacher == 2:    
@@ -133,40 +151,9 @@ transform_train = transforms.Compose([
     transforms.RandomHorizontalFlip(),
 ])
 
-if args.data_name == 'RAF':
-	transforms_teacher_Normalize = transforms.Normalize((0.5884594, 0.45767313, 0.40865755), 
-                            (0.25717735, 0.23602168, 0.23505741))
-	transforms_student_Normalize =  transforms.Normalize((0.58846486, 0.45766878, 0.40865615), 
-                            (0.2516557, 0.23020789, 0.22939532))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.59003043, 0.4573948, 0.40749523], std=[0.2465465, 0.22635746, 0.22564183])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'PET':
-	transforms_teacher_Normalize = transforms.Normalize((0.47950855, 0.4454716, 0.3953508), 
-                            (0.26221144, 0.25676072, 0.2640482))
-	transforms_student_Normalize =  transforms.Normalize((0.4794851, 0.44543326, 0.39531776), 
-                            (0.24786888, 0.24236518, 0.24950708))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.4862494, 0.45275217, 0.39576027], std=[0.24864933, 0.2446337, 0.2527274])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'colorferet':
-	transforms_teacher_Normalize = transforms.Normalize((0.50150657, 0.4387828, 0.37715995), 
-                            (0.22249317, 0.24526535, 0.25831717))
-	transforms_student_Normalize =  transforms.Normalize((0.50166893, 0.43892872, 0.37727863), 
-                            (0.21588857, 0.23875234, 0.25212118))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.4992823, 0.4371743, 0.37574747], std=[0.21377444, 0.23534843, 0.24466512])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'FairFace':
-	transforms_teacher_Normalize = transforms.Normalize((0.4911152, 0.36028033, 0.30489963), 
-                            (0.25160596, 0.21829675, 0.21198231))
-	transforms_student_Normalize =  transforms.Normalize((0.4911364, 0.3602937, 0.3049148), 
-                            (0.24722975, 0.21383813, 0.20771481))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49202734, 0.36110377, 0.30535242], std=[0.24179104, 0.21022305, 0.20413795])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-else:
-    raise Exception('Invalid dataset name...')
+transforms_teacher_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher'))
+transforms_student_Normalize =  transforms.Normalize(*stats.norm_stats(args.data_name, 'student'))
+transforms_test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'student_test'))
 
 teacher_norm = transforms.Compose([
 transforms.ToTensor(),
@@ -181,30 +168,77 @@ transforms_student_Normalize,
 
 transform_test = transforms.Compose([
 transforms.TenCrop(44),
-transforms_test_Normalize,
+transforms.Lambda(lambda crops: torch.stack([transforms_test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),
 ])
 
-if args.data_name == 'RAF':
-	trainset = RAF(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = RAF(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'PET':
-	trainset = PET(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = PET(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'colorferet':
-	trainset = colorferet(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = colorferet(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'FairFace':
-	trainset = FairFace(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = FairFace(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-else:
-	raise Exception('Invalid dataset name...')
-
-trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, shuffle=True, num_workers=args.num_workers)
-PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=args.num_workers)
+if args.uint8_input:
+	# the loaders ship uint8 views, the networks fold the normalization into conv1
+	teacher_norm = transforms.PILToTensor()
+	student_norm = transforms.Compose([transforms.Resize(44), transforms.PILToTensor()])
+	transform_test = transforms.Compose([
+	transforms.TenCrop(44),
+	transforms.Lambda(lambda crops: torch.stack([transforms.PILToTensor()(crop) for crop in crops])),
+	])
+
+if args.batch_aug:
+	# the loader ships raw uint8 pixels, train() augments and normalizes the whole batch
+	batch_augment = augment.TeacherStudentAugment(transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+	                                              transforms_student_Normalize.mean, transforms_student_Normalize.std, S_size=44)
+	transform_train = None
+
+if args.batch_tencrop:
+	# the loader ships raw uint8 pixels, test() resizes, crops and normalizes the whole batch
+	batch_tencrop = augment.TenCropNormalize(44, transforms_test_Normalize.mean, transforms_test_Normalize.std,
+	                                         resize=48)
+	transform_test = None
+
+# --batched: one __getitems__ call per batch instead of one __getitem__ per image
+batch_transform_train = batch_transform_test = None
+if args.batched and not args.uint8_input:
+    # vectorized crop/flip/normalize of the whole batch in the workers instead of the PIL transforms
+    if transform_train is not None:
+        batch_transform_train = augment.TeacherStudentAugment(transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+                                                              transforms_student_Normalize.mean, transforms_student_Normalize.std, S_size=44)
+    if transform_test is not None:
+        batch_transform_test = augment.TenCropNormalize(44, transforms_test_Normalize.mean, transforms_test_Normalize.std, resize=48)
+
+teacher_logits = None
+if args.teacher_cache:
+    # the teachers run once over a fixed pool of crops/flips of every training image, train() reads their logits back
+    if args.batch_aug or args.stream:
+        raise Exception('--teacher_cache replays recorded crops and cannot be combined with --batch_aug or --stream...')
+    teacher_logits = teacher_cache.TeacherCache(teacher_cache.build(args.data_name, (tnet,), tcheckpoint_path, ('Teacher%d' % args.best_teacher,),
+                                                                    transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+                                                                    pool=args.teacher_cache, topk=args.teacher_cache_topk))
+trainset = DualViewDataset(args.data_name, split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise, shared=args.shm, chunked=args.chunked, batched=args.batched, batch_transform=batch_transform_train, repeats=args.repeats, teacher_cache=teacher_logits)
+PrivateTestset = DualViewDataset(args.data_name, split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise, severity=args.severity, shared=args.shm, chunked=args.chunked, batched=args.batched, batch_transform=batch_transform_test)
+
+# training order, loaders and --eval_cache/--prefetch of the data flags, see datasets.loaders
+trainset, trainloader, train_order, PrivateTestloader = loaders.build_loaders(args, trainset, PrivateTestset, 44, transforms_test_Normalize.mean, transforms_test_Normalize.std, S_size=44, seed=args.seed)
+resizing = loaders.progressive_resizing(args, 44, first_epoch=1)
+# (mean, std) folded into conv1 with --uint8_input, None where the batches arrive normalized
+train_input_norm = args.uint8_input and not args.batch_aug
+tnet.set_input_norm((transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std) if train_input_norm else None)
+student_input_norm = (transforms_student_Normalize.mean, transforms_student_Normalize.std) if train_input_norm else None
+test_input_norm = transforms_test_Normalize.mean, transforms_test_Normalize.std
+if not args.uint8_input or args.batch_tencrop or args.eval_cache:
+    test_input_norm = None
+# snapshot.t7 after every epoch and on SIGTERM/SIGUSR1 mid-epoch, --resume continues from it
+snap = snapshot.Snapshot(path, {'snet': snet}, optimizer, order=train_order, scope=globals(), names=('best_acc', 'best_mAP', 'best_F1'))
+start_epoch = 1
+if args.resume:
+    start_epoch = snap.load(start_epoch)
 
 def train(epoch):
     print('\nEpoch: %d' % epoch)
+    if args.stream:
+        trainset.set_epoch(epoch)
+    snap.begin(epoch)
+    if args.progressive:
+        input_size = resizing.begin(epoch, trainloader)
+        print(resizing.report(epoch))
     snet.train()
+    snet.set_input_norm(student_input_norm)
     train_loss = 0
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
     if epoch > learning_rate_decay_start and learning_rate_decay_start >= 0:
@@ -214,42 +248,68 @@ def train(epoch):
         utils.set_lr(optimizer, current_lr)  # set the decayed rate
     else:
         current_lr = args.lr
+    if args.progressive:
+        # the learning rate follows the batch size of the epoch
+        current_lr *= resizing.lr_scale(epoch)
+        utils.set_lr(optimizer, current_lr)
     print('learning_rate: %s' % str(current_lr))
     
-    for batch_idx, (img_teacher, img_student, target) in enumerate(trainloader):
+    for batch_idx, batch in enumerate(trainloader):
+        if args.batch_aug:
+            img, target = batch
+            if args.cuda:
+                img = img.cuda(non_blocking=True)
+            img_teacher, img_student = batch_augment(img)
+        else:
+            img_teacher, img_student, target = batch
         if args.cuda:
             img_teacher = img_teacher.cuda()
             img_student = img_student.cuda()
             target = target.cuda()
+        if args.progressive:
+            img_student = resizing.resize(img_student, input_size)
 
         optimizer.zero_grad()
         img_teacher, img_student, target = Variable(img_teacher), Variable(img_student), Variable(target)
         
         rb1_s1, rb2_s1, rb3_s1, mimic_s1, out_s1 = snet(img_student)
         
-        with torch.no_grad():
-            rb1_t1, rb2_t1, rb3_t1, mimic_t1, out_t1 = tnet(img_teacher)
+        if args.teacher_cache:
+            # img_teacher holds the cached logits of the replayed crop, one row per teacher
+            out_t1 = img_teacher[:, 0].float()
+        else:
+            with torch.no_grad():
+                rb1_t1, rb2_t1, rb3_t1, mimic_t1, out_t1 = tnet(img_teacher)
         cls_loss = Cls_crit(out_s1, target)
         loss = 0.2 * cls_loss + 0.8 * utils.KL_divergence(temperature = 20).cuda()(out_t1,out_s1)
         loss.backward()
         
         utils.clip_gradient(optimizer, 0.1)
         optimizer.step()
+        snap.step(len(target))
         train_loss += loss.item()
         
         conf_mat, acc, mAP, F1_score = ACC_evaluation(conf_mat, out_s1, target, NUM_CLASSES)
         
+    if args.prefetch:
+        print(trainloader.report())
+        trainloader.reset_stats()
     return train_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
 def test(epoch):
 	
 	snet.eval()
+	snet.set_input_norm(test_input_norm)
 	PrivateTest_loss = 0
 	t_prediction = 0
 	conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
 	
 	for batch_idx, (img, target) in enumerate(PrivateTestloader):
 		t = time.time()
+		if args.batch_tencrop:
+			if args.cuda:
+				img = img.cuda(non_blocking=True)
+			img = batch_tencrop(img)
 		test_bs, ncrops, c, h, w = np.shape(img)
 		img = img.view(-1, c, h, w)
 		if args.cuda:
@@ -283,7 +343,7 @@ def test(epoch):
   
 	return PrivateTest_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
-for epoch in range(1, args.epochs+1):
+for epoch in range(start_epoch, args.epochs+1):
 	# train one epoch
 	train_loss, train_acc, train_mAP, train_F1 = train(epoch)
 	# evaluate on testing set
@@ -315,6 +375,7 @@ for epoch in range(1, args.epochs+1):
 			'test_epoch': epoch,
 		} 
 		torch.save(state, os.path.join(path,'Student_Test_model.t7'))
+	snap.end_epoch(epoch)
 
 print("best_PrivateTest_acc: %0.3f" % best_acc)
 print("best_PrivateTest_mAP: %0.3f" % best_mAP)
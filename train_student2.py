@@ -18,16 +18,19 @@ import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
 import torchvision.transforms as transforms
 from torch.autograd import Variable
-from datasets.RAF import RAF
-from datasets.PET import PET
-from datasets.colorferet import colorferet
-from datasets.FairFace import FairFace
+from datasets import store, stats
+from datasets.generic import DualViewDataset
+from datasets import augment
+from datasets import loaders
+from datasets import teacher_cache
 from network.teacherNet import Teacher
+from network.ensemble import TeacherEnsemble, PackedTeacher
 from network.studentNet import CNN_RIS
 import utils
 from utils import load_pretrained_model, count_parameters_in_MB
 
 import losses
+import snapshot
 from tensorboardX import SummaryWriter
 
 parser = argparse.ArgumentParser(description='train kd')
@@ -51,6 +54,32 @@ parser.add_argument('--variance', default=0, type=float, help='variance')
 parser.add_argument('--num_workers', type=int, default=4, help='num_workers')
 parser.add_argument('--seed', type=int, default=2, help='random seed')
 parser.add_argument('--noise', type=str, default='None', help='GaussianBlur,AverageBlur,MedianBlur,BilateralFilter,Salt-and-pepper') 
+parser.add_argument('--severity', type=int, default=3, help='severity of the test-set noise, 1-5')
+parser.add_argument('--batch_aug', type=int, default=0, help='crop/flip/resize/normalize whole batches on the device')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
+parser.add_argument('--stream', type=int, default=0, help='stream the training set in shards of this many images, 0 samples it at random')
+parser.add_argument('--stream_buffer', type=int, default=4096, help='shuffle buffer of the streamed training set')
+parser.add_argument('--prefetch', type=int, default=0, help='batches staged ahead in pinned buffers, 0 disables the prefetcher')
+parser.add_argument('--shm', type=int, default=0, help='share one copy of the dataset in /dev/shm between concurrent runs')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
+parser.add_argument('--balanced', type=int, default=0, help='class-balanced batches drawn from the class index of the store')
+parser.add_argument('--samples_per_class', type=int, default=1, help='images per class of the balanced batches, P x K batches when > 1')
+parser.add_argument('--chunked', type=int, default=0, help='read the compressed chunks of build_store.py --pack in block-shuffled order')
+parser.add_argument('--batched', type=int, default=0, help='fetch whole batches with one gather and augment them in the workers')
+parser.add_argument('--uint8_input', type=int, default=0, help='ship uint8 views and normalize them inside the first convolution')
+parser.add_argument('--resume', type=int, default=0, help='continue from the snapshot.t7 of an interrupted run')
+parser.add_argument('--prune', type=float, default=0, help='fraction of the solved training images left out of an epoch, 0 disables pruning')
+parser.add_argument('--prune_margin', type=float, default=0.5, help='teacher-ensemble probability margin of a solved image')
+parser.add_argument('--prune_recheck', type=int, default=5, help='every this many epochs a full pass re-scores all images')
+parser.add_argument('--prune_anneal', type=float, default=0.125, help='final fraction of the epochs trained without pruning')
+parser.add_argument('--progressive', type=float, default=0, help='start training at this fraction of the input size and ramp it up to the full size, 0 disables')
+parser.add_argument('--progressive_end', type=float, default=0.5, help='fraction of the epochs after which the input size is the full one')
+parser.add_argument('--progressive_bs', type=int, default=4, help='largest multiple of --train_bs at low resolution, the learning rate scales with the batch size')
+parser.add_argument('--repeats', type=int, default=1, help='augmented views of every loaded image in the same batch (repeated augmentation), 1 disables')
+parser.add_argument('--teacher_cache', type=int, default=0, help='recorded crops/flips per training image whose teacher logits are computed once and read back, 0 runs the teachers every step')
+parser.add_argument('--teacher_cache_topk', type=int, default=0, help='keep only the top-k teacher logits in the cache, 0 keeps all classes')
+parser.add_argument('--vmap', type=int, default=0, help='stack the four teachers and run them as one vectorized forward')
+parser.add_argument('--packed', type=int, default=0, help='pack the four teachers into one network of grouped convolutions')
 
 args, unparsed = parser.parse_known_args()
 
@@ -72,12 +101,7 @@ best_F1 = 0
 learning_rate_decay_start = 80  # 50
 learning_rate_decay_every = 5 # 5
 learning_rate_decay_rate = 0.9 # 0.9
-if args.data_name == 'colorferet':
-    NUM_CLASSES = 994
-elif args.data_name == 'PET':
-    NUM_CLASSES = 37
-else:
-    NUM_CLASSES = 7
+NUM_CLASSES = store.num_classes(args.data_name)
 
 if args.s_model == 'CNNRIS':
     snet = CNN_RIS(num_classes=NUM_CLASSES)
@@ -92,8 +116,9 @@ if args.t_model == 'Teacher':
 else:
     raise Exception('Invalid name of the teacher network...')
 
-tcheckpoint = torch.load(os.path.join(args.save_root + args.data_name + '_MultiTeacher_OurDiversity_' + \
-                                          str(args.direction)+ '_' + str(args.variance),'Best_MultiTeacher_model.t7'))
+tcheckpoint_path = os.path.join(args.save_root + args.data_name + '_MultiTeacher_OurDiversity_' + \
+                                str(args.direction)+ '_' + str(args.variance),'Best_MultiTeacher_model.t7')
+tcheckpoint = torch.load(tcheckpoint_path)
 load_pretrained_model(tnet1, tcheckpoint['Teacher1'])
 load_pretrained_model(tnet2, tcheckpoint['Teacher2'])
 load_pretrained_model(tnet3, tcheckpoint['Teacher3'])
@@ -141,40 +166,9 @@ transform_train = transforms.Compose([
     transforms.RandomHorizontalFlip(),
 ])
 
-if args.data_name == 'RAF':
-	transforms_teacher_Normalize = transforms.Normalize((0.5884594, 0.45767313, 0.40865755), 
-                            (0.25717735, 0.23602168, 0.23505741))
-	transforms_student_Normalize =  transforms.Normalize((0.58846486, 0.45766878, 0.40865615), 
-                            (0.2516557, 0.23020789, 0.22939532))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.59003043, 0.4573948, 0.40749523], std=[0.2465465, 0.22635746, 0.22564183])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'PET':
-	transforms_teacher_Normalize = transforms.Normalize((0.47950855, 0.4454716, 0.3953508), 
-                            (0.26221144, 0.25676072, 0.2640482))
-	transforms_student_Normalize =  transforms.Normalize((0.4794851, 0.44543326, 0.39531776), 
-                            (0.24786888, 0.24236518, 0.24950708))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.4862494, 0.45275217, 0.39576027], std=[0.24864933, 0.2446337, 0.2527274])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'colorferet':
-	transforms_teacher_Normalize = transforms.Normalize((0.50150657, 0.4387828, 0.37715995), 
-                            (0.22249317, 0.24526535, 0.25831717))
-	transforms_student_Normalize =  transforms.Normalize((0.50166893, 0.43892872, 0.37727863), 
-                            (0.21588857, 0.23875234, 0.25212118))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.4992823, 0.4371743, 0.37574747], std=[0.21377444, 0.23534843, 0.24466512])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-elif args.data_name == 'FairFace':
-	transforms_teacher_Normalize = transforms.Normalize((0.4911152, 0.36028033, 0.30489963), 
-                            (0.25160596, 0.21829675, 0.21198231))
-	transforms_student_Normalize =  transforms.Normalize((0.4911364, 0.3602937, 0.3049148), 
-                            (0.24722975, 0.21383813, 0.20771481))
-	transforms_test_Normalize = transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49202734, 0.36110377, 0.30535242], std=[0.24179104, 0.21022305, 0.20413795])
-            (transforms.ToTensor()(crop)) for crop in crops]))
-else:
-    raise Exception('Invalid dataset name...')
+transforms_teacher_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher'))
+transforms_student_Normalize =  transforms.Normalize(*stats.norm_stats(args.data_name, 'student'))
+transforms_test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'student_test'))
 
 teacher_norm = transforms.Compose([
 transforms.ToTensor(),
@@ -189,30 +183,92 @@ transforms_student_Normalize,
 
 transform_test = transforms.Compose([
 transforms.TenCrop(44),
-transforms_test_Normalize,
+transforms.Lambda(lambda crops: torch.stack([transforms_test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),
 ])
 
-if args.data_name == 'RAF':
-	trainset = RAF(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = RAF(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'PET':
-	trainset = PET(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = PET(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'colorferet':
-	trainset = colorferet(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = colorferet(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-elif args.data_name == 'FairFace':
-	trainset = FairFace(split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise)
-	PrivateTestset = FairFace(split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise)
-else:
-	raise Exception('Invalid dataset name...')
+if args.uint8_input:
+	# the loaders ship uint8 views, the networks fold the normalization into conv1
+	teacher_norm = transforms.PILToTensor()
+	student_norm = transforms.Compose([transforms.Resize(44), transforms.PILToTensor()])
+	transform_test = transforms.Compose([
+	transforms.TenCrop(44),
+	transforms.Lambda(lambda crops: torch.stack([transforms.PILToTensor()(crop) for crop in crops])),
+	])
+
+if args.batch_aug:
+	# the loader ships raw uint8 pixels, train() augments and normalizes the whole batch
+	batch_augment = augment.TeacherStudentAugment(transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+	                                              transforms_student_Normalize.mean, transforms_student_Normalize.std, S_size=44)
+	transform_train = None
+
+if args.batch_tencrop:
+	# the loader ships raw uint8 pixels, test() resizes, crops and normalizes the whole batch
+	batch_tencrop = augment.TenCropNormalize(44, transforms_test_Normalize.mean, transforms_test_Normalize.std,
+	                                         resize=48)
+	transform_test = None
 
-trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, shuffle=True, num_workers=args.num_workers)
-PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=args.num_workers)
+# --batched: one __getitems__ call per batch instead of one __getitem__ per image
+batch_transform_train = batch_transform_test = None
+if args.batched and not args.uint8_input:
+    # vectorized crop/flip/normalize of the whole batch in the workers instead of the PIL transforms
+    if transform_train is not None:
+        batch_transform_train = augment.TeacherStudentAugment(transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+                                                              transforms_student_Normalize.mean, transforms_student_Normalize.std, S_size=44)
+    if transform_test is not None:
+        batch_transform_test = augment.TenCropNormalize(44, transforms_test_Normalize.mean, transforms_test_Normalize.std, resize=48)
+
+teacher_logits = None
+if args.teacher_cache:
+    # the teachers run once over a fixed pool of crops/flips of every training image, train() reads their logits back
+    if args.batch_aug or args.stream:
+        raise Exception('--teacher_cache replays recorded crops and cannot be combined with --batch_aug or --stream...')
+    teacher_logits = teacher_cache.TeacherCache(teacher_cache.build(args.data_name, (tnet1, tnet2, tnet3, tnet4), tcheckpoint_path, ('Teacher1', 'Teacher2', 'Teacher3', 'Teacher4'),
+                                                                    transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std,
+                                                                    pool=args.teacher_cache, topk=args.teacher_cache_topk))
+trainset = DualViewDataset(args.data_name, split = 'Training', transform=transform_train, student_norm=student_norm, teacher_norm=teacher_norm, noise=args.noise, shared=args.shm, chunked=args.chunked, batched=args.batched, batch_transform=batch_transform_train, repeats=args.repeats, teacher_cache=teacher_logits)
+PrivateTestset = DualViewDataset(args.data_name, split = 'PrivateTest', transform=transform_test, student_norm=None, teacher_norm=None, noise=args.noise, severity=args.severity, shared=args.shm, chunked=args.chunked, batched=args.batched, batch_transform=batch_transform_test)
+
+# training order, loaders and --eval_cache/--prefetch of the data flags, see datasets.loaders
+trainset, trainloader, train_order, PrivateTestloader = loaders.build_loaders(args, trainset, PrivateTestset, 44, transforms_test_Normalize.mean, transforms_test_Normalize.std, S_size=44, seed=args.seed)
+resizing = loaders.progressive_resizing(args, 44, first_epoch=1)
+# (mean, std) folded into conv1 with --uint8_input, None where the batches arrive normalized
+train_input_norm = args.uint8_input and not args.batch_aug
+for net in (tnet1, tnet2, tnet3, tnet4):
+    net.set_input_norm((transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std) if train_input_norm else None)
+if args.vmap or args.packed:
+    # the frozen teachers stacked into one vectorized forward or packed into one network, (4, B, classes) logits
+    if args.teacher_cache:
+        raise Exception('--vmap/--packed run the teachers every step and cannot be combined with --teacher_cache...')
+    tnets = PackedTeacher.from_teachers((tnet1, tnet2, tnet3, tnet4)) if args.packed else TeacherEnsemble((tnet1, tnet2, tnet3, tnet4))
+    tnets.eval()
+    tnets.set_input_norm((transforms_teacher_Normalize.mean, transforms_teacher_Normalize.std) if train_input_norm else None)
+    for param in tnets.parameters():
+        param.requires_grad = False
+    for net in (tnet1, tnet2, tnet3, tnet4):
+        net.cpu()
+student_input_norm = (transforms_student_Normalize.mean, transforms_student_Normalize.std) if train_input_norm else None
+test_input_norm = transforms_test_Normalize.mean, transforms_test_Normalize.std
+if not args.uint8_input or args.batch_tencrop or args.eval_cache:
+    test_input_norm = None
+# snapshot.t7 after every epoch and on SIGTERM/SIGUSR1 mid-epoch, --resume continues from it
+snap_state = {'snet': snet}
+if args.prune:
+    snap_state['train_order'] = train_order
+snap = snapshot.Snapshot(path, snap_state, optimizer, order=train_order, scope=globals(), names=('best_acc', 'best_mAP', 'best_F1'))
+start_epoch = 1
+if args.resume:
+    start_epoch = snap.load(start_epoch)
 
 def train(epoch):
     print('\nEpoch: %d' % epoch)
+    if args.stream:
+        trainset.set_epoch(epoch)
+    snap.begin(epoch)
+    if args.progressive:
+        input_size = resizing.begin(epoch, trainloader)
+        print(resizing.report(epoch))
     snet.train()
+    snet.set_input_norm(student_input_norm)
     train_loss = 0
     train_cls_loss = 0
     
@@ -224,33 +280,63 @@ def train(epoch):
         utils.set_lr(optimizer, current_lr)  # set the decayed rate
     else:
         current_lr = args.lr
+    if args.progressive:
+        # the learning rate follows the batch size of the epoch
+        current_lr *= resizing.lr_scale(epoch)
+        utils.set_lr(optimizer, current_lr)
     print('learning_rate: %s' % str(current_lr))
 
-    for batch_idx, (img_teacher, img_student, target) in enumerate(trainloader):
+    for batch_idx, batch in enumerate(trainloader):
+        if args.batch_aug:
+            img, target = batch
+            if args.cuda:
+                img = img.cuda(non_blocking=True)
+            img_teacher, img_student = batch_augment(img)
+        else:
+            img_teacher, img_student, target = batch
         if args.cuda:
             img_teacher = img_teacher.cuda()
             img_student = img_student.cuda()
             target = target.cuda()
+        if args.progressive:
+            img_student = resizing.resize(img_student, input_size)
 
         optimizer.zero_grad()
         img_teacher, img_student, target = Variable(img_teacher), Variable(img_student), Variable(target)
         
         rb1_s, rb2_s, rb3_s, mimic_s, out_s = snet(img_student)
-        with torch.no_grad():
-            rb1_t1, rb2_t1, rb3_t1, mimic_t1, out_t1 = tnet1(img_teacher)
-            rb1_t2, rb2_t2, rb3_t2, mimic_t2, out_t2 = tnet2(img_teacher)
-            rb1_t3, rb2_t3, rb3_t3, mimic_t3, out_t3 = tnet3(img_teacher)
-            rb1_t4, rb2_t4, rb3_t4, mimic_t4, out_t4 = tnet4(img_teacher)
+        if args.teacher_cache:
+            # img_teacher holds the cached logits of the replayed crop, one row per teacher
+            out_t1, out_t2, out_t3, out_t4 = img_teacher.float().unbind(1)
+        else:
+            with torch.no_grad():
+                if args.vmap or args.packed:
+                    out_t1, out_t2, out_t3, out_t4 = tnets(img_teacher)[-1].unbind(0)
+                else:
+                    rb1_t1, rb2_t1, rb3_t1, mimic_t1, out_t1 = tnet1(img_teacher)
+                    rb1_t2, rb2_t2, rb3_t2, mimic_t2, out_t2 = tnet2(img_teacher)
+                    rb1_t3, rb2_t3, rb3_t3, mimic_t3, out_t3 = tnet3(img_teacher)
+                    rb1_t4, rb2_t4, rb3_t4, mimic_t4, out_t4 = tnet4(img_teacher)
         
         cls_loss = Cls_crit(out_s, target)
         if args.distillation == 'OurDiversity':
             mimic = (out_t1+out_t2+out_t3+out_t4)/4
-            loss = 0.2 * cls_loss + 0.8 * utils.KL_divergence(temperature = 20).cuda()(mimic,out_s)
+            if args.prune:
+                # per-sample losses: the pruner scores them and reweights the down-sampled images
+                sample_loss = 0.2 * F.cross_entropy(out_s, target, reduction='none') + \
+                              0.8 * utils.KL_divergence(temperature = 20, reduction='none').cuda()(mimic,out_s)
+            else:
+                loss = 0.2 * cls_loss + 0.8 * utils.KL_divergence(temperature = 20).cuda()(mimic,out_s)
         else:
             raise Exception('Invalid distillation name...')
+        if args.prune:
+            indices = train_order.next_batch(len(target))
+            loss = (sample_loss * train_order.weights(indices, sample_loss.device)).mean()
+            train_order.update(indices, (out_t1, out_t2, out_t3, out_t4), target, sample_loss)
         loss.backward()
         utils.clip_gradient(optimizer, 0.1)
         optimizer.step()
+        snap.step(len(target))
         train_loss += loss.item()
         train_cls_loss += cls_loss.item()
         
@@ -268,15 +354,25 @@ def train(epoch):
 #         utils.progress_bar(batch_idx, len(trainloader), 'Loss: %.3f | Acc: %.3f%% | mAP: %.3f%% | F1: %.3f%%'
 #                            % (train_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100.* F1_score))
     
+    if args.prefetch:
+        print(trainloader.report())
+        trainloader.reset_stats()
+    if args.prune:
+        print(train_order.report())
     return train_cls_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
 def test(epoch):
     snet.eval()
+    snet.set_input_norm(test_input_norm)
     PrivateTest_loss = 0
     t_prediction = 0
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
     for batch_idx, (img, target) in enumerate(PrivateTestloader):
         t = time.time()
+        if args.batch_tencrop:
+            if args.cuda:
+                img = img.cuda(non_blocking=True)
+            img = batch_tencrop(img)
         test_bs, ncrops, c, h, w = np.shape(img)
         img = img.view(-1, c, h, w)
         if args.cuda:
@@ -307,7 +403,7 @@ def test(epoch):
   
     return PrivateTest_loss/(batch_idx+1), 100.*acc, 100.* mAP, 100 * F1_score
 
-for epoch in range(1, args.epochs+1):
+for epoch in range(start_epoch, args.epochs+1):
     train_loss, train_acc, train_mAP, train_F1 = train(epoch)
     test_loss, test_acc, test_mAP, test_F1 = test(epoch)
     print("train_loss:  %0.3f, train_acc:  %0.3f, train_mAP:  %0.3f, train_F1:  %0.3f"%
@@ -318,6 +414,8 @@ for epoch in range(1, args.epochs+1):
     writer.add_scalars('epoch/accuracy', {'train': train_acc, 'test': test_acc}, epoch)
     writer.add_scalars('epoch/mAP', {'train': train_mAP, 'test': test_mAP}, epoch)
     writer.add_scalars('epoch/F1', {'train': train_F1, 'test': test_F1}, epoch)
+    if args.prune:
+        writer.add_scalars('epoch/pruning', {'trained': len(train_order.plan), 'solved': train_order.num_solved}, epoch)
     
     if test_acc > best_acc:
         best_acc = test_acc
@@ -336,6 +434,7 @@ for epoch in range(1, args.epochs+1):
             'test_epoch': epoch,
         } 
         torch.save(state, os.path.join(path,'Student_Test_model.t7'))
+    snap.end_epoch(epoch)
 
 print("best_PrivateTest_acc: %0.3f" % best_acc)
 print("best_PrivateTest_mAP: %0.3f" % best_mAP)
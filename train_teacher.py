@@ -17,13 +17,15 @@ import math
 import argparse
 import utils
 import losses
+import snapshot
 from utils import load_pretrained_model
-from datasets.RAF import RAF_multi_teacher
-from datasets.PET import PET_multi_teacher
-from datasets.colorferet import colorferet_multi_teacher
-from datasets.FairFace import FairFace_multi_teacher
+from datasets import store, stats
+from datasets.generic import StoreDataset
+from datasets import augment
+from datasets import loaders
 from torch.autograd import Variable
 from network.teacherNet import Teacher
+from network.ensemble import TeacherEnsemble, PackedTeacher
 from tensorboardX import SummaryWriter
 from utils import ACC_evaluation
 
@@ -39,18 +41,34 @@ parser.add_argument('--direction', default=0, type=float, help='direction')
 parser.add_argument('--variance', default=0, type=float, help='variance')
 parser.add_argument('--num_workers', type=int, default=1, help='num_workers')
 parser.add_argument('--fusion', type=str, default="OurDiversity", help='OurDiversity')
+parser.add_argument('--batch_tencrop', type=int, default=0, help='TenCrop and normalize whole test batches on the device')
+parser.add_argument('--stream', type=int, default=0, help='stream the training set in shards of this many images, 0 samples it at random')
+parser.add_argument('--stream_buffer', type=int, default=4096, help='shuffle buffer of the streamed training set')
+parser.add_argument('--prefetch', type=int, default=0, help='batches staged ahead in pinned buffers, 0 disables the prefetcher')
+parser.add_argument('--shm', type=int, default=0, help='share one copy of the dataset in /dev/shm between concurrent runs')
+parser.add_argument('--eval_cache', type=str, default='', help='uint8 or float16: materialize the TenCrop test tensors once and stream them')
+parser.add_argument('--balanced', type=int, default=0, help='class-balanced batches drawn from the class index of the store')
+parser.add_argument('--samples_per_class', type=int, default=1, help='images per class of the balanced batches, P x K batches when > 1')
+parser.add_argument('--chunked', type=int, default=0, help='read the compressed chunks of build_store.py --pack in block-shuffled order')
+parser.add_argument('--batched', type=int, default=0, help='fetch whole batches with one gather and augment them in the workers')
+parser.add_argument('--uint8_input', type=int, default=0, help='ship uint8 crops and normalize them inside the first convolution')
+parser.add_argument('--resume', type=int, default=0, help='continue from the snapshot.t7 of an interrupted run')
+parser.add_argument('--importance', type=int, default=0, help='draw training images in proportion to their last loss, reweighted to stay unbiased')
+parser.add_argument('--importance_uniform', type=float, default=0.1, help='uniform share of the importance sampling distribution')
+parser.add_argument('--importance_stale', type=int, default=5, help='epochs after which a recorded loss counts as stale')
+parser.add_argument('--progressive', type=float, default=0, help='start training at this fraction of the input size and ramp it up to the full size, 0 disables')
+parser.add_argument('--progressive_end', type=float, default=0.5, help='fraction of the epochs after which the input size is the full one')
+parser.add_argument('--progressive_bs', type=int, default=4, help='largest multiple of --train_bs at low resolution, the learning rate scales with the batch size')
+parser.add_argument('--repeats', type=int, default=1, help='augmented views of every loaded image in the same batch (repeated augmentation), 1 disables')
+parser.add_argument('--vmap', type=int, default=0, help='stack the four teachers and run them as one vectorized forward')
+parser.add_argument('--packed', type=int, default=0, help='pack the four teachers into one network of grouped convolutions')
 args = parser.parse_args()
 
 best_ACC = 0
 learning_rate_decay_start = 80  # 50
 learning_rate_decay_every = 5 # 5
 learning_rate_decay_rate = 0.9 # 0.9
-if args.data_name == 'colorferet':
-    NUM_CLASSES = 994
-elif args.data_name == 'PET':
-    NUM_CLASSES = 37
-else:
-    NUM_CLASSES = 7
+NUM_CLASSES = store.num_classes(args.data_name)
 
 total_epoch = args.epochs
 
@@ -68,92 +86,98 @@ print ('The direction is:                          '+ str(args.direction))
 print ('The variance is:                           '+ str(args.variance))
 print('==> Preparing data..')
 
-if args.data_name == 'RAF':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.5884594, 0.45767313, 0.40865755), 
-                             (0.25717735, 0.23602168, 0.23505741)),
-    ]) 
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.589667, 0.45717254, 0.40727714], std=[0.25235596, 0.23242524, 0.23155019])
-                            (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'PET':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.47950855, 0.4454716, 0.3953508), 
-                      (0.26221144, 0.25676072, 0.2640482)),])
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.486185, 0.45276144, 0.39575183], std=[0.2640792, 0.25989106, 0.26799843])
-               (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'colorferet':
-    transform_train = transforms.Compose([
-        transforms.RandomCrop(92),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.50150657, 0.4387828, 0.37715995), 
-                             (0.22249317, 0.24526535, 0.25831717)),
-    ]) 
-    transform_test = transforms.Compose([
-        transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49930117, 0.43744352, 0.37612754], std=[0.22151423, 0.24302939, 0.2520711])
-                            (transforms.ToTensor()(crop)) for crop in crops])),])
-elif args.data_name == 'FairFace':
+transform_train = transforms.Compose([
+    transforms.RandomCrop(92),
+    transforms.RandomHorizontalFlip(),
+    transforms.ToTensor(),
+    transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher')),
+])
+test_Normalize = transforms.Normalize(*stats.norm_stats(args.data_name, 'teacher_test'))
+transform_test = transforms.Compose([
+    transforms.TenCrop(92),
+    transforms.Lambda(lambda crops: torch.stack([test_Normalize(transforms.ToTensor()(crop)) for crop in crops])),])
+
+if args.uint8_input:
+    # the loaders ship uint8 crops, the networks fold the normalization into conv1
     transform_train = transforms.Compose([
         transforms.RandomCrop(92),
         transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.4911152, 0.36028033, 0.30489963), 
-                             (0.25160596, 0.21829675, 0.21198231)),
-    ]) 
+        transforms.PILToTensor(),
+    ])
     transform_test = transforms.Compose([
         transforms.TenCrop(92),
-        transforms.Lambda(lambda crops: torch.stack([transforms.Normalize(
-            mean=[0.49167913, 0.36098105, 0.30529523], std=[0.24649838, 0.21503104, 0.20875944])
-                            (transforms.ToTensor()(crop)) for crop in crops])),])
-else:
-    raise Exception('Invalid ...')
+        transforms.Lambda(lambda crops: torch.stack([transforms.PILToTensor()(crop) for crop in crops])),])
 
-if args.data_name == 'RAF':
-    trainset = RAF_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = RAF_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'PET':
-    trainset = PET_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = PET_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'colorferet':
-    trainset = colorferet_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = colorferet_multi_teacher(split = 'PrivateTest', transform=transform_test)
-elif args.data_name == 'FairFace':
-    trainset = FairFace_multi_teacher(split = 'Training', transform=transform_train)
-    PrivateTestset = FairFace_multi_teacher(split = 'PrivateTest', transform=transform_test)
-else:
-    raise Exception('Invalid dataset name...')
-trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.train_bs, shuffle=True, num_workers=args.num_workers)
-PrivateTestloader = torch.utils.data.DataLoader(PrivateTestset, batch_size=args.test_bs, shuffle=False, num_workers=args.num_workers)
+if args.batch_tencrop:
+    # the loader ships raw uint8 pixels, test() crops and normalizes the whole batch
+    batch_tencrop = augment.TenCropNormalize(92, test_Normalize.mean, test_Normalize.std)
+    transform_test = None
+
+# --batched: one __getitems__ call per batch instead of one __getitem__ per image
+batch_transform_train = batch_transform_test = None
+if args.batched and not args.uint8_input:
+    # vectorized crop/flip/normalize of the whole batch in the workers instead of the PIL transforms
+    if transform_train is not None:
+        batch_transform_train = augment.CropFlipNormalize(92, *stats.norm_stats(args.data_name, 'teacher'))
+    if transform_test is not None:
+        batch_transform_test = augment.TenCropNormalize(92, test_Normalize.mean, test_Normalize.std)
+
+trainset = StoreDataset(args.data_name, split = 'Training', transform=transform_train, shared=args.shm, chunked=args.chunked, batched=args.batched, batch_transform=batch_transform_train, repeats=args.repeats)
+PrivateTestset = StoreDataset(args.data_name, split = 'PrivateTest', transform=transform_test, shared=args.shm, chunked=args.chunked, batched=args.batched, batch_transform=batch_transform_test)
+# training order, loaders and --eval_cache/--prefetch of the data flags, see datasets.loaders
+trainset, trainloader, train_order, PrivateTestloader = loaders.build_loaders(args, trainset, PrivateTestset, 92, test_Normalize.mean, test_Normalize.std)
+resizing = loaders.progressive_resizing(args, 92)
 
 net1 = Teacher(num_classes=NUM_CLASSES).cuda()
 net2 = Teacher(num_classes=NUM_CLASSES).cuda()
 net3 = Teacher(num_classes=NUM_CLASSES).cuda()
 net4 = Teacher(num_classes=NUM_CLASSES).cuda()
+# (mean, std) folded into conv1 with --uint8_input, None where the batches arrive normalized
+train_input_norm = stats.norm_stats(args.data_name, 'teacher') if args.uint8_input else None
+test_input_norm = test_Normalize.mean, test_Normalize.std
+if not args.uint8_input or args.batch_tencrop or args.eval_cache:
+    test_input_norm = None
 criterion = nn.CrossEntropyLoss().cuda()
 
-optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),net4.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
+if args.vmap or args.packed:
+    # one stacked (--vmap) or packed (--packed) copy of the four teachers trains instead of them; they only
+    # receive its weights to be saved
+    teachers = PackedTeacher.from_teachers((net1, net2, net3, net4)) if args.packed else TeacherEnsemble((net1, net2, net3, net4))
+    for net in (net1, net2, net3, net4):
+        net.cpu()
+    optimizer = optim.SGD(teachers.parameters(), lr=args.lr, momentum=0.9, weight_decay=5e-4)
+else:
+    optimizer = optim.SGD(itertools.chain(net1.parameters(),net2.parameters(),net3.parameters(),net4.parameters()), lr=args.lr, momentum=0.9, weight_decay=5e-4)
+
+# snapshot.t7 after every epoch and on SIGTERM/SIGUSR1 mid-epoch, --resume continues from it
+snap_state = {'Teacher1': net1, 'Teacher2': net2, 'Teacher3': net3, 'Teacher4': net4}
+if args.vmap or args.packed:
+    snap_state = dict(('Teacher%d' % (i + 1), teachers.member(i)) for i in range(4))
+if args.importance:
+    snap_state['train_order'] = train_order
+snap = snapshot.Snapshot(path, snap_state, optimizer, order=train_order, scope=globals(), names=('best_ACC',))
+start_epoch = 0
+if args.resume:
+    start_epoch = snap.load(start_epoch)
 
 # Training
 def train(epoch):
     print('\nEpoch: %d' % epoch)
+    if args.stream:
+        trainset.set_epoch(epoch)
+    snap.begin(epoch)
+    if args.progressive:
+        input_size = resizing.begin(epoch, trainloader)
+        print(resizing.report(epoch))
     net1.train()
     net2.train()
     net3.train()
     net4.train()
+    for net in (net1, net2, net3, net4):
+        net.set_input_norm(train_input_norm)
+    if args.vmap or args.packed:
+        teachers.train()
+        teachers.set_input_norm(train_input_norm)
     train_loss = 0
 
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
@@ -169,19 +193,31 @@ def train(epoch):
         utils.set_lr(optimizer, current_lr)  # set the decayed rate
     else:
         current_lr = args.lr
+    if args.progressive:
+        # the learning rate follows the batch size of the epoch
+        current_lr *= resizing.lr_scale(epoch)
+        utils.set_lr(optimizer, current_lr)
     print('learning_rate: %s' % str(current_lr))
 
     for batch_idx, (inputs, targets) in enumerate(trainloader):
         
         inputs, targets = inputs.cuda(), targets.cuda()
+        if args.progressive:
+            inputs = resizing.resize(inputs, input_size)
         optimizer.zero_grad()
         
         inputs, targets = Variable(inputs), Variable(targets)
         
-        _, _, _, mimic1, outputs1 = net1(inputs)
-        _, _, _, mimic2, outputs2 = net2(inputs)
-        _, _, _, mimic3, outputs3 = net3(inputs)
-        _, _, _, mimic4, outputs4 = net4(inputs)
+        if args.vmap or args.packed:
+            # (4, B, classes) logits of one vectorized forward
+            _, _, _, mimics, outputs = teachers(inputs)
+            mimic1, mimic2, mimic3, mimic4 = mimics.unbind(0)
+            outputs1, outputs2, outputs3, outputs4 = outputs.unbind(0)
+        else:
+            _, _, _, mimic1, outputs1 = net1(inputs)
+            _, _, _, mimic2, outputs2 = net2(inputs)
+            _, _, _, mimic3, outputs3 = net3(inputs)
+            _, _, _, mimic4, outputs4 = net4(inputs)
             
         loss1 = criterion(outputs1, targets)
         loss2 = criterion(outputs2, targets)
@@ -190,15 +226,24 @@ def train(epoch):
         
         if args.fusion == 'OurDiversity':
             mimic = (outputs1+outputs2+outputs3+outputs4)/4
-            loss = criterion(mimic, targets)
-            diversityLoss = losses.Diversity(args.direction, args.variance).cuda()(outputs1,outputs2,outputs3,outputs4,targets)
-            loss = loss + loss1 + loss2 + loss3 + loss4 + diversityLoss
+            if args.importance:
+                # per-sample cross-entropies score the images, the whole per-sample loss is reweighted
+                sample_ce = sum(F.cross_entropy(outputs, targets, reduction='none') for outputs in (mimic, outputs1, outputs2, outputs3, outputs4))
+                sample_loss = sample_ce + losses.Diversity(args.direction, args.variance, reduction='none').cuda()(outputs1,outputs2,outputs3,outputs4,targets)
+                indices = train_order.next_batch(len(targets))
+                loss = (sample_loss * train_order.weights(indices, sample_loss.device)).mean()
+                train_order.update(indices, sample_ce)
+            else:
+                loss = criterion(mimic, targets)
+                diversityLoss = losses.Diversity(args.direction, args.variance).cuda()(outputs1,outputs2,outputs3,outputs4,targets)
+                loss = loss + loss1 + loss2 + loss3 + loss4 + diversityLoss
         else:
             raise Exception('Invalid ...')
         
         loss.backward()
         utils.clip_gradient(optimizer, 0.1)
         optimizer.step()
+        snap.step(len(targets))
         
         train_loss += loss.item()
         
@@ -208,6 +253,11 @@ def train(epoch):
         conf_mat3, acc3, mAP3, F1_score3 = ACC_evaluation(conf_mat3, outputs3, targets, NUM_CLASSES)
         conf_mat4, acc4, mAP4, F1_score4 = ACC_evaluation(conf_mat4, outputs4, targets, NUM_CLASSES)
     
+    if args.prefetch:
+        print(trainloader.report())
+        trainloader.reset_stats()
+    if args.importance:
+        print(train_order.report())
     return train_loss/(batch_idx+1), 100.*acc1, 100.*acc2, 100.*acc3, 100.*acc4, 100.*acc, 100.* mAP, 100 * F1_score
 
 def test(epoch):
@@ -215,6 +265,11 @@ def test(epoch):
     net2.eval()
     net3.eval()
     net4.eval()
+    for net in (net1, net2, net3, net4):
+        net.set_input_norm(test_input_norm)
+    if args.vmap or args.packed:
+        teachers.eval()
+        teachers.set_input_norm(test_input_norm)
     
     conf_mat = np.zeros((NUM_CLASSES, NUM_CLASSES))
     conf_mat1 = np.zeros((NUM_CLASSES, NUM_CLASSES))
@@ -226,16 +281,21 @@ def test(epoch):
 
     for batch_idx, (inputs, targets) in enumerate(PrivateTestloader):
         t = time.time()
+        if args.batch_tencrop:
+            inputs = batch_tencrop(inputs.cuda(non_blocking=True))
         test_bs, ncrops, c, h, w = np.shape(inputs)
         inputs = inputs.view(-1, c, h, w)
         inputs, targets = inputs.cuda(), targets.cuda()
         inputs, targets = Variable(inputs), Variable(targets)
         
         with torch.no_grad():
-            _, _, _, mimic1, outputs1 = net1(inputs)
-            _, _, _, mimic2, outputs2 = net2(inputs)
-            _, _, _, mimic3, outputs3 = net3(inputs)
-            _, _, _, mimic4, outputs4 = net4(inputs)
+            if args.vmap or args.packed:
+                outputs1, outputs2, outputs3, outputs4 = teachers(inputs)[-1].unbind(0)
+            else:
+                _, _, _, mimic1, outputs1 = net1(inputs)
+                _, _, _, mimic2, outputs2 = net2(inputs)
+                _, _, _, mimic3, outputs3 = net3(inputs)
+                _, _, _, mimic4, outputs4 = net4(inputs)
             
         outputs1 = outputs1.view(test_bs, ncrops, -1).mean(1)
         outputs2 = outputs2.view(test_bs, ncrops, -1).mean(1) 
@@ -256,7 +316,7 @@ def test(epoch):
     return PrivateTest_loss/(batch_idx+1), 100.*acc1, 100.*acc2, 100.*acc3, 100.*acc4, 100.*acc, 100.* mAP, 100 * F1_score
 
 
-for epoch in range(0, total_epoch):
+for epoch in range(start_epoch, total_epoch):
     train_loss, train_acc1, train_acc2, train_acc3, train_acc4,train_avgACC, train_avgMAP, train_avgF1 = train(epoch)
     test_loss, test_acc1, test_acc2, test_acc3, test_acc4, test_avgACC, test_avgMAP, test_avgF1 = test(epoch)
     
@@ -282,6 +342,8 @@ for epoch in range(0, total_epoch):
         print("Test_Avg_accuracy: %0.3f" % test_avgACC)
         print("Test_Avg_MAP: %0.3f" % test_avgMAP)
         print("Test_Avg_F1: %0.3f" % test_avgF1)
+        if args.vmap or args.packed:
+            teachers.unstack((net1, net2, net3, net4))
         state = {
             'Teacher1': net1.state_dict(),
             'Teacher2': net2.state_dict(),
@@ -299,6 +361,7 @@ for epoch in range(0, total_epoch):
         if not os.path.isdir(path):
             os.mkdir(path)
         torch.save(state, os.path.join(path,'Best_MultiTeacher_model.t7'))
+    snap.end_epoch(epoch)
 
 print("best_PrivateTest_avgACC: %0.3f" % best_ACC)
 writer.close()
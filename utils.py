@@ -11,6 +11,7 @@ import sys
 import math
 import torch.nn as nn
 import torch.nn.init as init
+import torch.nn.functional as F
 from torch.autograd import Function
 from collections import defaultdict
 from itertools import chain
@@ -117,6 +118,28 @@ class Cutout(object):
 
         return img
 
+
+class BatchCutout(object):
+    """Cutout on a whole (N, C, H, W) batch, one random mask per image.
+    Args:
+        n_holes (int): Number of patches to cut out of each image.
+        length (int): The length (in pixels) of each square patch.
+    """
+    def __init__(self, n_holes, length):
+        self.n_holes = n_holes
+        self.length = length
+
+    def __call__(self, imgs):
+        n, _, h, w = imgs.shape
+        y = torch.randint(h, (n, self.n_holes, 1, 1), device=imgs.device)
+        x = torch.randint(w, (n, self.n_holes, 1, 1), device=imgs.device)
+        rows = torch.arange(h, device=imgs.device).view(1, 1, h, 1)
+        cols = torch.arange(w, device=imgs.device).view(1, 1, 1, w)
+        holes = (rows >= y - self.length // 2) & (rows < y + self.length // 2) & \
+                (cols >= x - self.length // 2) & (cols < x + self.length // 2)
+        mask = (~holes.any(1, keepdim=True)).to(imgs.dtype)
+        return imgs * mask
+
 def mixup_data(x, y, alpha=1.0, use_cuda=True):
     '''Returns mixed inputs, pairs of targets, and lambda'''
     if alpha > 0:
@@ -125,7 +148,7 @@ def mixup_data(x, y, alpha=1.0, use_cuda=True):
         lam = 1
 
     batch_size = x.size()[0]
-    index = torch.randperm(batch_size)
+    index = torch.randperm(batch_size, device=x.device)
 
     mixed_x = lam * x + (1 - lam) * x[index, :]
     y_a, y_b = y, y[index]
@@ -186,11 +209,16 @@ def load_pretrained_model(model, pretrained_dict):
 	model.load_state_dict(model_dict)
 	
 class KL_divergence(nn.Module):
-    def __init__(self, temperature = 1):
+    def __init__(self, temperature = 1, reduction = 'mean'):
         super(KL_divergence, self).__init__()
         self.T = temperature
+        self.reduction = reduction
     def forward(self, teacher_logit, student_logit):
 
+        if self.reduction == 'none':
+            # per-sample terms, their mean is the 'mean' loss
+            KD_loss = nn.KLDivLoss(reduction='none')(F.log_softmax(student_logit/self.T,dim=1), F.softmax(teacher_logit/self.T,dim=1)).mean(1) * self.T * self.T
+            return KD_loss
         KD_loss = nn.KLDivLoss()(F.log_softmax(student_logit/self.T,dim=1), F.softmax(teacher_logit/self.T,dim=1)) * self.T * self.T
 
         return KD_loss